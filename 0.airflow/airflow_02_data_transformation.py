@@ -123,14 +123,18 @@ with DAG(
     # --- Stage C: 向量生成 ---
     stageC_builder = create_cloud_run_task("stageC_builder", "stageC_builder")
     stageC_launcher = create_cloud_run_task("stageC_launcher", "stageC_launcher")
+    stageC_snippet_builder = create_cloud_run_task("stageC_snippet_builder", "stageC_snippet_builder")
+    stageC_snippet_launcher = create_cloud_run_task("stageC_snippet_launcher", "stageC_snippet_launcher")
+    stageC_snippet_parser = create_cloud_run_task("stageC_snippet_parser", "stageC_snippet_parser")
 
     notify_stageC = PythonOperator(
     task_id='notify_stageC_done',
     python_callable=send_line_notification,
-    op_kwargs={'message': '☕ [資料清洗 stage C 已完成]\n已成功為店家與評論生成向量'})
+    op_kwargs={'message': '☕ [資料清洗 stage C 已完成]\n已成功為店家與評論生成向量與推薦短句'})
 
     # --- Stage D: 終極資料庫寫入 ---
     stageD_ingestor = create_cloud_run_task("stageD_ingestor", "stageD_ingestor")
+    stageD_theme_tiles = create_cloud_run_task("stageD_theme_tiles", "stageD_theme_tiles")
 
     notify_stageD = PythonOperator(
     task_id='notify_stageD_done',
@@ -156,6 +160,8 @@ with DAG(
 
     # 5. Stage C 核心流程
     stageB_scenario_aggregator >> notify_stageB >>stageC_builder >> stageC_launcher
+    # 推薦短句只依賴 Stage B 的產出，與向量任務平行跑
+    notify_stageB >> stageC_snippet_builder >> stageC_snippet_launcher >> stageC_snippet_parser
 
     # 6. Stage D 寫入 MongoDB
-    stageC_launcher >> notify_stageC >> stageD_ingestor >> notify_stageD
\ No newline at end of file
+    [stageC_launcher, stageC_snippet_parser] >> notify_stageC >> stageD_ingestor >> stageD_theme_tiles >> notify_stageD
\ No newline at end of file
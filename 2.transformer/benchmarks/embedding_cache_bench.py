@@ -0,0 +1,201 @@
+"""
+[評測] Stage C 向量快取：連續兩週的 embed_builder -> Launcher，第二週只送新 / 改過的文字
+
+用法 (在 2.transformer 目錄下，不需要 GCS / Vertex AI)：
+    python benchmarks/embedding_cache_bench.py
+    python benchmarks/embedding_cache_bench.py --stores 2000 --reviews-per-store 30 --changed-ratio 0.2
+
+以記憶體內的假 bucket 與假 embedding 端點模擬：
+    - 第一週：快取是空的，全部送端點，Launcher 順手把向量寫進快取
+    - 第二週：changed-ratio 比例的評論 / 總結換成新文字，embed_builder 查快取後只把沒命中的交給 Launcher
+檢查兩件事：第二週的 API 呼叫數與快取命中率，以及最終輸出資料夾裡每筆紀錄的向量與「不用快取全部重算」完全一致
+(以 float32 比對：快取命中的向量寫成最短的 float32 十進位表示，數值相同、字串較短)。
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np  # noqa: E402
+from llm_src.utils.embedding_cache import EmbeddingCache, text_key  # noqa: E402
+from llm_src.utils.online_batch_runner import ConcurrentMicroBatchRunner, EMBED_BATCH_SIZE  # noqa: E402
+from llm_src.stageC_embeddin.embed_builder import StageC_Embedding_Processor  # noqa: E402
+
+OUTPUT_FOLDER = "batch_output/embedding_generation/"
+SOURCE_PATH = "transform/stageC/vertex_job_stage_c_embedding.jsonl"
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self.bucket.files
+
+    def upload_from_string(self, data, content_type=None):
+        with self.bucket.lock:
+            self.bucket.files[self.name] = data.encode("utf-8") if isinstance(data, str) else data
+
+    def download_as_bytes(self):
+        return self.bucket.files[self.name]
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.bucket.files[self.name].decode(encoding)
+
+    def delete(self):
+        with self.bucket.lock:
+            self.bucket.files.pop(self.name, None)
+
+
+class FakeBucket:
+    name = "bench"
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        with self.lock:
+            return [FakeBlob(self, n) for n in sorted(self.files) if n.startswith(prefix)]
+
+
+class FakeEmbeddingEndpoint:
+    """向量由文字決定 (同一段文字永遠得到同一個向量)，並以 float32 精度回傳，與真實模型輸出一致"""
+    def __init__(self, dim, latency_sec):
+        self.dim = dim
+        self.latency_sec = latency_sec
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def vector(self, text):
+        rng = np.random.default_rng(int(text_key(text)[:8], 16))
+        return rng.uniform(-0.1, 0.1, self.dim).astype(np.float32).tolist()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        time.sleep(self.latency_sec)
+        return [self.vector(t) for t in texts]
+
+
+def make_week(stores, reviews_per_store, rng, previous=None, changed_ratio=0.0):
+    """回傳 (scored_map, reviews_map)；有 previous 時依 changed_ratio 換掉部分文字"""
+    scored_map, reviews_map = {}, {}
+    for i in range(stores):
+        place_id = f"ChIJ{i:08d}"
+        summary = previous[0][place_id]["content_for_embedding"] if previous else f"第 {i} 家店：安靜有插座，適合工作"
+        if previous and rng.random() < changed_ratio:
+            summary += f" (更新 {rng.random():.6f})"
+        scored_map[place_id] = {"place_name": f"咖啡廳 {i}", "content_for_embedding": summary,
+                                "metadata_for_filtering": {"tags": ["插座"], "feature_scores": {}}}
+        reviews = list(previous[1][place_id]) if previous else [
+            f"店 {i} 的第 {j} 則評論：咖啡好喝、環境舒服，店員很親切" for j in range(reviews_per_store)]
+        for j in range(len(reviews)):
+            if previous and rng.random() < changed_ratio:
+                reviews[j] = f"店 {i} 本週新評論 {rng.random():.6f}：甜點推薦，假日人多"
+        reviews_map[place_id] = reviews
+    return scored_map, reviews_map
+
+
+def run_week(bucket, week, endpoint, use_cache, dim):
+    """embed_builder (查快取) -> Launcher 的併發執行器 (新向量寫回快取)"""
+    scored_map, reviews_map = week
+    bucket.blob("scored.json").upload_from_string(json.dumps(scored_map, ensure_ascii=False))
+
+    processor = StageC_Embedding_Processor.__new__(StageC_Embedding_Processor)
+    processor.bucket = bucket
+    processor.gcs_scored_data_path = "scored.json"
+    processor.gcs_output_path = SOURCE_PATH
+    processor.gcs_embedding_output_folder = OUTPUT_FOLDER
+    processor.max_reviews_per_store = 30
+    processor.min_review_length = 15
+    processor.cache = EmbeddingCache(bucket, "fake-model", dimensionality=dim) if use_cache else None
+    processor._load_raw_reviews = lambda: reviews_map
+
+    start = time.perf_counter()
+    processor.generate_jsonl()
+    build_sec = time.perf_counter() - start
+
+    cache = EmbeddingCache(bucket, "fake-model", dimensionality=dim) if use_cache else None
+
+    def embed(texts):
+        vectors = endpoint(texts)
+        if cache:
+            cache.add(texts, vectors)
+        return vectors
+
+    lines = bucket.files[SOURCE_PATH].decode("utf-8").splitlines()
+    runner = ConcurrentMicroBatchRunner(bucket, OUTPUT_FOLDER, embed, max_rpm=60000, max_concurrency=8)
+    start = time.perf_counter()
+    runner.run(iter(lines), source=f"{SOURCE_PATH}#{time.time_ns()}")
+    if cache:
+        cache.flush()
+    return build_sec, time.perf_counter() - start
+
+
+def collect_vectors(bucket):
+    vectors = {}
+    for name, data in bucket.files.items():
+        if name.startswith(OUTPUT_FOLDER) and "batch_" in name and name.endswith(".jsonl"):
+            for line in data.decode("utf-8").splitlines():
+                record = json.loads(line)
+                vectors[record["custom_id"]] = np.asarray(record["embedding_1536"], dtype=np.float32).tobytes()
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stores", type=int, default=500)
+    parser.add_argument("--reviews-per-store", type=int, default=20)
+    parser.add_argument("--changed-ratio", type=float, default=0.1, help="第二週換掉的文字比例")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="假端點每次呼叫的延遲")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    week1 = make_week(args.stores, args.reviews_per_store, rng)
+    week2 = make_week(args.stores, args.reviews_per_store, rng, previous=week1, changed_ratio=args.changed_ratio)
+    total = args.stores * (1 + args.reviews_per_store)
+    print(f"🧪 {args.stores} 家店 / 每週 {total} 筆文字 | 第二週變動 {args.changed_ratio:.0%} | 每次呼叫 {EMBED_BATCH_SIZE} 筆")
+
+    bucket = FakeBucket()
+    endpoint = FakeEmbeddingEndpoint(args.dim, args.latency_ms / 1000)
+    build_sec, embed_sec = run_week(bucket, week1, endpoint, True, args.dim)
+    print(f"📊 第一週 (空快取)   呼叫 {endpoint.calls:>4} 次 / {endpoint.texts:>6} 筆 | "
+          f"builder {build_sec:5.2f} 秒 | embedding {embed_sec:5.2f} 秒")
+
+    endpoint = FakeEmbeddingEndpoint(args.dim, args.latency_ms / 1000)
+    build_sec, embed_sec = run_week(bucket, week2, endpoint, True, args.dim)
+    cached = collect_vectors(bucket)
+    cache_bytes = sum(len(d) for n, d in bucket.files.items() if n.endswith(".parquet"))
+    print(f"📊 第二週 (有快取)   呼叫 {endpoint.calls:>4} 次 / {endpoint.texts:>6} 筆 | "
+          f"builder {build_sec:5.2f} 秒 | embedding {embed_sec:5.2f} 秒 | 命中率 {1 - endpoint.texts / total:.1%} | "
+          f"快取 {cache_bytes / 1024 / 1024:.1f} MB")
+
+    baseline_bucket = FakeBucket()
+    baseline = FakeEmbeddingEndpoint(args.dim, args.latency_ms / 1000)
+    build_sec, embed_sec = run_week(baseline_bucket, week2, baseline, False, args.dim)
+    print(f"📊 第二週 (不用快取) 呼叫 {baseline.calls:>4} 次 / {baseline.texts:>6} 筆 | "
+          f"builder {build_sec:5.2f} 秒 | embedding {embed_sec:5.2f} 秒")
+
+    expected = collect_vectors(baseline_bucket)
+    same = cached == expected
+    print(f"💰 省下 {baseline.calls - endpoint.calls} 次呼叫 ({1 - endpoint.calls / baseline.calls:.0%}) | "
+          f"輸出 {len(cached)} 筆向量與全部重算一致 {'✅' if same else '❌'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
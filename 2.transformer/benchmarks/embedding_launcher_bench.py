@@ -0,0 +1,180 @@
+"""
+[評測] Embedding 即時引擎：舊版循序流程 vs ConcurrentMicroBatchRunner (token bucket + AIMD 併發)
+
+用法 (在 2.transformer 目錄下，不需要 GCS / Vertex AI)：
+    python benchmarks/embedding_launcher_bench.py
+    python benchmarks/embedding_launcher_bench.py --records 4000 --latency-ms 300 --quota-rpm 600 1200 2400
+
+以假的 embedding 端點 (每次呼叫固定延遲 + 滑動視窗配額，超過就丟 "429 RESOURCE_EXHAUSTED") 與記憶體內的假 bucket 分別跑：
+    - legacy    : 一次一批、每批後 sleep 1 秒 (原 OnlineMicroBatchLauncher 的流程)
+    - concurrent: ConcurrentMicroBatchRunner，配額提高時吞吐量應跟著上升，遇到 429 自動降速
+最後模擬中途失敗，確認續跑只補做進度清單上沒有的分片，且輸出與一次跑完相同。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_src.utils.online_batch_runner as runner_module  # noqa: E402
+from llm_src.utils.online_batch_runner import ConcurrentMicroBatchRunner  # noqa: E402
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self.bucket.files
+
+    def upload_from_string(self, data, content_type=None):
+        with self.bucket.lock:
+            self.bucket.files[self.name] = data
+
+    def download_as_bytes(self):
+        data = self.bucket.files[self.name]
+        return data.encode("utf-8") if isinstance(data, str) else data
+
+    def delete(self):
+        with self.bucket.lock:
+            self.bucket.files.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        with self.lock:
+            return [FakeBlob(self, n) for n in sorted(self.files) if n.startswith(prefix)]
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class FakeEmbeddingEndpoint:
+    """每次呼叫 sleep latency 秒；任意 1 秒視窗內超過 quota_rpm / 60 次就回 429 (把每分鐘配額攤到每秒，評測才跑得短)"""
+    def __init__(self, latency_sec, quota_rpm, fail_after=None):
+        self.latency_sec = latency_sec
+        self.quota_rpm = quota_rpm
+        self.fail_after = fail_after
+        self.calls = 0
+        self.throttled = 0
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 1.0:
+                self._window.popleft()
+            if len(self._window) >= self.quota_rpm / 60:
+                self.throttled += 1
+                raise QuotaExceeded("429 RESOURCE_EXHAUSTED: Quota exceeded for aiplatform.googleapis.com")
+            self._window.append(now)
+            self.calls += 1
+            if self.fail_after is not None and self.calls > self.fail_after:
+                raise ValueError("模擬的非限流錯誤 (例如輸入過長)")
+        time.sleep(self.latency_sec)
+        return [[float(len(t)), 0.5] for t in texts]
+
+
+def make_lines(records):
+    return [json.dumps({"custom_id": f"place_{i}", "content": f"咖啡好喝 {i}"}, ensure_ascii=False) + "\n"
+            for i in range(records)]
+
+
+def run_legacy(lines, endpoint, bucket, batch_size, sleep_sec):
+    """原本的循序流程：一次一批，每批後固定 sleep"""
+    batch, index = [], 0
+    for line in lines + [None]:
+        if line is not None:
+            batch.append(json.loads(line))
+        if batch and (len(batch) == batch_size or line is None):
+            vectors = endpoint([r["content"] for r in batch])
+            payload = [json.dumps({**r, "embedding_1536": v}, ensure_ascii=False) for r, v in zip(batch, vectors)]
+            bucket.blob(f"out/batch_{index:05d}.jsonl").upload_from_string("\n".join(payload) + "\n")
+            time.sleep(sleep_sec)
+            index, batch = index + 1, []
+
+
+def outputs(bucket):
+    return {n: d for n, d in bucket.files.items() if n.endswith(".jsonl")}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=1500)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="假端點每次呼叫的延遲")
+    parser.add_argument("--quota-rpm", type=int, nargs="+", default=[300, 600, 1200], help="假端點的每分鐘配額")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--legacy-sleep", type=float, default=1.0, help="舊流程每批後的 sleep 秒數")
+    args = parser.parse_args()
+
+    # 評測時縮短清單寫回間隔 (退避由 base_backoff_sec 縮短)，數字才不會被等待時間主導
+    runner_module.EMBED_MANIFEST_FLUSH_SEC = 0.2
+    lines = make_lines(args.records)
+    batches = -(-args.records // args.batch_size)
+    latency = args.latency_ms / 1000
+    print(f"🧪 {args.records} 筆 / {batches} 個分片 | 端點延遲 {args.latency_ms:g} ms")
+
+    bucket = FakeBucket()
+    start = time.perf_counter()
+    run_legacy(lines, FakeEmbeddingEndpoint(latency, max(args.quota_rpm)), bucket, args.batch_size, args.legacy_sleep)
+    legacy_sec = time.perf_counter() - start
+    reference = outputs(bucket)
+    print(f"📊 legacy     {'-':>10} | {legacy_sec:6.2f} 秒 | {args.records / legacy_sec:7.1f} 筆/秒")
+
+    for quota in args.quota_rpm:
+        bucket = FakeBucket()
+        endpoint = FakeEmbeddingEndpoint(latency, quota)
+        # 送出速率故意設成配額的兩倍，讓 AIMD 真的撞到 429 並自行退回
+        runner = ConcurrentMicroBatchRunner(bucket, "out/", endpoint, batch_size=args.batch_size,
+                                            max_rpm=quota * 2, max_concurrency=args.max_concurrency,
+                                            base_backoff_sec=0.2)
+        stats = runner.run(iter(lines), source="bench#1")
+        same = outputs(bucket) == reference
+        print(f"📊 concurrent 配額 {quota:>5} RPM | {stats['seconds']:6.2f} 秒 | {stats['records_per_sec']:7.1f} 筆/秒 | "
+              f"429 {endpoint.throttled:>3} 次 | 併發上限最高 {stats['limiter_peak_limit']:>2} | "
+              f"輸出一致 {'✅' if same else '❌'}")
+        if not same:
+            sys.exit(1)
+
+    # 斷點續傳：第一輪在部分分片後失敗，第二輪只補跑清單上沒有的分片
+    bucket = FakeBucket()
+    bucket.blob("out/batch_99999.jsonl").upload_from_string("舊版留下的過期分片\n")
+    first = ConcurrentMicroBatchRunner(bucket, "out/", FakeEmbeddingEndpoint(latency, 10 ** 6, fail_after=batches // 2),
+                                       batch_size=args.batch_size, max_retries=1, max_rpm=6000)
+    try:
+        first.run(iter(lines), source="bench#1")
+    except RuntimeError:
+        pass
+    done = len(json.loads(bucket.files["out/_manifest.json"])["completed"])
+    endpoint = FakeEmbeddingEndpoint(latency, 10 ** 6)
+    stats = ConcurrentMicroBatchRunner(bucket, "out/", endpoint, batch_size=args.batch_size,
+                                       max_rpm=6000).run(iter(lines), source="bench#1")
+    resumed_ok = stats["skipped"] == done and endpoint.calls == batches - done
+    print(f"♻️ 續跑: 第一輪完成 {done} 個分片後中止，第二輪跳過 {stats['skipped']} 個、補跑 {endpoint.calls} 個 "
+          f"{'✅' if resumed_ok else '❌'}")
+
+    # 來源檔換了 (generation 不同)：清單作廢、整批重跑並清掉過期分片
+    stats = ConcurrentMicroBatchRunner(bucket, "out/", FakeEmbeddingEndpoint(latency, 10 ** 6),
+                                       batch_size=args.batch_size, max_rpm=6000).run(iter(lines), source="bench#2")
+    rebuilt_ok = stats["skipped"] == 0 and outputs(bucket) == reference
+    print(f"🔄 來源變更: 重跑 {stats['batches']} 個分片，過期分片已清除 {'✅' if rebuilt_ok else '❌'}")
+    if not (resumed_ok and rebuilt_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+[評測] Stage D 向量分片匯入：舊版循序流程 vs ParallelShardIngestor 三段式管線
+
+用法 (在 2.transformer 目錄下，不需要 GCS / MongoDB)：
+    python benchmarks/ingest_pipeline_bench.py
+    python benchmarks/ingest_pipeline_bench.py --shards 16 --lines 500 --write-latency-ms 50
+
+先在暫存資料夾產生假的 batch_*.jsonl 分片 (1536 維向量，店家與評論各半)，
+以模擬的 GCS blob (依頻寬限速) 與模擬的 MongoDB 集合 (每次 bulk_write 固定延遲 + 每筆成本) 分別跑：
+    - legacy  : 逐一下載到暫存檔 -> 逐行解析 -> 同一條執行緒每 500 筆 bulk_write (原 process_and_upload 的流程)
+    - pipeline: ParallelShardIngestor (串流 / 解析 / 寫入 三段並行，段間有上限佇列)
+兩種模式各自在獨立的子行程執行，峰值記憶體 (ru_maxrss) 才不會互相污染。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_src.stageD_ingestion.ingest_pipeline import ParallelShardIngestor, peak_rss_mb  # noqa: E402
+
+
+class FakeReader:
+    """依頻寬限速的串流讀取 (模擬 blob.open)"""
+    def __init__(self, path, bytes_per_sec):
+        self.f = open(path, "r", encoding="utf-8")
+        self.bytes_per_sec = bytes_per_sec
+
+    def __iter__(self):
+        for line in self.f:
+            time.sleep(len(line) / self.bytes_per_sec)
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+class FakeBlob:
+    def __init__(self, path, bytes_per_sec):
+        self.name = f"batch_output/embeddings/{os.path.basename(path)}"
+        self.path = path
+        self.bytes_per_sec = bytes_per_sec
+
+    def open(self, mode="r", encoding="utf-8"):
+        return FakeReader(self.path, self.bytes_per_sec)
+
+    def download_to_filename(self, filename):
+        time.sleep(os.path.getsize(self.path) / self.bytes_per_sec)
+        shutil.copyfile(self.path, filename)
+
+
+class FakeCollection:
+    """bulk_write 的網路來回以 sleep 模擬 (與真實 I/O 一樣會釋放 GIL)"""
+    def __init__(self, latency_sec, per_doc_sec):
+        self.latency_sec = latency_sec
+        self.per_doc_sec = per_doc_sec
+        self.docs = 0
+        self._lock = threading.Lock()
+
+    def bulk_write(self, ops, ordered=True):
+        time.sleep(self.latency_sec + self.per_doc_sec * len(ops))
+        with self._lock:
+            self.docs += len(ops)
+
+
+def parse_line(line, where=None):
+    """與 MongoFinalIngestor._line_to_ops 相同的工作量：解析 JSON、取出向量、組裝文件"""
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return []
+    vector = data.get("embedding_1536")
+    if not vector:
+        return []
+    if data.get("doc_type") == "store_level":
+        doc = {"place_id": data["custom_id"], "vector": vector, "summary": data.get("content", "")}
+        return [("store", doc)]
+    doc = {"doc_id": data["custom_id"], "place_id": data.get("parent_place_id"),
+           "content": data.get("content", ""), "embedding": vector, "doc_type": "review_level"}
+    return [("review", doc)]
+
+
+def generate_shards(folder, shards, lines, seed):
+    rng = random.Random(seed)
+    paths = []
+    for s in range(shards):
+        path = os.path.join(folder, f"batch_{s:05d}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(lines):
+                place_id = f"place_{s}_{i // 6}"
+                if i % 6 == 0:
+                    record = {"custom_id": place_id, "doc_type": "store_level", "content": "安靜有插座" * 20}
+                else:
+                    record = {"custom_id": f"{place_id}_rev_{i % 6 - 1}", "parent_place_id": place_id,
+                              "doc_type": "review_level", "content": "咖啡好喝" * 15}
+                record["embedding_1536"] = [round(rng.uniform(-0.1, 0.1), 6) for _ in range(1536)]
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        paths.append(path)
+    return paths
+
+
+def run_legacy(blobs, collections, batch_size):
+    ops = {target: [] for target in collections}
+    for idx, blob in enumerate(blobs):
+        local_path = os.path.join(tempfile.gettempdir(), f"vector_read_{idx}_{os.getpid()}.jsonl")
+        blob.download_to_filename(local_path)
+        with open(local_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                for target, op in parse_line(line):
+                    ops[target].append(op)
+                    if len(ops[target]) >= batch_size:
+                        collections[target].bulk_write(ops[target])
+                        ops[target] = []
+        os.remove(local_path)
+    for target, buf in ops.items():
+        if buf:
+            collections[target].bulk_write(buf)
+
+
+def run_mode(args):
+    paths = sorted(os.path.join(args.data_dir, n) for n in os.listdir(args.data_dir) if n.startswith("batch_"))
+    bytes_per_sec = args.download_mbps * 1024 * 1024
+    blobs = [FakeBlob(p, bytes_per_sec) for p in paths]
+    collections = {target: FakeCollection(args.write_latency_ms / 1000, args.per_doc_us / 1e6)
+                   for target in ("store", "review")}
+
+    start = time.perf_counter()
+    if args.mode == "legacy":
+        run_legacy(blobs, collections, args.batch_size)
+    else:
+        ParallelShardIngestor(collections, batch_size=args.batch_size).run(blobs, parse_line)
+    elapsed = time.perf_counter() - start
+    docs = sum(c.docs for c in collections.values())
+    print(json.dumps({"docs": docs, "seconds": elapsed, "peak_rss_mb": peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=300, help="每個分片幾行")
+    parser.add_argument("--download-mbps", type=float, default=50.0, help="模擬 GCS 下載頻寬 (MB/s)")
+    parser.add_argument("--write-latency-ms", type=float, default=30.0, help="每次 bulk_write 的來回延遲")
+    parser.add_argument("--per-doc-us", type=float, default=200.0, help="每筆文件的寫入成本 (微秒)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=["legacy", "pipeline"], help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    data_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    try:
+        paths = generate_shards(data_dir, args.shards, args.lines, args.seed)
+        total_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+        print(f"🧪 {args.shards} 個分片 x {args.lines} 行 (共 {total_mb:.1f} MB) | 頻寬 {args.download_mbps:g} MB/s | "
+              f"bulk_write 延遲 {args.write_latency_ms:g} ms + {args.per_doc_us:g} µs/筆")
+        results = {}
+        for mode in ("legacy", "pipeline"):
+            cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--data-dir", data_dir]
+            for flag in ("download_mbps", "write_latency_ms", "per_doc_us", "batch_size"):
+                cmd += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+            r = results[mode]
+            print(f"📊 {mode:<9} {r['docs']} 筆 | {r['seconds']:6.2f} 秒 | {r['docs'] / r['seconds']:8.1f} docs/sec | "
+                  f"峰值記憶體 {r['peak_rss_mb']} MB")
+        old, new = results["legacy"], results["pipeline"]
+        if old["docs"] != new["docs"]:
+            print(f"❌ 寫入筆數不一致: legacy {old['docs']} vs pipeline {new['docs']}")
+            sys.exit(1)
+        print(f"🚀 吞吐量 {old['seconds'] / new['seconds']:.1f}x")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+[評測] Stage A 批次 JSONL：每行塞完整系統指令 (舊) vs request 層級 systemInstruction + 精簡設定表 (新)
+
+用法 (在 2.transformer 目錄下，不需要 GCS / Vertex AI)：
+    python benchmarks/stageA_payload_bench.py
+    python benchmarks/stageA_payload_bench.py --stores 3000 --reviews-per-store 50 --cold-ratio 0.1
+
+以記憶體內的假 bucket 跑真正的 StageA_OneStop_Processor.generate_jsonl()，
+舊版則換回改版前的 prompt 與 baseline 序列化、把系統指令併進 user 內容，比較：
+    - JSONL 檔案大小
+    - 估算輸入 token (utils/token_budget.estimate_tokens)：系統指令 / 店家內容 / 合計
+token 為粗估值，實際計費以 Vertex AI 回報的 usageMetadata 為準。
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd  # noqa: E402
+from configs import tag_config as tc  # noqa: E402
+from llm_src.utils.token_budget import estimate_tokens  # noqa: E402
+from llm_src.stageA_extraction.A_StageA_Processor import StageA_OneStop_Processor  # noqa: E402
+
+OUTPUT_PATH = "transform/stageA/vertex_job_stageA_bench.jsonl"
+REVIEW_POOL = ["咖啡好喝，拿鐵奶泡很綿密", "插座很多，適合帶筆電來工作", "假日人很多有點吵，平日下午很安靜",
+               "店貓超可愛會來蹭人", "甜點普通但手沖單品很有水準", "有限時 90 分鐘，低消一杯飲料",
+               "wifi 很穩，可以開視訊會議", "老宅改建，採光很好", "店員很親切，會主動介紹豆子", "冷氣很強記得帶外套"]
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        with self.bucket.lock:
+            self.bucket.files[self.name] = data.encode("utf-8") if isinstance(data, str) else data
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.bucket.files[self.name].decode(encoding)
+
+
+class FakeBucket:
+    name = "bench"
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+# ==========================================
+# 改版前的 prompt (僅供對照，內容照抄)
+# ==========================================
+def legacy_system_instruction():
+    feature_def = json.dumps(tc.FEATURE_DEFINITION, ensure_ascii=False)
+    norm_rules = json.dumps(tc.NORM_RULES, ensure_ascii=False)
+    cat_map_context = json.dumps(tc.CAT_MAP, ensure_ascii=False)
+
+    return f"""
+[ROLE] Lead Data Auditor. Audit [OFFICIAL_BASELINE] against [USER_REVIEWS].
+
+[SCHEMA REGISTRY (CRITICAL)]
+1. [features] 所有的 Key 必須嚴格對應 {{feature_def}} 中的英文 ID。
+2. [official_tags_audit] 必須依照 {cat_map_context} 的分類進行歸納，內容為繁體中文標籤。
+
+[LANGUAGE RULE]
+- JSON Keys: 必須維持英文（不可翻譯）。
+- JSON Values: 所有內容、理由、證據、總結必須使用 **繁體中文**。
+
+[CONFIG] 
+- Feature Definition: {feature_def}
+- Category Map: {cat_map_context}
+- Norm Rules: {norm_rules}
+
+[TASK]
+1. **Feature Logic Audit**: 
+   - 根據 {{feature_def}} 更新 `features` 狀態。
+   - TRUE: 評論證實存在 | FALSE: 評論證實不存在 | NULL: 未提及。
+2. **Official Tags Grouping**: 
+   - 根據評論提到的關鍵字，參考 {cat_map_context} 的分類，將其歸類到 `official_tags_audit`。
+3. **Evidence & Analysis**: 
+   - `conflict_alerts`: 記錄官方與現實不符的理由。
+   - `evidence_map`: 針對 `features` 的 **英文 Key** 提供 20 字內原始節錄。
+
+[OUTPUT SCHEMA (Strict JSON)]
+{{
+  "audit_results": {{
+    "audit_summary": {{ "total_reviews": 50, "overall_vibe": "繁體中文總結" }},
+    "official_tags_audit": {{
+        "atmosphere": ["安靜", "氛圍舒適"],
+        "facilities": ["洗手間", "插座"],
+        "..." : "依照 CAT_MAP 的英文分類填入對應的繁體中文標籤"
+    }},
+    "features": {{
+        "has_wifi": Boolean or Null,
+        "is_quiet": Boolean or Null,
+        "..." : "必須使用 feature_def 中的英文 ID，嚴禁中文 Key"
+    }},
+    "conflict_alerts": [
+      {{
+        "key": "英文代碼",
+        "official_claim": "String",
+        "reality_check": "String",
+        "reason": "繁體中文分析理由",
+        "consensus_level": 5,
+        "sentiment": -1
+      }}
+    ],
+    "new_incremental_features": [
+      {{
+        "feature_name": "繁體中文標籤",
+        "raw_keywords": ["關鍵字"],
+        "evidence": "20-30字評論節錄",
+        "frequency": "High/Low"
+      }}
+    ],
+    "evidence_map": {{ 
+        "英文代碼": "20字內原始評論精華" 
+    }}
+  }}
+}}
+"""
+
+
+def make_data(stores, reviews_per_store, cold_ratio, rng):
+    """官方基準 (tag_processor 的輸出形狀) 與 Stage 0 蒸餾後的評論表"""
+    feature_ids = [fid for fid, _ in tc.FEATURE_DEFINITION.values()]
+    categories = list(tc.CAT_MAP.values())
+    baseline, rows = [], []
+    for i in range(stores):
+        place_id = f"ChIJ{i:08d}"
+        baseline.append({
+            "place_id": place_id,
+            "name": f"咖啡廳 {i}",
+            "official_tags": {c: rng.sample(list(tc.NORM_RULES), 2) for c in rng.sample(categories, 4)},
+            "features": {f: rng.choice([True, False, None]) for f in rng.sample(feature_ids, 20)},
+        })
+        if rng.random() < cold_ratio:
+            continue
+        for j in range(reviews_per_store):
+            text = "，".join(rng.sample(REVIEW_POOL, rng.randint(1, 4)))
+            rows.append({"place_id": place_id, "place_name": f"咖啡廳 {i}", "content": f"{text} ({j})"})
+    return baseline, pd.DataFrame(rows, columns=["place_id", "place_name", "content"])
+
+
+def build(baseline, reviews, legacy):
+    bucket = FakeBucket()
+    bucket.blob("baseline.json").upload_from_string(json.dumps(baseline, ensure_ascii=False))
+    processor = StageA_OneStop_Processor.__new__(StageA_OneStop_Processor)
+    processor.bucket = bucket
+    processor.gcs_baseline_path = "baseline.json"
+    processor.gcs_output_path = OUTPUT_PATH
+    processor.official_map = {}
+    processor._load_data = lambda: reviews
+    if legacy:
+        processor._build_system_instruction = legacy_system_instruction
+        processor.compact_baseline = lambda b: json.dumps(b, ensure_ascii=False)
+    processor.generate_jsonl()
+
+    lines = bucket.files[OUTPUT_PATH].decode("utf-8").splitlines()
+    instruction_tokens = user_tokens = 0
+    output = []
+    for line in lines:
+        item = json.loads(line)
+        request = item["request"]
+        instruction = request.pop("systemInstruction")["parts"][0]["text"]
+        user = request["contents"][0]["parts"][0]
+        if legacy:
+            # 改版前：系統指令與店家內容併成同一段 user 文字
+            user["text"] = f"System Instruction:\n{instruction}\n\nUser Content:\n{user['text']}"
+        else:
+            request["systemInstruction"] = {"parts": [{"text": instruction}]}
+        instruction_tokens += estimate_tokens(instruction)
+        user_tokens += estimate_tokens(user["text"]) - (estimate_tokens(instruction) if legacy else 0)
+        output.append(json.dumps(item, ensure_ascii=False))
+    size = len("\n".join(output).encode("utf-8"))
+    return size, instruction_tokens, user_tokens, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--reviews-per-store", type=int, default=30)
+    parser.add_argument("--cold-ratio", type=float, default=0.05, help="沒有評論的店家比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    baseline, reviews = make_data(args.stores, args.reviews_per_store, args.cold_ratio, random.Random(args.seed))
+    print(f"🧪 {args.stores} 家店 / {len(reviews)} 則評論 | 冷啟動 {args.cold_ratio:.0%}")
+
+    results = {}
+    for label, legacy in (("舊版", True), ("新版", False)):
+        size, instruction, user, count = build(baseline, reviews, legacy)
+        results[label] = (size, instruction + user)
+        print(f"📊 {label} {count} 行 | 檔案 {size / 1024 / 1024:7.2f} MB | 系統指令 {instruction:>10,} tokens | "
+              f"店家內容 {user:>10,} tokens | 合計 {instruction + user:>10,} tokens")
+
+    (old_size, old_tokens), (new_size, new_tokens) = results["舊版"], results["新版"]
+    print(f"💰 檔案 -{1 - new_size / old_size:.1%} ({(old_size - new_size) / 1024 / 1024:.2f} MB) | "
+          f"輸入 token -{1 - new_tokens / old_tokens:.1%} ({old_tokens - new_tokens:,} tokens) | "
+          f"每店平均 {old_tokens // args.stores:,} -> {new_tokens // args.stores:,} tokens")
+
+
+if __name__ == "__main__":
+    main()
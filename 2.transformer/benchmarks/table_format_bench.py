@@ -0,0 +1,165 @@
+"""
+[評測] Stage 之間交接表格：CSV vs Parquet (table_io.write_table / read_table)
+
+用法 (在 2.transformer 目錄下，不需要 GCS)：
+    python benchmarks/table_format_bench.py
+    python benchmarks/table_format_bench.py --cafes 5000 --reviews-per-cafe 50
+
+產生兩張與正式資料同形狀的假表：
+    - reviews_top50_distilled : 每家店 Top N 評論 (長文字 + 品質分數)
+    - cafes_with_scenarios_final : 特徵分數 + 四大情境分數 + 驚喜標籤 list
+分別寫成 CSV 與 Parquet，比較檔案大小，以及下游實際的讀法 (全讀 / 只讀需要的欄位) 的讀取時間與峰值記憶體。
+CSV 的讀取時間包含把標籤字串 literal_eval 回 list，與下游拿到的型別一致。
+每次讀取在獨立的子行程執行，峰值記憶體 (Linux 的 VmHWM) 扣掉載入套件後的基準值。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd  # noqa: E402
+from llm_src.utils.table_io import read_table, write_table, DISTILLED_REVIEWS_SCHEMA, SCENARIO_SCHEMA  # noqa: E402
+
+TAG_POOL = ["店貓", "甜點", "插座", "安靜", "不限時", "寵物友善", "戶外座位", "手沖", "插畫", "老宅", "景觀", "深夜營業"]
+FEATURES = [f"feature_{i:02d}" for i in range(40)]
+
+# 下游各自只讀的欄位 (對應 embed_builder / A_StageA_Processor / reason_snippet_builder)
+READS = {
+    "reviews": {"全讀": None, "投影 (place_id, content, quality_score)": ["place_id", "content", "quality_score"]},
+    "scenarios": {"全讀": None, "投影 (place_id + 4 個標籤欄)": ["place_id"] + [f"tags_score_{t}" for t in
+                                                                           ("workspace", "dating", "pet_friendly", "relax")]},
+}
+SCHEMAS = {"reviews": DISTILLED_REVIEWS_SCHEMA, "scenarios": SCENARIO_SCHEMA}
+
+
+class LocalBucket:
+    """以本機資料夾模擬 GCS bucket，只實作 table_io 用到的方法"""
+    def __init__(self, root):
+        self.root = root
+
+    def blob(self, path):
+        return LocalBlob(os.path.join(self.root, path))
+
+
+class LocalBlob:
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def upload_from_string(self, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def download_as_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def make_tables(cafes, reviews_per_cafe, seed):
+    rng = random.Random(seed)
+    reviews = pd.DataFrame([{
+        "place_id": f"ChIJ{i:08d}",
+        "place_name": f"咖啡廳 {i}",
+        "content": "".join(rng.choices("咖啡好喝環境安靜店員親切有插座適合久坐甜點推薦", k=rng.randint(30, 250))),
+        "full_date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "reviewer_level": rng.randint(1, 10),
+        "reviewer_amount": rng.randint(1, 500),
+        "quality_score": rng.random(),
+    } for i in range(cafes) for _ in range(reviews_per_cafe)])
+
+    rows = []
+    for i in range(cafes):
+        row = {"place_id": f"ChIJ{i:08d}", "place_name": f"咖啡廳 {i}"}
+        row.update({f: round(rng.random(), 3) for f in FEATURES})
+        for theme in ("workspace", "dating", "pet_friendly", "relax"):
+            row[f"score_{theme}"] = round(rng.random() * 5, 3)
+            row[f"tags_score_{theme}"] = rng.sample(TAG_POOL, rng.randint(0, 4))
+        rows.append(row)
+    return {"reviews": reviews, "scenarios": pd.DataFrame(rows)}
+
+
+def peak_memory_mb():
+    """行程的峰值常駐記憶體。不用 ru_maxrss：它會跨 exec 繼承父行程的高水位，子行程量不準"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_read(args):
+    baseline = peak_memory_mb()
+    bucket = LocalBucket(args.data_dir)
+    columns = json.loads(args.columns) if args.columns else None
+    start = time.perf_counter()
+    df = read_table(bucket, args.path, columns=columns, schema=SCHEMAS[args.table])
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "rows": len(df), "rss_mb": round(peak_memory_mb() - baseline, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cafes", type=int, default=3000)
+    parser.add_argument("--reviews-per-cafe", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--read", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--table", help=argparse.SUPPRESS)
+    parser.add_argument("--columns", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.read:
+        run_read(args)
+        return
+
+    data_dir = tempfile.mkdtemp(prefix="table_bench_")
+    try:
+        bucket = LocalBucket(data_dir)
+        tables = make_tables(args.cafes, args.reviews_per_cafe, args.seed)
+        print(f"🧪 {args.cafes} 家店 | 評論 {len(tables['reviews'])} 筆 | 情境表 {len(tables['scenarios'])} 筆")
+        for name, df in tables.items():
+            paths = {fmt: f"{name}.{fmt}" for fmt in ("csv", "parquet")}
+            sizes = {}
+            for fmt, path in paths.items():
+                start = time.perf_counter()
+                write_table(bucket, path, df, SCHEMAS[name])
+                sizes[fmt] = os.path.getsize(os.path.join(data_dir, path)) / 1024 / 1024
+                print(f"💾 {name:<9} {fmt:<7} {sizes[fmt]:7.2f} MB (寫入 {time.perf_counter() - start:.2f} 秒)")
+
+            for label, columns in READS[name].items():
+                results = {}
+                for fmt, path in paths.items():
+                    cmd = [sys.executable, os.path.abspath(__file__), "--read", "--data-dir", data_dir,
+                           "--path", path, "--table", name]
+                    if columns:
+                        cmd += ["--columns", json.dumps(columns)]
+                    out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+                    results[fmt] = json.loads(out.strip().splitlines()[-1])
+                csv, parquet = results["csv"], results["parquet"]
+                print(f"📊 {name:<9} {label:<40} CSV {csv['seconds']:6.3f} 秒 / +{csv['rss_mb']:6.1f} MB | "
+                      f"Parquet {parquet['seconds']:6.3f} 秒 / +{parquet['rss_mb']:6.1f} MB | "
+                      f"{csv['seconds'] / parquet['seconds']:.1f}x")
+
+        # 型別一致性：兩種格式讀回來的標籤欄都是 list
+        csv_tags = read_table(bucket, "scenarios.csv", ["tags_score_workspace"], SCENARIO_SCHEMA)["tags_score_workspace"]
+        pq_tags = read_table(bucket, "scenarios.parquet", ["tags_score_workspace"], SCENARIO_SCHEMA)["tags_score_workspace"]
+        same = csv_tags.tolist() == pq_tags.tolist() == tables["scenarios"]["tags_score_workspace"].tolist()
+        print(f"🔍 標籤欄讀回一致: {'✅' if same else '❌'}")
+        if not same:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
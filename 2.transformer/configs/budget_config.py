@@ -0,0 +1,45 @@
+# budget_config.py
+# 全管線的工作量預算：每家店的評論配額與 LLM prompt 的 token 預算集中在這裡，
+# Stage 0 / A / C / D 都從這裡讀，上游不再產生下游用不到的資料。
+# 所有數值都可用同名環境變數覆寫 (Cloud Run Job 不必重新打包)。
+import os
+from dotenv import load_dotenv
+
+# 各模組 import 本檔時還沒執行自己的 load_dotenv()，這裡先載入 .env 才讀得到覆寫值
+load_dotenv()
+
+# ==========================================
+# 第一層：每家店的評論配額 (依品質分數排序取前 N 則)
+# ==========================================
+# Stage D 最終寫入 MongoDB 的評論數；Stage C 只需要替這些評論算向量
+# (沿用舊的 MAX_REVIEWS_PER_CAFE 環境變數)
+REVIEWS_PER_STORE_SERVED = int(os.getenv("MAX_REVIEWS_PER_CAFE", 5))
+REVIEWS_PER_STORE_EMBED = REVIEWS_PER_STORE_SERVED
+
+# Stage A 審計時餵給 LLM 的評論數 (再受下方 token 預算截斷)
+REVIEWS_PER_STORE_AUDIT = int(os.getenv("BUDGET_REVIEWS_PER_STORE_AUDIT", 50))
+
+# Stage C 推薦短句的寫作素材
+REVIEWS_PER_STORE_SNIPPET = int(os.getenv("BUDGET_REVIEWS_PER_STORE_SNIPPET", 8))
+
+# Stage 0 蒸餾保留的評論數 = 下游最大需求，多留的只會在後面被丟掉
+REVIEWS_PER_STORE_DISTILLED = max(REVIEWS_PER_STORE_AUDIT, REVIEWS_PER_STORE_SNIPPET, REVIEWS_PER_STORE_EMBED)
+
+# 向量化的評論最短長度 (太短的多半是「好喝」「推」之類的雜訊)
+MIN_EMBED_REVIEW_LENGTH = int(os.getenv("BUDGET_MIN_EMBED_REVIEW_LENGTH", 15))
+
+# ==========================================
+# 第二層：LLM prompt 的 token 預算 (以 utils/token_budget.estimate_tokens 估算)
+# ==========================================
+# Stage A：單家店評論區塊的 token 上限，以及單則評論的字數上限
+AUDIT_REVIEW_TOKEN_BUDGET = int(os.getenv("BUDGET_AUDIT_REVIEW_TOKENS", 8000))
+AUDIT_MAX_CHARS_PER_REVIEW = int(os.getenv("BUDGET_AUDIT_MAX_CHARS_PER_REVIEW", 600))
+AUDIT_MAX_OUTPUT_TOKENS = int(os.getenv("BUDGET_AUDIT_MAX_OUTPUT_TOKENS", 8192))
+
+# Stage C 推薦短句：summary 與單則評論的字數上限、輸出上限
+SNIPPET_SUMMARY_MAX_CHARS = int(os.getenv("BUDGET_SNIPPET_SUMMARY_MAX_CHARS", 400))
+SNIPPET_MAX_CHARS_PER_REVIEW = int(os.getenv("BUDGET_SNIPPET_MAX_CHARS_PER_REVIEW", 150))
+SNIPPET_MAX_OUTPUT_TOKENS = int(os.getenv("BUDGET_SNIPPET_MAX_OUTPUT_TOKENS", 2048))
+
+# Stage 0 店名清洗：每次呼叫送幾家店
+NAME_CLEAN_BATCH_SIZE = int(os.getenv("BUDGET_NAME_CLEAN_BATCH_SIZE", 30))
@@ -4,6 +4,7 @@ import json
 import os
 import io
 from google.cloud import storage
+from llm_src.utils.table_io import write_table, NAME_REGEX_SCHEMA
 
 def stage1_ultimate_scrubber(name):
     """核心清洗邏輯"""
@@ -40,7 +41,7 @@ def clean_name_by_py():
     # ================= 配置區  =================
     BUCKET_NAME = os.getenv("BUCKET_NAME", "tjr104-cafe-datalake")
     INPUT_FILE = os.getenv("GCS_RAW_STORE_PATH", "raw/store/base.csv")
-    OUT_CSV = os.getenv("GCS_NAME_REGEX_CLEAND", "transform/stage0/cafes_name_regex_cleaned.csv")
+    OUT_TABLE = os.getenv("GCS_NAME_REGEX_CLEAND", "transform/stage0/cafes_name_regex_cleaned.parquet")
     OUT_JSON = os.getenv("GCS_TAG_REGEX", "transform/stage0/cafes_tag_regex.json")
     # ==========================================
     
@@ -76,12 +77,8 @@ def clean_name_by_py():
             json_map[p_id] = {"clean_name": c_name, "raw_tags": tags, "original_name": raw_n}
 
         # 存檔
-        print(f"📁 正在上傳清洗後的資料至: {OUT_CSV}")
-        blob_csv = bucket.blob(OUT_CSV)
-        blob_csv.upload_from_string(
-            pd.DataFrame(csv_results).to_csv(index=False, encoding="utf-8-sig"),
-            content_type='text/csv'
-        )
+        print(f"📁 正在上傳清洗後的資料至: {OUT_TABLE}")
+        write_table(bucket, OUT_TABLE, pd.DataFrame(csv_results), NAME_REGEX_SCHEMA)
 
         print(f"📁 正在上傳標籤資料至: {OUT_JSON}")
         blob_json = bucket.blob(OUT_JSON)
@@ -90,7 +87,7 @@ def clean_name_by_py():
             content_type='application/json'
         )
         print(f"✅ 第一階段初步篩選完成！")
-        print(f"📁 產出 CSV: {OUT_CSV}")
+        print(f"📁 產出資料表: {OUT_TABLE}")
         print(f"📁 產出 JSON: {OUT_JSON}")
 
     except FileNotFoundError:
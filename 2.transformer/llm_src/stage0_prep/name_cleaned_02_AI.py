@@ -3,11 +3,12 @@ import pandas as pd
 import json
 import time
 import os
-import io
 import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 from google.cloud import storage
 from dotenv import load_dotenv
+from llm_src.utils.table_io import read_table, write_table, NAME_CLEAN_TEMP_SCHEMA, NAME_CLEAN_SCHEMA
+from configs.budget_config import NAME_CLEAN_BATCH_SIZE
 
 load_dotenv()
 
@@ -17,7 +18,7 @@ LOCATION = "us-central1"  # 建議使用 us-central1，模型支援度最高
 MODEL_NAME = "gemini-2.5-pro"
 
 # 效能與速率限制 (10 RPM 安全設定)
-BATCH_SIZE = 30  
+BATCH_SIZE = NAME_CLEAN_BATCH_SIZE  # 見 configs/budget_config.py
 SLEEP_TIME = 8   
 
 # 連接到vertexai
@@ -59,8 +60,8 @@ def clean_name_by_gemini():
     INPUT_CSV = os.getenv("GCS_NAME_REGEX_CLEAND")
     INPUT_JSON = os.getenv("GCS_TAG_REGEX")
     PROCESS_FILE = os.getenv("GCS_NAME_CLEAN_JSON_PROCESS", "transform/stage0/name_clean_process/cleaning_process.json")
-    TEMP_CSV = os.getenv("GCS_NAME_CLEAN_CSV_PROCESS", "transform/stage0/name_clean_process/temp_results.csv")
-    OUTPUT_FINAL = os.getenv("GCS_NAME_CLEAN_FINISH","transform/stage0/name_clean_finished.csv")
+    TEMP_CSV = os.getenv("GCS_NAME_CLEAN_CSV_PROCESS", "transform/stage0/name_clean_process/temp_results.parquet")
+    OUTPUT_FINAL = os.getenv("GCS_NAME_CLEAN_FINISH","transform/stage0/name_clean_finished.parquet")
     
     client = storage.Client()
     bucket = client.bucket(BUCKET_NAME)
@@ -68,8 +69,7 @@ def clean_name_by_gemini():
     # 1. 從 GCS 讀取原始資料
     print(f"📡 正在從 GCS 讀取資料: {BUCKET_NAME}...")
     try:
-        csv_blob = bucket.blob(INPUT_CSV)
-        df_stage1 = pd.read_csv(io.BytesIO(csv_blob.download_as_bytes()))
+        df_stage1 = read_table(bucket, INPUT_CSV)
         
         # 讀取 JSON
         json_blob = bucket.blob(INPUT_JSON)
@@ -113,7 +113,7 @@ def clean_name_by_gemini():
     try:
         temp_blob = bucket.blob(TEMP_CSV)
         if temp_blob.exists():
-            temp_df = pd.read_csv(io.BytesIO(temp_blob.download_as_bytes()))
+            temp_df = read_table(bucket, TEMP_CSV)
             all_results = temp_df.to_dict('records')
     except:
         pass
@@ -146,11 +146,9 @@ def clean_name_by_gemini():
                     json.dumps(processed_ids), content_type='application/json'
                 )
                 
-                # 儲存暫存結果 CSV
+                # 儲存暫存結果
                 temp_df = pd.DataFrame(all_results)
-                bucket.blob(TEMP_CSV.replace(f"gs://{BUCKET_NAME}/", "")).upload_from_string(
-                    temp_df.to_csv(index=False, encoding="utf-8-sig"), content_type='text/csv'
-                )
+                write_table(bucket, TEMP_CSV.replace(f"gs://{BUCKET_NAME}/", ""), temp_df, NAME_CLEAN_TEMP_SCHEMA)
                 print(f"✅ 批次完成並已同步至 GCS")
             except Exception as e:
                 print(f"⚠️ 雲端同步失敗 (但程式繼續): {e}")
@@ -167,8 +165,7 @@ def clean_name_by_gemini():
     print("\n💾 正在生成最終合併檔案...")
     result_df = pd.DataFrame(all_results)
     final_df = pd.merge(df_stage1, result_df[['place_id', 'final_name', 'branch']], on="place_id", how="left")
-    final_csv_string = final_df.to_csv(index=False, encoding="utf-8-sig")
-    bucket.blob(OUTPUT_FINAL).upload_from_string(final_csv_string, content_type='text/csv')
+    write_table(bucket, OUTPUT_FINAL, final_df, NAME_CLEAN_SCHEMA)
     
     print(f"✨ 全量任務完成！檔案已上傳至 GCS：gs://{BUCKET_NAME}/{OUTPUT_FINAL}")
 
@@ -7,6 +7,8 @@ from google.cloud import storage
 from datetime import datetime, timedelta
 import logging
 from dotenv import load_dotenv
+from llm_src.utils.table_io import write_table, DISTILLED_REVIEWS_SCHEMA
+from configs.budget_config import REVIEWS_PER_STORE_DISTILLED
 
 load_dotenv()
 
@@ -75,6 +77,22 @@ class ReviewPreFilter:
         )
         return df
 
+    def distill(self, df):
+        """預過濾 -> 品質評分 -> 每家店取前 N 則 (budget_planner 試算時也走同一套)"""
+        # 1. 預過濾
+        df = df.dropna(subset=['content']).drop_duplicates(subset=['place_id', 'content'])
+        
+        # 2. 評分
+        df_scored = self.calculate_quality_score(df)
+        
+        # 3. 核心邏輯：每家店取品質優選 (數量 = 下游各階段的最大需求，見 configs/budget_config.py)
+        return (
+            df_scored.sort_values(['place_id', 'quality_score'], ascending=[True, False])
+            .groupby('place_id')
+            .head(REVIEWS_PER_STORE_DISTILLED)
+            .reset_index(drop=True)
+        )
+
     def run(self):
         logger.info(f"從 GCS 下載原始資料: gs://{self.bucket.name}/{self.gcs_raw_path}")
         try:
@@ -92,24 +110,10 @@ class ReviewPreFilter:
             logger.error(f"雲端讀取或解析失敗: {e}")
             return None
         
-        # 1. 預過濾
-        df = df.dropna(subset=['content']).drop_duplicates(subset=['place_id', 'content'])
-        
-        # 2. 評分
-        df_scored = self.calculate_quality_score(df)
-        
-        # 3. 核心邏輯：每家店取 Top 50 品質優選
-        df_top_50 = (
-            df_scored.sort_values(['place_id', 'quality_score'], ascending=[True, False])
-            .groupby('place_id')
-            .head(50)
-            .reset_index(drop=True)
-        )
+        df_top_50 = self.distill(df)
         
         # 4. 雲端存取
-        output_blob = self.bucket.blob(self.gcs_output_path)
-        csv_data = df_top_50.to_csv(index=False, encoding='utf-8-sig')
-        output_blob.upload_from_string(csv_data, content_type='text/csv')
+        write_table(self.bucket, self.gcs_output_path, df_top_50, DISTILLED_REVIEWS_SCHEMA)
         
         logger.info(f"蒸餾完成。已將 {len(df_top_50)} 筆資料上傳至 GCS: gs://{self.bucket.name}/{self.gcs_output_path}")
         return df_top_50
@@ -119,7 +123,7 @@ if __name__ == "__main__":
         "project_id": os.getenv("PROJECT_ID", "project-tjr104-cafe"),
         "bucket_name": os.getenv("BUCKET_NAME", "tjr104-cafe-datalake"),
         "gcs_raw_path": os.getenv("GCS_RAW_REVIEWS_PATH", "raw/comments/reviews_all.csv"),
-        "gcs_output_path": os.getenv("GCS_DISTILLED_CSV_PATH", "transform/stage0/reviews_top50_distilled.csv")
+        "gcs_output_path": os.getenv("GCS_DISTILLED_CSV_PATH", "transform/stage0/reviews_top50_distilled.parquet")
     }
     filter_engine = ReviewPreFilter(**CONFIG)
     filter_engine.run()
\ No newline at end of file
@@ -1,12 +1,14 @@
-import pandas as pd
 import json
 import os
 import logging
 from configs import tag_config as tc 
 import datetime
-from io import BytesIO
 from google.cloud import storage
 from dotenv import load_dotenv
+from llm_src.utils.table_io import read_table
+from llm_src.utils.token_budget import take_within_budget, estimate_tokens
+from configs.budget_config import (REVIEWS_PER_STORE_AUDIT, AUDIT_REVIEW_TOKEN_BUDGET,
+                                   AUDIT_MAX_CHARS_PER_REVIEW, AUDIT_MAX_OUTPUT_TOKENS)
 
 load_dotenv()
 
@@ -25,8 +27,7 @@ class StageA_OneStop_Processor:
 
     def _load_data(self):
         logger.info(f"正在從 GCS 讀取純化評論: {self.gcs_distilled_path}")
-        blob = self.bucket.blob(self.gcs_distilled_path)
-        return pd.read_csv(BytesIO(blob.download_as_bytes()))
+        return read_table(self.bucket, self.gcs_distilled_path, columns=['place_id', 'place_name', 'content'])
 
 
     def _load_official_baseline(self):
@@ -36,77 +37,76 @@ class StageA_OneStop_Processor:
         self.official_map = {str(item.get('place_id')): item for item in raw_data}
  
 
-    def _build_system_instruction(self):
-        feature_def = json.dumps(tc.FEATURE_DEFINITION, ensure_ascii=False)
-        norm_rules = json.dumps(tc.NORM_RULES, ensure_ascii=False)
-        cat_map_context = json.dumps(tc.CAT_MAP, ensure_ascii=False)
-
-        #  Prompt 內容不要動
-        return f"""
-[ROLE] Lead Data Auditor. Audit [OFFICIAL_BASELINE] against [USER_REVIEWS].
-
-[SCHEMA REGISTRY (CRITICAL)]
-1. [features] 所有的 Key 必須嚴格對應 {{feature_def}} 中的英文 ID。
-2. [official_tags_audit] 必須依照 {cat_map_context} 的分類進行歸納，內容為繁體中文標籤。
-
-[LANGUAGE RULE]
-- JSON Keys: 必須維持英文（不可翻譯）。
-- JSON Values: 所有內容、理由、證據、總結必須使用 **繁體中文**。
-
-[CONFIG] 
-- Feature Definition: {feature_def}
-- Category Map: {cat_map_context}
-- Norm Rules: {norm_rules}
+    @staticmethod
+    def _compact_feature_schema():
+        """
+        把 tag_config 壓成精簡的行內格式 (英文ID=中文)，取代整包 json.dumps：
+        FEATURE_DEFINITION 的值全是 True 不必逐一列出；NORM_RULES 去掉與標準名只差大小寫的同義詞。
+        """
+        features = ", ".join(f"{fid}={zh}" + ("" if flag is True else f"({json.dumps(flag)})")
+                             for zh, (fid, flag) in tc.FEATURE_DEFINITION.items())
+        categories = ", ".join(f"{en}={zh}" for zh, en in tc.CAT_MAP.items())
+        norm_rules = []
+        for std_name, variants in tc.NORM_RULES.items():
+            seen = {std_name.lower()}
+            synonyms = []
+            for v in variants:
+                if v.lower() not in seen:
+                    seen.add(v.lower())
+                    synonyms.append(v)
+            if synonyms:
+                norm_rules.append(f"{std_name}:{'/'.join(synonyms)}")
+        return features, categories, "; ".join(norm_rules)
+
+    @staticmethod
+    def _build_system_instruction():
+        """
+        放在 request 的 systemInstruction，與店家內容分開：每行的前綴完全相同 (可被隱式快取)，
+        設定表只展開一次、以精簡格式呈現；規則與輸出 Schema 與原版一致。
+        """
+        features, categories, norm_rules = StageA_OneStop_Processor._compact_feature_schema()
+        return f"""[ROLE] Lead Data Auditor. Audit [OFFICIAL BASELINE] against [USER REVIEWS].
+
+[LANGUAGE RULE] JSON Keys 必須維持英文 (不可翻譯)；所有內容、理由、證據、總結必須使用繁體中文。
+
+[FEATURES] (英文ID=中文標籤) `features` 的 Key 只能用這裡的英文 ID，嚴禁中文 Key：
+{features}
+
+[CATEGORIES] (英文分類=中文分類) `official_tags_audit` 的 Key 只能用這裡的英文分類，值為繁體中文標籤：
+{categories}
+
+[NORM RULES] (標準標籤:同義詞/同義詞) 歸類前先把同義詞換成標準標籤：
+{norm_rules}
 
 [TASK]
-1. **Feature Logic Audit**: 
-   - 根據 {{feature_def}} 更新 `features` 狀態。
-   - TRUE: 評論證實存在 | FALSE: 評論證實不存在 | NULL: 未提及。
-2. **Official Tags Grouping**: 
-   - 根據評論提到的關鍵字，參考 {cat_map_context} 的分類，將其歸類到 `official_tags_audit`。
-3. **Evidence & Analysis**: 
-   - `conflict_alerts`: 記錄官方與現實不符的理由。
-   - `evidence_map`: 針對 `features` 的 **英文 Key** 提供 20 字內原始節錄。
+1. Feature Logic Audit：依 [FEATURES] 更新 `features`。TRUE: 評論證實存在 | FALSE: 評論證實不存在 | NULL: 未提及。
+2. Official Tags Grouping：評論提到的關鍵字依 [CATEGORIES] 歸類到 `official_tags_audit`。
+3. Evidence & Analysis：`conflict_alerts` 記錄官方與現實不符的理由；`evidence_map` 針對 `features` 的英文 Key 提供 20 字內原始節錄。
 
 [OUTPUT SCHEMA (Strict JSON)]
-{{
-  "audit_results": {{
-    "audit_summary": {{ "total_reviews": 50, "overall_vibe": "繁體中文總結" }},
-    "official_tags_audit": {{
-        "atmosphere": ["安靜", "氛圍舒適"],
-        "facilities": ["洗手間", "插座"],
-        "..." : "依照 CAT_MAP 的英文分類填入對應的繁體中文標籤"
-    }},
-    "features": {{
-        "has_wifi": Boolean or Null,
-        "is_quiet": Boolean or Null,
-        "..." : "必須使用 feature_def 中的英文 ID，嚴禁中文 Key"
-    }},
-    "conflict_alerts": [
-      {{
-        "key": "英文代碼",
-        "official_claim": "String",
-        "reality_check": "String",
-        "reason": "繁體中文分析理由",
-        "consensus_level": 5,
-        "sentiment": -1
-      }}
-    ],
-    "new_incremental_features": [
-      {{
-        "feature_name": "繁體中文標籤",
-        "raw_keywords": ["關鍵字"],
-        "evidence": "20-30字評論節錄",
-        "frequency": "High/Low"
-      }}
-    ],
-    "evidence_map": {{ 
-        "英文代碼": "20字內原始評論精華" 
-    }}
-  }}
-}}
+{{"audit_results": {{
+  "audit_summary": {{"total_reviews": 50, "overall_vibe": "繁體中文總結"}},
+  "official_tags_audit": {{"atmosphere": ["安靜", "氛圍舒適"], "facilities": ["洗手間", "插座"]}},
+  "features": {{"has_wifi": true, "is_quiet": null}},
+  "conflict_alerts": [{{"key": "英文代碼", "official_claim": "String", "reality_check": "String", "reason": "繁體中文分析理由", "consensus_level": 5, "sentiment": -1}}],
+  "new_incremental_features": [{{"feature_name": "繁體中文標籤", "raw_keywords": ["關鍵字"], "evidence": "20-30字評論節錄", "frequency": "High/Low"}}],
+  "evidence_map": {{"英文代碼": "20字內原始評論精華"}}
+}}}}
 """
 
+    @staticmethod
+    def compact_baseline(baseline: dict) -> str:
+        """官方基準去掉標頭已經寫過的 place_id / name，並以無空白的 JSON 輸出"""
+        trimmed = {k: v for k, v in baseline.items() if k not in ("place_id", "name", "title")}
+        return json.dumps(trimmed, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def select_reviews(contents: list) -> list:
+        """依品質順序挑評論，受每店 token 預算與單則字數上限約束 (見 configs/budget_config.py)"""
+        cleaned = [str(r).replace('\n', ' ').replace('\r', ' ').strip() for r in contents]
+        return take_within_budget(cleaned, max_items=REVIEWS_PER_STORE_AUDIT,
+                                  max_tokens=AUDIT_REVIEW_TOKEN_BUDGET, max_chars=AUDIT_MAX_CHARS_PER_REVIEW)
+
     def generate_jsonl(self):
         df = self._load_data()
         self._load_official_baseline()
@@ -125,6 +125,8 @@ class StageA_OneStop_Processor:
 
         cold_start_count = 0
         valid_payloads = 0
+        review_tokens = 0
+        user_tokens = 0
         output_lines = []
 
         # ⭐️ 核心修正：改由「官方主表」帶動迴圈，保證所有店家都會進 AI 管線
@@ -136,12 +138,10 @@ class StageA_OneStop_Processor:
             
             # 嘗試去評論庫找資料 (Left Join)
             if grouped is not None and pid in grouped.groups:
-                group = grouped.get_group(pid).head(50)
+                group = grouped.get_group(pid).head(REVIEWS_PER_STORE_AUDIT)
                 # 如果有評論，優先使用評論表中的店名確保一致性
                 place_name = str(group['place_name'].iloc[0])
-                for r in group['content'].dropna().tolist():
-                    r_str = str(r).replace('\n', ' ').replace('\r', ' ').strip()
-                    clean_reviews.append(r_str)
+                clean_reviews = self.select_reviews(group['content'].dropna().tolist())
             
             # ==========================================
             # 🛡️ 動態組裝 User Content (觸發防呆機制)
@@ -155,27 +155,29 @@ class StageA_OneStop_Processor:
                 )
             else:
                 review_text_block = "\n".join([f"- {r}" for r in clean_reviews])
+                review_tokens += estimate_tokens(review_text_block)
 
             user_content = (
                 f"### [TARGET STORE]\n"
                 f"Name: {place_name} (ID: {pid})\n\n"
                 f"### [1. OFFICIAL BASELINE]\n"
-                f"{json.dumps(baseline, ensure_ascii=False)}\n\n"
+                f"{self.compact_baseline(baseline)}\n\n"
                 f"### [2. USER REVIEWS]\n"
                 f"{review_text_block}"
             )
-            
-            final_prompt = f"System Instruction:\n{system_instruction}\n\nUser Content:\n{user_content}"
+            user_tokens += estimate_tokens(user_content)
             
             request_item = {
                 "request": {
+                    # 系統指令放在 request 層級，每行內容只剩這家店自己的資料
+                    "systemInstruction": {"parts": [{"text": system_instruction}]},
                     "contents": [
-                        {"role": "user", "parts": [{"text": final_prompt}]}
+                        {"role": "user", "parts": [{"text": user_content}]}
                     ],
                     "generationConfig": { 
                         "response_mime_type": "application/json", 
                         "temperature": 0.0,
-                        "max_output_tokens": 8192
+                        "max_output_tokens": AUDIT_MAX_OUTPUT_TOKENS
                     }
                 },
                 "custom_id": str(pid),
@@ -194,6 +196,11 @@ class StageA_OneStop_Processor:
         output_blob = self.bucket.blob(self.gcs_output_path)
         output_blob.upload_from_string(final_jsonl_content, content_type='application/jsonl')
         logger.info(f"✅ 全量封裝完成！共處理 {valid_payloads} 筆 (其中無評論冷啟動 {cold_start_count} 筆)")
+        instruction_tokens = estimate_tokens(system_instruction)
+        logger.info(f"📏 檔案 {len(final_jsonl_content.encode('utf-8')) / 1024 / 1024:.2f} MB | "
+                    f"系統指令約 {instruction_tokens} tokens x {valid_payloads} 筆 | 店家內容約 {user_tokens} tokens "
+                    f"(其中評論 {review_tokens}，每店上限 {AUDIT_REVIEW_TOKEN_BUDGET}) | "
+                    f"輸入合計約 {instruction_tokens * valid_payloads + user_tokens} tokens")
         logger.info(f"✅ 已上傳至: gs://{self.bucket.name}/{self.gcs_output_path}")
 
 if __name__ == "__main__":
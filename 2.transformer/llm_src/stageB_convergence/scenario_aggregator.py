@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 # 從 config 中把權重矩陣跟翻譯字典一起 import 進來
 from configs import tag_config
 from configs.tag_config import SCENARIO_CONFIG, FEATURE_TO_ZH
+from llm_src.utils.table_io import write_table, SCENARIO_SCHEMA
 
 load_dotenv()
 
@@ -118,9 +119,7 @@ class StageB_CloudCalculator:
         
         # 4. 直接將 DataFrame 轉為字串並上傳至 GCS (不落地，拯救 I/O)
         logger.info(f"☁️ 正在將運算結果上傳至 GCS: gs://{self.bucket.name}/{output_gcs_path}")
-        csv_buffer = df_enriched.to_csv(index=False, encoding='utf-8-sig')
-        out_blob = self.bucket.blob(output_gcs_path)
-        out_blob.upload_from_string(csv_buffer, content_type='text/csv')
+        write_table(self.bucket, output_gcs_path, df_enriched, SCENARIO_SCHEMA)
         
         logger.info(f"🎉 雲端運算完成！場景分數已安全降落。")
         
@@ -140,8 +139,8 @@ if __name__ == "__main__":
     # 輸入：Stage B 剛產出的打分 JSON
     INPUT_PATH = os.getenv("GCS_FINAL_SCORED_PATH", "transform/stageB/final_scored_data.json")
     
-    # 輸出：準備餵給 Stage C / MongoIngestor 的 CSV
-    OUTPUT_PATH = os.getenv("GCS_SCENARIO_CSV_PATH", "transform/stageB/cafes_with_scenarios_final.csv")
+    # 輸出：準備餵給 Stage C / MongoIngestor 的情境資料表
+    OUTPUT_PATH = os.getenv("GCS_SCENARIO_CSV_PATH", "transform/stageB/cafes_with_scenarios_final.parquet")
     
     try:
         calculator = StageB_CloudCalculator(PROJECT_ID, BUCKET_NAME)
@@ -1,10 +1,12 @@
-import pandas as pd
 import json
 import os
 import logging
-from io import BytesIO
 from google.cloud import storage
 from dotenv import load_dotenv
+from llm_src.utils.table_io import read_table
+from llm_src.utils.embedding_cache import EmbeddingCache, EMBED_CACHE_ENABLED, text_key
+from llm_src.utils.online_batch_runner import EMBED_BATCH_SIZE
+from configs.budget_config import REVIEWS_PER_STORE_EMBED, MIN_EMBED_REVIEW_LENGTH
 
 load_dotenv()
 
@@ -12,21 +14,24 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 class StageC_Embedding_Processor:
-    def __init__(self, project_id, bucket_name, gcs_scored_data_path, gcs_raw_reviews_path, gcs_output_path):
+    def __init__(self, project_id, bucket_name, gcs_scored_data_path, gcs_raw_reviews_path, gcs_output_path,
+                 gcs_embedding_output_folder, embedding_model_id):
         self.client = storage.Client(project=project_id)
         self.bucket = self.client.bucket(bucket_name)
         self.gcs_scored_data_path = gcs_scored_data_path
         self.gcs_raw_reviews_path = gcs_raw_reviews_path
         self.gcs_output_path = gcs_output_path
-        self.max_reviews_per_store = 30
-        self.min_review_length = 15
+        self.gcs_embedding_output_folder = gcs_embedding_output_folder.rstrip('/') + '/'
+        self.cache = EmbeddingCache(self.bucket, embedding_model_id) if EMBED_CACHE_ENABLED else None
+        # Stage D 只寫入前幾則評論，多算的向量都會被丟掉 (配額見 configs/budget_config.py)
+        self.max_reviews_per_store = REVIEWS_PER_STORE_EMBED
+        self.min_review_length = MIN_EMBED_REVIEW_LENGTH
 
     def _load_raw_reviews(self):
         """讀取第一階段純化出來的 Top 50 評論 CSV，並嚴格保留品質排序"""
         logger.info(f"📥 正在從 GCS 讀取原始評論: gs://{self.bucket.name}/{self.gcs_raw_reviews_path}")
         try:
-            blob = self.bucket.blob(self.gcs_raw_reviews_path)
-            df = pd.read_csv(BytesIO(blob.download_as_bytes()))
+            df = read_table(self.bucket, self.gcs_raw_reviews_path, columns=['place_id', 'content', 'quality_score'])
         # [DE 嚴謹防線]：確保資料確實是依照 quality_score 降冪排列
         # 以防 CSV 在傳遞過程中順序被打亂
             if 'quality_score' in df.columns:
@@ -59,6 +64,47 @@ class StageC_Embedding_Processor:
                 
         return valid_reviews
 
+    def _apply_embedding_cache(self, instances: list) -> list:
+        """
+        查向量快取：命中的紀錄直接帶上 embedding_1536，寫成 batch_cached_*.jsonl 放進向量輸出資料夾 (Stage D 一併讀取)，
+        回傳沒命中、需要送 Vertex AI 的紀錄 (維持原本順序)。
+        """
+        # 上一輪的快取命中分片整批換新，避免 Stage D 讀到已經不存在的評論
+        for blob in self.bucket.list_blobs(prefix=f"{self.gcs_embedding_output_folder}batch_cached_"):
+            blob.delete()
+        if not self.cache:
+            logger.info("⏭️ 向量快取已停用 (EMBED_CACHE_ENABLED=false)，全部送 Vertex AI")
+            return instances
+
+        keys = [text_key(inst["content"]) for inst in instances]
+        by_key = {}
+        for key, inst in zip(keys, instances):
+            by_key.setdefault(key, []).append(inst)
+
+        hits, shard_idx, buffer = 0, 0, []
+
+        def upload_shard(lines, idx):
+            shard_path = f"{self.gcs_embedding_output_folder}batch_cached_{idx:05d}.jsonl"
+            self.bucket.blob(shard_path).upload_from_string("\n".join(lines) + "\n", content_type='application/jsonl')
+
+        for key, vector in self.cache.iter_hits(set(by_key)):
+            for inst in by_key.pop(key):
+                # 向量已經是 JSON 陣列字串，直接接在紀錄的最後一個欄位
+                buffer.append(json.dumps(inst, ensure_ascii=False)[:-1] + f', "embedding_1536": {vector}}}')
+                hits += 1
+            if len(buffer) >= EMBED_BATCH_SIZE:
+                upload_shard(buffer, shard_idx)
+                shard_idx, buffer = shard_idx + 1, []
+        if buffer:
+            upload_shard(buffer, shard_idx)
+
+        misses = [inst for key, inst in zip(keys, instances) if key in by_key]
+        total = len(instances)
+        calls_saved = -(-total // EMBED_BATCH_SIZE) - (-(-len(misses) // EMBED_BATCH_SIZE))
+        logger.info(f"💾 向量快取命中 {hits}/{total} 筆 ({hits / total:.1%})" if total else "💾 沒有需要向量化的資料")
+        logger.info(f"💰 需送 Vertex AI: {len(misses)} 筆 | 省下約 {calls_saved} 次 embedding 呼叫 (每次 {EMBED_BATCH_SIZE} 筆)")
+        return misses
+
     def generate_jsonl(self):
         """產出 Vertex AI Embedding 專用的 Batch JSONL (包含嚴格 Schema 防護)"""
         logger.info(f"📥 正在從 GCS 讀取 Scored Data: gs://{self.bucket.name}/{self.gcs_scored_data_path}")
@@ -73,7 +119,7 @@ class StageC_Embedding_Processor:
         
         store_count = 0
         review_count = 0
-        output_lines = []
+        instances = []
 
         logger.info(f"🚀 開始生成雙層向量任務封包 (啟動 JSON Stringification 防護)...")
 
@@ -102,7 +148,7 @@ class StageC_Embedding_Processor:
                 "doc_type": "store_level",
                 "safe_metadata": safe_metadata_str  # <--- 這裡變成純字串了！
             }
-            output_lines.append(json.dumps(store_instance, ensure_ascii=False))
+            instances.append(store_instance)
             store_count += 1
 
             # ==========================================
@@ -119,17 +165,21 @@ class StageC_Embedding_Processor:
                     "doc_type": "review_level",
                     "parent_place_id": str(place_id) # 攤平為單一欄位，不使用 nested dict
                 }
-                output_lines.append(json.dumps(review_instance, ensure_ascii=False))
+                instances.append(review_instance)
                 review_count += 1
         
+        # 快取命中的直接寫成向量分片，只把新的 / 改過的文字交給 Launcher
+        pending = self._apply_embedding_cache(instances)
+
         #結果上傳至GCS     
-        final_jsonl_content = "\n".join(output_lines)
+        final_jsonl_content = "\n".join(json.dumps(inst, ensure_ascii=False) for inst in pending)
         output_blob = self.bucket.blob(self.gcs_output_path)
         output_blob.upload_from_string(final_jsonl_content, content_type='application/jsonl')
 
         logger.info("================ Stage C Pipeline Summary ================")
         logger.info(f"✅ Store-Level Vectors 準備數: {store_count} 筆")
         logger.info(f"✅ Review-Level Vectors 準備數: {review_count} 筆")
+        logger.info(f"✅ 快取命中 {len(instances) - len(pending)} 筆，待向量化 {len(pending)} 筆")
         logger.info(f"✅ 封裝完成並上傳至: gs://{self.bucket.name}/{self.gcs_output_path}")
         logger.info("==========================================================")
 
@@ -138,11 +188,14 @@ if __name__ == "__main__":
         "project_id": os.getenv("PROJECT_ID"),
         "bucket_name": os.getenv("BUCKET_NAME"),
         # 讀取 Stage 0 的產出
-        "gcs_raw_reviews_path": os.getenv("GCS_DISTILLED_CSV_PATH", "transform/stage0/reviews_top50_distilled.csv"),
+        "gcs_raw_reviews_path": os.getenv("GCS_DISTILLED_CSV_PATH", "transform/stage0/reviews_top50_distilled.parquet"),
         # 讀取 Stage B 的產出
         "gcs_scored_data_path": os.getenv("GCS_FINAL_SCORED_PATH", "transform/stageB/final_scored_data.json"),
         # 輸出給 Stage C 的 JSONL
-        "gcs_output_path": os.getenv("GCS_STAGE_C_EMBEDDING_JSONL_PATH", "transform/stageC/vertex_job_stage_c_embedding.jsonl")
+        "gcs_output_path": os.getenv("GCS_STAGE_C_EMBEDDING_JSONL_PATH", "transform/stageC/vertex_job_stage_c_embedding.jsonl"),
+        # 快取命中的向量直接寫進 Launcher 的輸出資料夾 (與 VertexAI_Launcher 同一組設定)
+        "gcs_embedding_output_folder": os.getenv("GCS_EMBEDDING_RESULTS_OUTPUT", "batch_output/embedding_generation/"),
+        "embedding_model_id": os.getenv("EMBEDDING_MODEL_ID", "gemini-embedding-001")
     }
     # 檔案路徑配置
     
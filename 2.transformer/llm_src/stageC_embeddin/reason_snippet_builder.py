@@ -0,0 +1,155 @@
+import json
+import os
+import logging
+import datetime
+from google.cloud import storage
+from dotenv import load_dotenv
+from llm_src.utils.table_io import read_table, SCENARIO_SCHEMA
+from configs.budget_config import (REVIEWS_PER_STORE_SNIPPET, SNIPPET_SUMMARY_MAX_CHARS,
+                                   SNIPPET_MAX_CHARS_PER_REVIEW, SNIPPET_MAX_OUTPUT_TOKENS)
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 四大情境按鈕 (與 scenario_aggregator / 服務端 theme 參數對齊)
+THEME_COLUMNS = {
+    "workspace": ("適合辦公", "tags_score_workspace"),
+    "dating": ("質感約會", "tags_score_dating"),
+    "pet_friendly": ("毛孩同樂", "tags_score_pet_friendly"),
+    "relax": ("獨處放鬆", "tags_score_relax"),
+}
+# 負面標籤寫不出「正面推薦理由」，不產生短句
+NEGATIVE_TAGS = {"溫度冷", "悶熱", "服務不佳", "服務效率不佳", "停車困難", "限時", "無內用座位", "低消", "服務費"}
+
+
+class StageC_ReasonSnippet_Processor:
+    """
+    [離線預生成] 每家店針對自身標籤與四大情境，各寫一句 15~20 字的推薦短句。
+    服務端依使用者的標籤直接挑句子套用，只有少見的自由文字需求才需要即時呼叫 ReasonAgent。
+    """
+    def __init__(self, project_id, bucket_name, gcs_scored_data_path, gcs_raw_reviews_path,
+                 gcs_scenario_csv_path, gcs_output_path):
+        self.client = storage.Client(project=project_id)
+        self.bucket = self.client.bucket(bucket_name)
+        self.gcs_scored_data_path = gcs_scored_data_path
+        self.gcs_raw_reviews_path = gcs_raw_reviews_path
+        self.gcs_scenario_csv_path = gcs_scenario_csv_path
+        self.gcs_output_path = gcs_output_path
+        self.max_reviews_per_store = REVIEWS_PER_STORE_SNIPPET
+        self.max_tags_per_store = 12
+
+    def _load_top_reviews(self):
+        """沿用 Stage 0 的品質排序，每家只取前幾則當寫作素材"""
+        try:
+            df = read_table(self.bucket, self.gcs_raw_reviews_path, columns=['place_id', 'content', 'quality_score'])
+            if 'quality_score' in df.columns:
+                df = df.sort_values(['place_id', 'quality_score'], ascending=[True, False])
+            df = df.dropna(subset=['content'])
+            return df.groupby('place_id')['content'].apply(lambda s: list(s)[:self.max_reviews_per_store]).to_dict()
+        except Exception as e:
+            logger.error(f"❌ 讀取評論失敗: {e}")
+            return {}
+
+    def _load_theme_tags(self):
+        """讀取 Stage B 的情境標籤，只替「有命中標籤」的情境寫句子"""
+        blob = self.bucket.blob(self.gcs_scenario_csv_path)
+        if not blob.exists():
+            logger.warning(f"⚠️ 找不到情境資料表 {self.gcs_scenario_csv_path}，將略過情境短句。")
+            return {}
+        tag_columns = [col for _, col in THEME_COLUMNS.values()]
+        df = read_table(self.bucket, self.gcs_scenario_csv_path, columns=['place_id'] + tag_columns, schema=SCENARIO_SCHEMA)
+        for col in tag_columns:
+            if col not in df.columns:
+                df[col] = [[] for _ in range(len(df))]
+        theme_map = {}
+        for place_id, *tag_lists in zip(df['place_id'].astype(str), *(df[col] for col in tag_columns)):
+            theme_map[place_id] = {theme: tags for theme, tags in zip(THEME_COLUMNS, tag_lists) if tags}
+        return theme_map
+
+    @staticmethod
+    def _build_instruction():
+        return """
+[ROLE] 你是熱情專業的咖啡廳推薦專家，要替「一家店」預先寫好推薦短句，之後會依使用者的需求挑一句顯示在卡片上。
+
+[RULES]
+1. 每句 15~20 字、完整結束的正面推薦語氣，不要使用括號、不要重複店名。
+2. 只能根據提供的 summary、評論與標籤寫作；評論沒提到的細節不可捏造。
+3. 嚴禁「資訊較少」、「未提及」、「整體而言」、「這是一家」等否定或廢話字眼。
+4. `tags` 的每個 Key 必須是 [TAGS] 清單中的原字串；`themes` 的 Key 必須是 [THEMES] 中的英文代碼。
+
+[OUTPUT SCHEMA (Strict JSON)]
+{
+  "tags": {"插座": "座位旁插座充足，筆電族久坐也安心"},
+  "themes": {"workspace": "插座網路齊全，安靜角落適合專心辦公"}
+}
+"""
+
+    def generate_jsonl(self):
+        logger.info(f"📥 正在從 GCS 讀取 Scored Data: gs://{self.bucket.name}/{self.gcs_scored_data_path}")
+        try:
+            scored_map = json.loads(self.bucket.blob(self.gcs_scored_data_path).download_as_text(encoding='utf-8'))
+        except Exception as e:
+            logger.error(f"❌ 讀取 Scored Data 失敗: {e}")
+            return
+
+        reviews_map = self._load_top_reviews()
+        theme_map = self._load_theme_tags()
+        instruction = self._build_instruction()
+        today_str = datetime.date.today().isoformat()
+
+        output_lines = []
+        skipped = 0
+        for place_id, store_data in scored_map.items():
+            tags = [t for t in store_data.get("metadata_for_filtering", {}).get("tags", []) if t not in NEGATIVE_TAGS]
+            tags = tags[:self.max_tags_per_store]
+            themes = theme_map.get(str(place_id), {})
+            if not tags and not themes:
+                skipped += 1
+                continue
+
+            reviews = [str(r).replace('\n', ' ').strip() for r in reviews_map.get(place_id, [])]
+            theme_block = {theme: {"name": THEME_COLUMNS[theme][0], "matched_tags": t} for theme, t in themes.items()}
+            user_content = (
+                f"### [SUMMARY]\n{store_data.get('content_for_embedding', '')[:SNIPPET_SUMMARY_MAX_CHARS]}\n\n"
+                f"### [TAGS]\n{json.dumps(tags, ensure_ascii=False)}\n\n"
+                f"### [THEMES]\n{json.dumps(theme_block, ensure_ascii=False)}\n\n"
+                f"### [TOP REVIEWS]\n" + "\n".join(f"- {r[:SNIPPET_MAX_CHARS_PER_REVIEW]}" for r in reviews)
+            )
+
+            request_item = {
+                "request": {
+                    # 指令放在 request 層級，每行前綴完全相同 (可被隱式快取)，contents 只放這家店的素材
+                    "systemInstruction": {"parts": [{"text": instruction}]},
+                    "contents": [
+                        {"role": "user", "parts": [{"text": user_content}]}
+                    ],
+                    "generationConfig": {
+                        "response_mime_type": "application/json",
+                        "temperature": 0.3,
+                        "max_output_tokens": SNIPPET_MAX_OUTPUT_TOKENS
+                    }
+                },
+                "custom_id": str(place_id),
+                "place_name": str(store_data.get("place_name", "")),
+                "snippet_date": today_str
+            }
+            output_lines.append(json.dumps(request_item, ensure_ascii=False))
+
+        self.bucket.blob(self.gcs_output_path).upload_from_string("\n".join(output_lines), content_type='application/jsonl')
+        logger.info(f"✅ 推薦短句任務封裝完成！共 {len(output_lines)} 家 (無可用標籤略過 {skipped} 家)")
+        logger.info(f"✅ 已上傳至: gs://{self.bucket.name}/{self.gcs_output_path}")
+
+
+if __name__ == "__main__":
+    CONFIG = {
+        "project_id": os.getenv("PROJECT_ID"),
+        "bucket_name": os.getenv("BUCKET_NAME"),
+        "gcs_scored_data_path": os.getenv("GCS_FINAL_SCORED_PATH", "transform/stageB/final_scored_data.json"),
+        "gcs_raw_reviews_path": os.getenv("GCS_DISTILLED_CSV_PATH", "transform/stage0/reviews_top50_distilled.parquet"),
+        "gcs_scenario_csv_path": os.getenv("GCS_SCENARIO_CSV_PATH", "transform/stageB/cafes_with_scenarios_final.parquet"),
+        "gcs_output_path": os.getenv("GCS_STAGE_C_SNIPPET_JSONL_PATH", "transform/stageC/vertex_job_reason_snippets.jsonl")
+    }
+    processor = StageC_ReasonSnippet_Processor(**CONFIG)
+    processor.generate_jsonl()
@@ -0,0 +1,88 @@
+import json
+import os
+import re
+import logging
+from google.cloud import storage
+from dotenv import load_dotenv
+from llm_src.stageA_extraction.audit_result_parser import get_latest_prediction_folder
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VALID_THEMES = {"workspace", "dating", "pet_friendly", "relax"}
+MAX_SNIPPET_LENGTH = 30  # 規定 15~20 字，留一點彈性；超過代表 AI 沒照規定寫，直接捨棄
+
+
+def _clean_snippets(raw: dict, allowed_keys=None) -> dict:
+    cleaned = {}
+    if not isinstance(raw, dict):
+        return cleaned
+    for key, text in raw.items():
+        if not isinstance(text, str) or (allowed_keys is not None and key not in allowed_keys):
+            continue
+        text = re.sub(r"\(.*?\)|（.*?）", "", text).strip(" 。")
+        if 0 < len(text) <= MAX_SNIPPET_LENGTH:
+            cleaned[key] = text
+    return cleaned
+
+
+def process_snippet_results(project_id, bucket_name, folder_path, gcs_output_path):
+    client = storage.Client(project=project_id)
+    bucket = client.bucket(bucket_name)
+
+    actual_folder_path = get_latest_prediction_folder(bucket, folder_path)
+    all_results = {}
+    failed_logs = []
+
+    for blob in bucket.list_blobs(prefix=actual_folder_path):
+        if not blob.name.endswith(".jsonl") or "predictions" not in blob.name:
+            continue
+        for line in blob.download_as_text().splitlines():
+            if not line.strip():
+                continue
+            pid = None
+            try:
+                raw_data = json.loads(line)
+                pid = raw_data.get("custom_id")
+                candidates = raw_data.get('response', {}).get('candidates', [])
+                if not candidates:
+                    raise ValueError("AI 無回傳內容")
+                raw_text = candidates[0].get('content', {}).get('parts', [{}])[0].get('text', "")
+                json_match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+                if not json_match:
+                    raise ValueError("無法從 AI 回傳中找到有效的 JSON 結構")
+                prediction = json.loads(json_match.group())
+
+                snippets = {
+                    "tags": _clean_snippets(prediction.get("tags")),
+                    "themes": _clean_snippets(prediction.get("themes"), VALID_THEMES)
+                }
+                if snippets["tags"] or snippets["themes"]:
+                    all_results[pid] = snippets
+            except Exception as e:
+                failed_logs.append({"pid": pid, "error": str(e)})
+                logger.warning(f"⚠️ 店家 {pid} 短句解析失敗: {e}")
+
+    bucket.blob(gcs_output_path).upload_from_string(
+        json.dumps(all_results, ensure_ascii=False, indent=2),
+        content_type='application/json'
+    )
+    if failed_logs:
+        bucket.blob(gcs_output_path.replace(".json", "_failed.json")).upload_from_string(
+            json.dumps(failed_logs, ensure_ascii=False, indent=2),
+            content_type='application/json'
+        )
+    snippet_total = sum(len(v["tags"]) + len(v["themes"]) for v in all_results.values())
+    logger.info(f"✅ 推薦短句解析完成：{len(all_results)} 家、共 {snippet_total} 句 | 失敗 {len(failed_logs)} 家")
+    logger.info(f"✅ 已上傳至 GCS: {gcs_output_path}")
+
+
+if __name__ == "__main__":
+    process_snippet_results(
+        os.getenv("PROJECT_ID"),
+        os.getenv("BUCKET_NAME"),
+        os.getenv("GCS_SNIPPET_PREDICTION_FOLDER", "batch_output/reason_snippets/"),
+        os.getenv("GCS_REASON_SNIPPETS_PATH", "transform/stageC/reason_snippets.json")
+    )
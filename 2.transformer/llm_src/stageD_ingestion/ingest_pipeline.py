@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource  # 只有 Unix 有，用來回報峰值記憶體
+except ImportError:
+    resource = None
+
+# ==========================================
+# 參數配置區
+# ==========================================
+INGEST_DOWNLOAD_WORKERS = int(os.getenv("INGEST_DOWNLOAD_WORKERS", 4))  # 同時串流幾個分片
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", 2))        # 解析 JSON + 組裝文件 (受 GIL 限制，開多效益有限)
+INGEST_WRITE_WORKERS = int(os.getenv("INGEST_WRITE_WORKERS", 2))        # 同時進行的 bulk_write (每條多佔一包文件的記憶體)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))              # 讀取 -> 解析的佇列最多積幾包，滿了讀取端就等
+INGEST_CHUNK_LINES = int(os.getenv("INGEST_CHUNK_LINES", 200))          # 讀取端每幾行打包交給解析端
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))            # 每次 bulk_write 的筆數
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def peak_rss_mb():
+    """目前行程的峰值常駐記憶體 (MB)；不支援的平台回傳 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位是 KB，macOS 是 bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class ParallelShardIngestor:
+    """
+    向量分片的三段式匯入管線：
+        讀取 (多個分片同時以 blob.open 串流，不落地暫存檔)
+        -> 解析 (worker 把每行轉成寫入操作，湊滿一批才往下送)
+        -> 寫入 (多個 writer 同時 bulk_write(ordered=False))
+    段與段之間是有上限的佇列，寫入跟不上時讀取端會被擋住，記憶體用量只跟佇列大小與 worker 數有關，與分片大小無關。
+    parse_line(line, where) 回傳 [(集合代號, 寫入操作), ...]，集合代號對應建構時給的 collections；
+    寫入操作為 None 代表內容沒變、不需要寫，只計入 {集合代號}_skipped。
+    """
+    def __init__(self, collections: dict, download_workers: int = None, parse_workers: int = None,
+                 write_workers: int = None, queue_size: int = None, chunk_lines: int = None, batch_size: int = None):
+        self.collections = collections
+        self.download_workers = max(1, download_workers or INGEST_DOWNLOAD_WORKERS)
+        self.parse_workers = max(1, parse_workers or INGEST_PARSE_WORKERS)
+        self.write_workers = max(1, write_workers or INGEST_WRITE_WORKERS)
+        self.queue_size = max(1, queue_size or INGEST_QUEUE_SIZE)
+        self.chunk_lines = max(1, chunk_lines or INGEST_CHUNK_LINES)
+        self.batch_size = max(1, batch_size or INGEST_BATCH_SIZE)
+
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self.counters = {}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def _read_blob(self, blob, line_queue):
+        short_name = blob.name.split('/')[-1]
+        logger.info(f"📥 開始串流分片: {short_name}")
+        chunk, start_line = [], 1
+        try:
+            with blob.open("r", encoding="utf-8") as f:
+                for line_num, line in enumerate(f, start=1):
+                    chunk.append(line)
+                    if len(chunk) >= self.chunk_lines:
+                        line_queue.put((short_name, start_line, chunk))
+                        chunk, start_line = [], line_num + 1
+            if chunk:
+                line_queue.put((short_name, start_line, chunk))
+            self._count("blobs")
+        except Exception as e:
+            logger.error(f"❌ 分片串流失敗 {short_name}: {e}")
+            self._count("failed_blobs")
+
+    def _parse_worker(self, parse_line, line_queue, write_queue):
+        while True:
+            item = line_queue.get()
+            if item is _STOP:
+                break
+            short_name, start_line, lines = item
+            for offset, line in enumerate(lines):
+                line = line.strip()
+                if not line:
+                    continue
+                where = f"{short_name} 第 {start_line + offset} 行"
+                try:
+                    results = parse_line(line, where)
+                except Exception as e:
+                    # 單行壞掉不能讓整個 worker 停掉，否則上游的佇列會永遠卡住
+                    logger.error(f"❌ [{where}] 解析錯誤: {e}")
+                    continue
+                for target, op in results:
+                    if op is None:
+                        self._count(f"{target}_skipped")  # 內容沒變，不需要寫入
+                        continue
+                    full = None
+                    # 所有解析 worker 共用同一組批次緩衝，在途的文件數才不會隨 worker 數倍增
+                    with self._lock:
+                        buf = self._buffers.setdefault(target, [])
+                        buf.append(op)
+                        if len(buf) >= self.batch_size:
+                            full, self._buffers[target] = buf, []
+                    if full:
+                        write_queue.put((target, full))
+            self._count("lines", len(lines))
+
+    def _write_worker(self, write_queue):
+        while True:
+            item = write_queue.get()
+            if item is _STOP:
+                break
+            target, ops = item
+            try:
+                # 每筆都是以唯一鍵 upsert，彼此沒有先後依賴，不需要照順序寫
+                self.collections[target].bulk_write(ops, ordered=False)
+                self._count(target, len(ops))
+            except Exception as e:
+                logger.error(f"❌ 寫入 {target} 失敗 ({len(ops)} 筆): {e}")
+                self._count("failed_ops", len(ops))
+
+    def run(self, blobs, parse_line) -> dict:
+        """跑完整條管線並回傳統計 (各集合寫入筆數、docs/sec、峰值記憶體)"""
+        start = time.perf_counter()
+        self._buffers = {}
+        line_queue = queue.Queue(maxsize=self.queue_size)
+        # 解析後的向量是 Python float list，一包 500 筆就要 20~30 MB：寫入端只預留一包待寫，其餘由解析端等待
+        write_queue = queue.Queue(maxsize=1)
+
+        parsers = [threading.Thread(target=self._parse_worker, args=(parse_line, line_queue, write_queue), daemon=True)
+                   for _ in range(self.parse_workers)]
+        writers = [threading.Thread(target=self._write_worker, args=(write_queue,), daemon=True)
+                   for _ in range(self.write_workers)]
+        for t in parsers + writers:
+            t.start()
+
+        with ThreadPoolExecutor(max_workers=self.download_workers) as pool:
+            list(pool.map(lambda b: self._read_blob(b, line_queue), blobs))
+
+        # 依序收尾：讀完才停解析端，解析端的尾批送出後才停寫入端
+        for _ in parsers:
+            line_queue.put(_STOP)
+        for t in parsers:
+            t.join()
+        for target, buf in self._buffers.items():
+            if buf:
+                write_queue.put((target, buf))
+        for _ in writers:
+            write_queue.put(_STOP)
+        for t in writers:
+            t.join()
+
+        elapsed = time.perf_counter() - start
+        docs = sum(self.counters.get(target, 0) for target in self.collections)
+        return {
+            **{target: self.counters.get(target, 0) for target in self.collections},
+            **{f"{target}_skipped": self.counters.get(f"{target}_skipped", 0) for target in self.collections},
+            "blobs": self.counters.get("blobs", 0),
+            "failed_blobs": self.counters.get("failed_blobs", 0),
+            "lines": self.counters.get("lines", 0),
+            "failed_ops": self.counters.get("failed_ops", 0),
+            "seconds": round(elapsed, 2),
+            "docs_per_sec": round(docs / elapsed, 1) if elapsed else 0.0,
+            "peak_rss_mb": peak_rss_mb()
+        }
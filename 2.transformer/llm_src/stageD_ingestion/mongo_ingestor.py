@@ -3,13 +3,15 @@ import json
 import os
 import re
 import logging
-import io
-import ast
-import time
+import hashlib
+import threading
 from datetime import datetime, timezone
 from google.cloud import storage
 from pymongo import MongoClient, UpdateOne, GEOSPHERE, DESCENDING
 from dotenv import load_dotenv
+from llm_src.stageD_ingestion.ingest_pipeline import ParallelShardIngestor
+from llm_src.utils.table_io import read_table, SCENARIO_SCHEMA
+from configs.budget_config import REVIEWS_PER_STORE_SERVED
 
 load_dotenv()
 # ==========================================
@@ -24,10 +26,27 @@ BUCKET_NAME = os.getenv("BUCKET_NAME")
 GCS_RAW_STORE_PATH = os.getenv("GCS_RAW_STORE_PATH")
 GCS_EMBEDDING_RESULTS_FOLDER = os.getenv("GCS_EMBEDDING_RESULTS_FOLDER") # 指向 Vertex AI 產出的母目錄
 GCS_SCORED_FILE_PATH = os.getenv("GCS_FINAL_SCORED_PATH") # 指向 Stage B 的產出
-GCS_NAME_CLEAN_PATH = os.getenv("GCS_NAME_CLEAN_PATH", "transform/stage0/name_clean_finished.csv")
+GCS_NAME_CLEAN_PATH = os.getenv("GCS_NAME_CLEAN_PATH", "transform/stage0/name_clean_finished.parquet")
 GCS_CHAIN_MAPPING_PATH = os.getenv("GCS_CHAIN_MAPPING_PATH", "transform/stage0/config/chain_store_mapping.json")
 GCS_STORE_DYNAMIC_PATH = os.getenv("GCS_STORE_DYNAMIC_PATH", "raw/store_dynamic/store_dynamic.csv")
-GCS_SCENARIO_CSV_PATH = os.getenv("GCS_SCENARIO_CSV_PATH", "transform/stageB/cafes_with_scenarios_final.csv")
+GCS_SCENARIO_CSV_PATH = os.getenv("GCS_SCENARIO_CSV_PATH", "transform/stageB/cafes_with_scenarios_final.parquet")
+GCS_REASON_SNIPPETS_PATH = os.getenv("GCS_REASON_SNIPPETS_PATH", "transform/stageC/reason_snippets.json")
+
+MAX_REVIEWS_PER_CAFE = REVIEWS_PER_STORE_SERVED # 評論上限 (與 Stage C 向量配額同一個設定，見 configs/budget_config.py)
+# 改了 Schema 或要重建向量索引時設為 true，忽略內容雜湊整份重寫
+INGEST_FORCE_FULL_WRITE = os.getenv("INGEST_FORCE_FULL_WRITE", "false").lower() == "true"
+# 不參與雜湊的欄位 (每次都會變)
+HASH_EXCLUDED_FIELDS = {"last_updated"}
+# 四大情境 (scenario CSV 的 score_* / tags_score_* 欄位)
+THEME_FIELDS = ["workspace", "dating", "pet_friendly", "relax"]
+# 各資料表實際用到的欄位 (讀取時只讀這些)
+STORE_TABLE_COLUMNS = {
+    "base": ["name", "types", "location", "formatted_address", "price_level", "business_status",
+             "formatted_phone_number", "website", "google_maps_url", "opening_hours"],
+    "name_clean": ["final_name", "branch_y"],
+    "dynamic": ["rating", "user_ratings_total"],
+    "scenario": [f"{prefix}_{theme}" for theme in THEME_FIELDS for prefix in ("score", "tags_score")],
+}
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -80,12 +99,98 @@ def parse_opening_hours_to_periods(hours_string):
             except: continue
     return sorted(periods, key=lambda x: (x['day'], x['open']))
 
-def safe_eval_list(val):
-    """安全地把字串 "['店貓', '甜點']" 轉回真正的 Python List"""
-    try:
-        return ast.literal_eval(str(val)) if pd.notna(val) else []
-    except:
-        return []
+def _column(df, name):
+    """取欄位；CSV 沒有這個欄位時回傳全空的欄位，對應舊版 row.get() 拿到 None 的行為"""
+    return df[name] if name in df.columns else pd.Series([None] * len(df), index=df.index, dtype=object)
+
+def _str_or_none(series):
+    return [str(v) if pd.notna(v) else None for v in series.tolist()]
+
+def build_store_fields(place_ids, base_df, name_clean_df, dynamic_df, scenario_df, chain_mapping):
+    """
+    店家文件中來自 CSV 的部分 (店名、四大情境、星等、位置、營業時間...)，以 place_id 一次合併四張表後逐欄轉換，
+    回傳 {place_id: 欄位 dict}。取代逐行 iterrows 建字典、每份文件再查五次表與 literal_eval 的作法。
+    """
+    frame = pd.DataFrame({"place_id": pd.Series(list(place_ids), dtype=object).drop_duplicates()})
+    for df, columns in (
+        (base_df, STORE_TABLE_COLUMNS["base"]),
+        (name_clean_df, STORE_TABLE_COLUMNS["name_clean"]),
+        (dynamic_df, STORE_TABLE_COLUMNS["dynamic"]),
+        (scenario_df, STORE_TABLE_COLUMNS["scenario"]),
+    ):
+        if df is None or df.empty:
+            continue
+        # 同一個 place_id 出現多次時以最後一筆為準 (與舊版 dict 覆寫的結果相同)
+        df = df[[c for c in columns if c in df.columns and c not in frame.columns] + ["place_id"]]
+        frame = frame.merge(df.drop_duplicates("place_id", keep="last"), on="place_id", how="left")
+
+    # --- 店名：清洗後店名 -> 原始店名，再查連鎖品牌字典 ---
+    original_names = _str_or_none(_column(frame, "name"))
+    clean_names = _str_or_none(_column(frame, "final_name"))
+    final_names = []
+    for clean, original in zip(clean_names, original_names):
+        raw_final_name = clean if clean is not None else original
+        final_names.append(chain_mapping.get(raw_final_name, raw_final_name))
+    branches = [v if v is not None else "0" for v in _str_or_none(_column(frame, "branch_y"))]
+
+    # --- 四大情境：分數轉 float；標籤已由 read_table 轉成 list (Parquet 原生、舊 CSV 讀取時解析) ---
+    theme_scores = {t: pd.to_numeric(_column(frame, f"score_{t}"), errors="coerce").fillna(0.0).astype(float).tolist()
+                    for t in THEME_FIELDS}
+    theme_tags = {t: [list(v) if isinstance(v, list) else [] for v in _column(frame, f"tags_score_{t}").tolist()]
+                  for t in THEME_FIELDS}
+
+    ratings = pd.to_numeric(_column(frame, "rating"), errors="coerce").fillna(0.0).astype(float).tolist()
+    review_amounts = pd.to_numeric(_column(frame, "user_ratings_total"), errors="coerce").fillna(0).astype(int).tolist()
+
+    # --- 位置：WKT 一次用 str.extract 解析 ---
+    wkt = pd.Series([v if isinstance(v, str) else None for v in _column(frame, "location").tolist()], dtype=object)
+    coords = wkt.str.extract(r'POINT\s*\(([-\d.]+)\s+([-\d.]+)\)').astype(float)
+    locations = [{"type": "Point", "coordinates": [lng, lat]} if pd.notna(lng) else None
+                 for lng, lat in zip(coords[0].tolist(), coords[1].tolist())]
+    area_infos = _column(frame, "formatted_address").map(extract_area_info).tolist()
+
+    # --- 屬性與聯絡資訊 ---
+    kick_tags = {'point_of_interest', 'establishment', 'store'}
+    types_lists = []
+    for raw_types in _str_or_none(_column(frame, "types")):
+        types_list = [t.strip() for t in raw_types.split(',') if t.strip() not in kick_tags] if raw_types is not None else []
+        if 'cafe' not in types_list: types_list.append('cafe')
+        types_lists.append(types_list)
+    price_levels = [float(v) if pd.notna(v) else None
+                    for v in pd.to_numeric(_column(frame, "price_level"), errors="coerce").tolist()]
+    statuses = [v if v is not None else "OPERATIONAL" for v in _str_or_none(_column(frame, "business_status"))]
+    phones = _str_or_none(_column(frame, "formatted_phone_number"))
+    websites = _str_or_none(_column(frame, "website"))
+    map_urls = _str_or_none(_column(frame, "google_maps_url"))
+
+    # --- 營業時間 ---
+    hours = _column(frame, "opening_hours")
+    periods = hours.map(parse_opening_hours_to_periods).tolist()
+    is_24_hours = [pd.notna(v) and "24 小時" in str(v) for v in hours.tolist()]
+
+    store_fields = {}
+    for i, place_id in enumerate(frame["place_id"].tolist()):
+        fields = {
+            "original_name": original_names[i],
+            "final_name": final_names[i],
+            "branch": branches[i],
+            "ratings": {"rating": ratings[i], "review_amount": review_amounts[i]},
+            "location": locations[i],
+            "area_info": area_infos[i],
+            "attributes": {"price_level": price_levels[i], "business_status": statuses[i], "types": types_lists[i]},
+            "contact": {"phone": phones[i], "website": websites[i], "google_maps_url": map_urls[i]},
+            "opening_hours": {"periods": periods[i], "is_24_hours": is_24_hours[i]},
+        }
+        for t in THEME_FIELDS:
+            fields[f"score_{t}"] = theme_scores[t][i]
+            fields[f"tags_{t}"] = theme_tags[t][i]
+        store_fields[place_id] = fields
+    return store_fields
+
+def content_hash(value):
+    """穩定的內容雜湊：key 排序後序列化，同樣的內容跨次執行結果一致"""
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
 
 class MongoFinalIngestor:
     def __init__(self, mongo_uri, db_name, PROJECT_ID, BUCKET_NAME):
@@ -107,6 +212,10 @@ class MongoFinalIngestor:
         self.review_col.create_index("doc_id", unique=True)
         self.review_col.create_index("parent_place_id")
 
+        # 評論上限的退回計數 (解析 worker 共用)
+        self._review_counts = {}
+        self._review_lock = threading.Lock()
+
     def _get_latest_prediction_blob(self, folder_path):
         """
         [架構師優化]：自動在輸出資料夾中找尋包含 'predictions' 的最新 JSONL
@@ -122,34 +231,21 @@ class MongoFinalIngestor:
         prediction_blobs.sort(key=lambda x: x.updated, reverse=True)
         return prediction_blobs[0]
     
-    def _load_base_csv_to_map(self, gcs_base_csv_path):
-        """讀取 GCS 上的基礎 CSV，並轉為以 place_id 為 Key 的字典"""
-        logger.info(f"📂 正在載入基礎物理資料: {gcs_base_csv_path}")
-        blob = self.bucket.blob(gcs_base_csv_path)
-        content = blob.download_as_bytes()
-        
-        df = pd.read_csv(io.BytesIO(content), header=0, quotechar='"', encoding='utf-8-sig')
-        logger.info(f"📊 CSV 實際包含的欄位有: {list(df.columns)}")
-
-        # 轉換為 dict，方便 O(1) 尋找
-        raw_store_map = {str(row['place_id']): row for _, row in df.iterrows() if pd.notna(row['place_id'])}
-        return raw_store_map
-    
-    def _load_csv_to_map(self, gcs_path):
-        """萬用 CSV 載入器：讀取 GCS 上的 CSV，並轉為以 place_id 為 Key 的字典"""
-        logger.info(f"📂 正在載入附加資料表: {gcs_path}")
+    def _load_frame(self, gcs_path, table, required=False):
+        """讀取 GCS 上的資料表 (CSV 或 Parquet，只讀需要的欄位)，place_id 統一為字串；附加資料表不存在時回傳 None"""
+        logger.info(f"📂 正在載入資料表: {gcs_path}")
         blob = self.bucket.blob(gcs_path)
-        
-        if not blob.exists():
-            logger.warning(f"⚠️ 找不到附加資料表 {gcs_path}，將回傳空字典。")
-            return {}
-            
-        content = blob.download_as_bytes()
-        # 信任 CSV 本身的 Header，不強制覆寫 names
-        df = pd.read_csv(io.BytesIO(content), header=0, quotechar='"', encoding='utf-8-sig')
-        
-        # 轉為 O(1) 尋找的 Hash Map
-        return {str(row['place_id']): row for _, row in df.iterrows() if pd.notna(row.get('place_id'))}
+
+        if not required and not blob.exists():
+            logger.warning(f"⚠️ 找不到附加資料表 {gcs_path}，該表欄位將使用預設值。")
+            return None
+
+        df = read_table(self.bucket, gcs_path, columns=["place_id"] + STORE_TABLE_COLUMNS[table],
+                        schema=SCENARIO_SCHEMA if table == "scenario" else None)
+        if required:
+            logger.info(f"📊 實際讀到的欄位有: {list(df.columns)}")
+        df = df[df['place_id'].notna()]
+        return df.assign(place_id=df['place_id'].astype(str))
     
     def _load_chain_mapping(self, config_path):
         """[架構師優化]：載入連鎖品牌正規化字典"""
@@ -167,6 +263,154 @@ class MongoFinalIngestor:
             logger.error(f"❌ 解析正規化字典失敗: {e}")
             return {}
 
+    def _load_reason_snippets(self, gcs_path):
+        """載入 Stage C 預生成的推薦短句 (可選)：沒有這份檔案時服務端會退回即時呼叫 ReasonAgent"""
+        blob = self.bucket.blob(gcs_path)
+        if not blob.exists():
+            logger.warning(f"⚠️ 找不到推薦短句 {gcs_path}，本次匯入不寫入 reason_snippets。")
+            return {}
+        try:
+            snippets = json.loads(blob.download_as_text(encoding='utf-8'))
+            logger.info(f"📂 已載入 {len(snippets)} 家店的推薦短句")
+            return snippets
+        except Exception as e:
+            logger.error(f"❌ 解析推薦短句失敗: {e}")
+            return {}
+
+
+    def _load_known_hashes(self, col, key_field):
+        """資料庫現有文件的內容雜湊 {key: {"content_hash", "field_hashes"}}，用來略過沒變的文件"""
+        if INGEST_FORCE_FULL_WRITE:
+            logger.info(f"♻️ INGEST_FORCE_FULL_WRITE 已開啟，{col.name} 將整份重寫")
+            return {}
+        known = {}
+        for doc in col.find({"content_hash": {"$exists": True}}, {key_field: 1, "content_hash": 1, "field_hashes": 1, "_id": 0}):
+            known[doc.get(key_field)] = doc
+        logger.info(f"🔑 {col.name} 已有 {len(known)} 筆內容雜湊")
+        return known
+
+    def _diff_update(self, key_field, doc, known):
+        """
+        依欄位雜湊產生最小的寫入：內容完全相同回傳 None (略過)，否則只 $set 有變動的欄位。
+        known 為 None 代表新文件或舊資料還沒有雜湊，整份寫入。
+        """
+        field_hashes = {k: content_hash(v) for k, v in doc.items() if k not in HASH_EXCLUDED_FIELDS}
+        doc_hash = content_hash(field_hashes)
+        if known and known.get("content_hash") == doc_hash:
+            return None
+        old_hashes = (known or {}).get("field_hashes") or {}
+        changed = {k: v for k, v in doc.items() if k in HASH_EXCLUDED_FIELDS or field_hashes[k] != old_hashes.get(k)}
+        changed.update({"content_hash": doc_hash, "field_hashes": field_hashes})
+        return UpdateOne({key_field: doc[key_field]}, {"$set": changed}, upsert=True)
+
+    def _take_review_slot(self, place_id, doc_id):
+        """
+        評論上限判斷。custom_id 是 Stage C 依品質排好的 {place_id}_rev_{名次}，直接看名次，
+        分片平行解析時抵達順序不固定，結果仍與循序處理相同；格式不符的資料才退回依抵達順序計數。
+        """
+        rank = str(doc_id).rsplit("_rev_", 1)
+        if len(rank) == 2 and rank[1].isdigit():
+            return int(rank[1]) < MAX_REVIEWS_PER_CAFE
+        with self._review_lock:
+            current_count = self._review_counts.get(place_id, 0)
+            if current_count >= MAX_REVIEWS_PER_CAFE:
+                return False
+            self._review_counts[place_id] = current_count + 1
+            return True
+
+    def _line_to_ops(self, line, where, lookups):
+        """把向量分片的一行轉成 [(集合代號, UpdateOne 或 None=內容沒變)]，壞資料回傳空 list。會被多個解析 worker 同時呼叫，lookups 只讀不寫"""
+        try:
+            # 嘗試解析 JSON
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            # 🌟 防護罩：印出到底是哪一行、長什麼樣子導致解析失敗
+            logger.error(f"❌ [{where}] JSON 解析失敗: {e}")
+            # 使用 repr() 把隱藏的換行符號 \n 或特殊字元現形，最多印出前 200 個字元防洗版
+            logger.error(f"🔍 兇手字串長這樣: {repr(line[:200])}...")
+            return [] # 放棄這筆髒資料，繼續拯救下一筆！
+
+        vector = data.get("embedding_1536") or data.get("embedding")
+        if not vector:
+            # 如果是從 Vertex AI 產出的原始 JSONL，向量可能在 response.predictions[0].embeddings.values
+            # 這裡根據你解析後的內容調整
+            vector = data.get("response", {}).get("predictions", [{}])[0].get("embeddings", {}).get("values")
+
+        if not vector:
+            logger.warning(f"⚠️ [{where}] 找不到向量資料，已跳過。")
+            return []
+
+        doc_type = data.get("doc_type")
+        scored_data_map, reason_snippets = lookups["scored"], lookups["reason_snippets"]
+
+        # ==========================================
+        # 邏輯 A：店家總表 (Cafes) -> 執行記憶體 Join
+        # ==========================================
+        if doc_type == "store_level":
+            place_id = data.get("custom_id")
+
+            # --- [三方資料 Join] ---
+            # [關鍵操作]：直接從 Ground Truth 提取完整資料，放棄有缺失的 safe_metadata
+            ai_data = scored_data_map.get(place_id, {})
+            meta_filter = ai_data.get("metadata_for_filtering", {})
+            # CSV 的部分已在 build_store_fields 合併並轉好型別
+            csv_fields = lookups["store_fields"].get(place_id)
+            if csv_fields is None:
+                csv_fields = build_store_fields([place_id], None, None, None, None, {})[place_id]
+
+            # 強制數值轉型防禦
+            raw_scores = meta_filter.get("feature_scores", {})
+            float_scores = {k: float(v) for k, v in raw_scores.items() if v is not None}
+
+            # --- 組裝終極版 Schema (對齊 v1.2) ---
+            store_node = {
+                "place_id": place_id,
+                **csv_fields,
+                "tags": meta_filter.get("tags", []),          
+                "features": meta_filter.get("features", {}),   
+                "scores": float_scores,                       
+                "vector": vector,                              
+                "summary": data.get("content", ""),            
+                "embedding_config": {
+                        "model": "gemini-embedding-001",
+                        "dimension": 1536,
+                        "stage": "Final_Merged"},
+                "last_updated": datetime.now(timezone.utc)
+            }
+
+            # 原始資料表沒有店名時，退回 Stage B 記錄的店名
+            if store_node["original_name"] is None:
+                store_node["original_name"] = str(ai_data.get("place_name"))
+            if store_node["final_name"] is None:
+                store_node["final_name"] = store_node["original_name"]
+
+            # 沒有短句的店不覆寫，保留上一輪的結果
+            if place_id in reason_snippets:
+                store_node["reason_snippets"] = reason_snippets[place_id]
+
+            return [("store", self._diff_update("place_id", store_node, lookups["known_stores"].get(place_id)))]
+
+        # ==========================================
+        # 邏輯 B：評論佐證表 (AI_embedding)
+        # ==========================================
+        elif doc_type == "review_level":
+            parent_place_id = data.get("parent_place_id")
+            if not parent_place_id:
+                return []
+            doc_id = data.get("custom_id")
+            if not self._take_review_slot(parent_place_id, doc_id):
+                return [] # 滿額了！無情略過，拯救資料庫空間
+
+            review_doc = {
+                "doc_id": doc_id,
+                "place_id": data.get("parent_place_id", ""),
+                "content": data.get("content", ""),
+                "embedding": vector,
+                "doc_type": "review_level"
+            }
+            return [("review", self._diff_update("doc_id", review_doc, lookups["known_reviews"].get(doc_id)))]
+
+        return []
 
     def process_and_upload(self, gcs_base_csv_path, gcs_vector_folder, gcs_scored_path, gcs_scenario_csv_path):
         """
@@ -198,207 +442,52 @@ class MongoFinalIngestor:
         
         # 3. 載入原始物理資料 (Base CSV)
         try:
-            raw_store_map = self._load_base_csv_to_map(gcs_base_csv_path)
-            name_clean_map = self._load_csv_to_map(GCS_NAME_CLEAN_PATH)
-            dynamic_map = self._load_csv_to_map(GCS_STORE_DYNAMIC_PATH)
-            scenario_map = self._load_csv_to_map(gcs_scenario_csv_path)
+            base_df = self._load_frame(gcs_base_csv_path, "base", required=True)
+            name_clean_df = self._load_frame(GCS_NAME_CLEAN_PATH, "name_clean")
+            dynamic_df = self._load_frame(GCS_STORE_DYNAMIC_PATH, "dynamic")
+            scenario_df = self._load_frame(gcs_scenario_csv_path, "scenario")
             chain_mapping = self._load_chain_mapping(GCS_CHAIN_MAPPING_PATH)
+            reason_snippets = self._load_reason_snippets(GCS_REASON_SNIPPETS_PATH)
         except Exception as e:
             logger.error(f"❌ 讀取基礎 CSV 失敗: {e}")
             return
 
-        cafes_ops = []
-        review_ops = []
-        batch_size = 500
-        counts = {"store": 0, "review": 0}
+        # 4. 以 place_id 一次合併四張表，逐欄轉好型別
+        place_ids = list(scored_data_map) + base_df['place_id'].tolist()
+        store_fields = build_store_fields(place_ids, base_df, name_clean_df, dynamic_df, scenario_df, chain_mapping)
+        logger.info(f"🧩 已合併 {len(store_fields)} 家店的 CSV 欄位")
 
-        review_counts = {} 
-        MAX_REVIEWS_PER_CAFE = int(os.getenv("MAX_REVIEWS_PER_CAFE", 5)) #評論上限
+        lookups = {
+            "scored": scored_data_map, "store_fields": store_fields, "reason_snippets": reason_snippets,
+            "known_stores": self._load_known_hashes(self.cafes_col, "place_id"),
+            "known_reviews": self._load_known_hashes(self.review_col, "doc_id")
+        }
+        self._review_counts = {}
 
         logger.info("🚀 開始執行【三方資料大融合】與寫入作業...")
-        
-        import tempfile
-        temp_dir = tempfile.gettempdir()
+        pipeline = ParallelShardIngestor({"store": self.cafes_col, "review": self.review_col})
+        logger.info(f"⚙️ 匯入管線: {len(batch_blobs)} 個分片 | 串流 {pipeline.download_workers} / 解析 {pipeline.parse_workers} / "
+                    f"寫入 {pipeline.write_workers} 條 | 佇列上限 {pipeline.queue_size} 包")
+        stats = pipeline.run(batch_blobs, lambda line, where: self._line_to_ops(line, where, lookups))
+        counts = {key: stats[key] for key in ("store", "review", "store_skipped", "review_skipped")}
+        logger.info(f"📊 讀取 {stats['lines']} 行，耗時 {stats['seconds']} 秒 | {stats['docs_per_sec']} docs/sec | "
+                    f"峰值記憶體 {stats['peak_rss_mb']} MB")
+
+        if stats["failed_blobs"] or stats["failed_ops"]:
+            logger.error(f"❌ {stats['failed_blobs']} 個分片讀取失敗、{stats['failed_ops']} 筆寫入失敗，不更新資料版本戳記。")
+            return
 
-        for blob_idx, vector_blob in enumerate(batch_blobs, start=1):
-            local_vector_path = os.path.join(temp_dir, f"vector_read_{blob_idx}_{int(time.time())}.jsonl")
-            
-            logger.info(f"📥 [{blob_idx}/{len(batch_blobs)}] 正在下載分片: {vector_blob.name.split('/')[-1]} ...")
-            vector_blob.download_to_filename(local_vector_path)
-
-            with open(local_vector_path, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, start=1):
-                    line = line.strip() # 去除頭尾空白與換行符號
-                    if not line: 
-                        continue # 完美略過純空白行
-                    try:
-                        # 嘗試解析 JSON
-                        data = json.loads(line)
-                        
-                    except json.JSONDecodeError as e:
-                        # 🌟 防護罩：印出到底是哪一行、長什麼樣子導致解析失敗
-                        logger.error(f"❌ [第 {line_num} 行] JSON 解析失敗: {e}")
-                        # 使用 repr() 把隱藏的換行符號 \n 或特殊字元現形，最多印出前 200 個字元防洗版
-                        logger.error(f"🔍 兇手字串長這樣: {repr(line[:200])}...")
-                        continue # 放棄這筆髒資料，繼續拯救下一筆！
-
-                    except Exception as e:
-                        logger.error(f"❌ [第 {line_num} 行] 發生未知錯誤: {e}")
-                        continue
-
-
-                    try:
-                        vector = data.get("embedding_1536") or data.get("embedding")
-                        if not vector:
-                            # 如果是從 Vertex AI 產出的原始 JSONL，向量可能在 response.predictions[0].embeddings.values
-                            # 這裡根據你解析後的內容調整
-                            vector = data.get("response", {}).get("predictions", [{}])[0].get("embeddings", {}).get("values")
-                        
-                        if not vector: 
-                            logger.warning(f"⚠️ [第 {line_num} 行] 找不到向量資料，已跳過。")
-                            continue
-
-                        doc_type = data.get("doc_type")
-                            
-                        # ==========================================
-                        # 邏輯 A：店家總表 (Cafes) -> 執行記憶體 Join
-                        # ==========================================
-                        if doc_type == "store_level":
-                            place_id = data.get("custom_id")
-                            
-                            # --- [三方資料 Join] ---
-                            # [關鍵操作]：直接從 Ground Truth 提取完整資料，放棄有缺失的 safe_metadata
-                            ai_data = scored_data_map.get(place_id, {})
-                            meta_filter = ai_data.get("metadata_for_filtering", {})
-                            phys_data = raw_store_map.get(place_id, pd.Series())
-                            clean_data = name_clean_map.get(place_id, pd.Series())
-                            dyn_data = dynamic_map.get(place_id, pd.Series())
-                            scene_data = scenario_map.get(place_id, pd.Series())
-
-                            # 解析 Types 邏輯 (來自 store_to_db)
-                            raw_types = phys_data.get('types')
-                            if pd.notna(raw_types):
-                                all_types = [t.strip() for t in str(raw_types).split(',')]
-                                kick_tags = {'point_of_interest', 'establishment', 'store'}
-                                types_list = [t for t in all_types if t not in kick_tags]
-                                if 'cafe' not in types_list: types_list.append('cafe')
-                            else:
-                                types_list = ['cafe']
-
-                            # 強制數值轉型防禦
-                            raw_scores = meta_filter.get("feature_scores", {})
-                            float_scores = {k: float(v) for k, v in raw_scores.items() if v is not None}
-                            
-                            coords = parse_wkt_point(phys_data.get('location'))
-                            # 如果有座標才建立 GeoJSON 結構，否則整包設為 None
-                            location_dict = {
-                                "type": "Point",
-                                "coordinates": coords
-                            } if coords[0] is not None else None
-
-                            rating_val = dyn_data.get('rating')
-                            review_count = dyn_data.get('user_ratings_total')
-
-                            # --- [字典轉換邏輯] ---
-                            # 1. 先取得原始清洗後的店名
-                            raw_final_name = str(clean_data.get('final_name')) if pd.notna(clean_data.get('final_name')) else str(phys_data.get('name'))
-                            # 2. 查字典：如果在字典裡就轉換，不在就保持原樣 (使用 dict.get 的預設值特性)
-                            final_name = chain_mapping.get(raw_final_name, raw_final_name)
-
-                            # --- 組裝終極版 Schema (對齊 v1.2) ---
-                            store_node = {
-                                "place_id": place_id,
-                                "original_name": str(phys_data.get('name', ai_data.get('place_name'))),
-                                "final_name": final_name,
-                                "branch": str(clean_data.get('branch_y')) if pd.notna(clean_data.get('branch_y')) else "0",
-                                #四大類別的分數與標籤
-                                "score_workspace": float(scene_data.get("score_workspace", 0.0)) if pd.notna(scene_data.get("score_workspace")) else 0.0,
-                                "tags_workspace": safe_eval_list(scene_data.get("tags_score_workspace")),
-                                "score_dating": float(scene_data.get("score_dating", 0.0)) if pd.notna(scene_data.get("score_dating")) else 0.0,
-                                "tags_dating": safe_eval_list(scene_data.get("tags_score_dating")),
-                                "score_pet_friendly": float(scene_data.get("score_pet_friendly", 0.0)) if pd.notna(scene_data.get("score_pet_friendly")) else 0.0,
-                                "tags_pet_friendly": safe_eval_list(scene_data.get("tags_score_pet_friendly")),
-                                "score_relax": float(scene_data.get("score_relax", 0.0)) if pd.notna(scene_data.get("score_relax")) else 0.0,
-                                "tags_relax": safe_eval_list(scene_data.get("tags_score_relax")),
-                                #星等與評論數
-                                "ratings": {
-                                    "rating": float(rating_val) if pd.notna(rating_val) else 0.0,
-                                    "review_amount": int(review_count) if pd.notna(review_count) else 0
-                                },
-                                "location": location_dict,
-                                "area_info": extract_area_info(phys_data.get('formatted_address')),
-                                "attributes": {
-                                    "price_level": float(phys_data['price_level']) if pd.notna(phys_data.get('price_level')) else None,
-                                    "business_status": str(phys_data.get('business_status')) if pd.notna(phys_data.get('business_status')) else "OPERATIONAL",
-                                    "types": types_list
-                                },
-                                "contact": {
-                                    "phone": str(phys_data['formatted_phone_number']) if pd.notna(phys_data.get('formatted_phone_number')) else None,
-                                    "website": str(phys_data['website']) if pd.notna(phys_data.get('website')) else None,
-                                    "google_maps_url": str(phys_data['google_maps_url']) if pd.notna(phys_data.get('google_maps_url')) else None
-                                },
-                                "opening_hours": {
-                                    "periods": parse_opening_hours_to_periods(phys_data.get('opening_hours')),
-                                    "is_24_hours": True if (pd.notna(phys_data.get('opening_hours')) and "24 小時" in str(phys_data.get('opening_hours'))) else False
-                                },
-                                "tags": meta_filter.get("tags", []),          
-                                "features": meta_filter.get("features", {}),   
-                                "scores": float_scores,                       
-                                "vector": vector,                              
-                                "summary": data.get("content", ""),            
-                                "embedding_config": {
-                                        "model": "gemini-embedding-001",
-                                        "dimension": 1536,
-                                        "stage": "Final_Merged"},
-                                "last_updated": datetime.now(timezone.utc)
-                            }
-
-                            cafes_ops.append(UpdateOne({"place_id": place_id}, {"$set": store_node}, upsert=True))
-                            counts["store"] += 1
-                            
-
-                        # ==========================================
-                        # 邏輯 B：評論佐證表 (AI_embedding)
-                        # ==========================================
-                        elif doc_type == "review_level":
-                            parent_place_id = data.get("parent_place_id")
-                            if not parent_place_id:
-                                continue
-                            current_count = review_counts.get(parent_place_id, 0)
-                            if current_count >= MAX_REVIEWS_PER_CAFE:
-                                continue # 滿額了！無情略過，拯救資料庫空間
-                            
-                            review_counts[parent_place_id] = current_count + 1
-                            doc_id = data.get("custom_id")
-                            review_doc = {
-                                "doc_id": doc_id,
-                                "place_id": data.get("parent_place_id", ""),
-                                "content": data.get("content", ""),
-                                "embedding": vector,
-                                "doc_type": "review_level"
-                            }
-                            review_ops.append(UpdateOne({"doc_id": doc_id}, {"$set": review_doc}, upsert=True))
-                            counts["review"] += 1
-
-                        # 批次提交
-                        if len(cafes_ops) >= batch_size:
-                            self.cafes_col.bulk_write(cafes_ops)
-                            cafes_ops = []
-                        if len(review_ops) >= batch_size:
-                            self.review_col.bulk_write(review_ops)
-                            review_ops = []
-
-                    except Exception as e:
-                        logger.error(f"❌ 解析錯誤: {e}")
-            if os.path.exists(local_vector_path):
-                os.remove(local_vector_path)
-                logger.info("🧹 已清除本地暫存檔案")
-
-        # 提交剩餘資料
-        if cafes_ops: self.cafes_col.bulk_write(cafes_ops)
-        if review_ops: self.review_col.bulk_write(review_ops)
-            
-        logger.info(f"🎉 任務達成！成功更新主表 {counts['store']} 筆，寫入評論表 {counts['review']} 筆。")
+        # 蓋上新的資料版本戳記，服務端的共用快取會據此自動失效；全部內容都沒變時沿用舊版本，快取不必重建
+        meta = {"finished_at": datetime.now(timezone.utc), "counts": counts}
+        ingest_version = None
+        if counts["store"] or counts["review"]:
+            ingest_version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+            meta["version"] = ingest_version
+        self.db["pipeline_meta"].update_one({"_id": "ingest"}, {"$set": meta}, upsert=True)
+
+        logger.info(f"🎉 任務達成！主表寫入 {counts['store']} 筆 / 未變略過 {counts['store_skipped']} 筆，"
+                    f"評論表寫入 {counts['review']} 筆 / 未變略過 {counts['review_skipped']} 筆。"
+                    f"(資料版本: {ingest_version or '未變更'})")
 
 if __name__ == "__main__":
     ingestor = MongoFinalIngestor(MONGO_URI, DB_NAME, PROJECT_ID, BUCKET_NAME)
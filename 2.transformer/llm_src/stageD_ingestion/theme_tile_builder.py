@@ -0,0 +1,129 @@
+import os
+import logging
+import time
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import MongoClient, ReplaceOne
+from dotenv import load_dotenv
+
+from llm_src.utils.geo_utils import iter_geohash_cells, geohash_cell_size, haversine_to_many
+
+load_dotenv()
+# ==========================================
+# 參數配置區
+# ==========================================
+MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = os.getenv("DB_NAME", "coffee_db")
+
+# 四大情境按鈕 (需與服務端 score_{theme} 欄位一致)
+THEMES = ["workspace", "dating", "pet_friendly", "relax"]
+
+TILE_PRECISION = int(os.getenv("THEME_TILE_PRECISION", 6))     # geohash 精度 (6 ≈ 1.2km x 0.6km)
+TILE_TOP_K = int(os.getenv("THEME_TILE_TOP_K", 60))            # 每格每情境保留的候選數
+THEME_RADIUS_M = float(os.getenv("THEME_TILE_RADIUS_M", 3000)) # 服務端情境搜尋半徑
+THEME_MIN_SCORE = float(os.getenv("THEME_TILE_MIN_SCORE", 0.4))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class ThemeTileBuilder:
+    """
+    [離線預算] 情境按鈕的 geohash 分格 Top-K 名單。
+    每一格涵蓋「格子中心半徑 + 半對角線」內的店家，因此格內任一點的 3km 圓都會被完整包含 (含鄰格覆蓋)。
+    """
+    def __init__(self, mongo_uri, db_name):
+        self.client = MongoClient(mongo_uri)
+        self.db = self.client[db_name]
+        self.cafes_col = self.db["cafes"]
+        self.tiles_col = self.db["theme_tiles"]
+        self.meta_col = self.db["pipeline_meta"]
+
+    def _load_cafes(self):
+        projection = {"_id": 0, "place_id": 1, "location": 1}
+        projection.update({f"score_{t}": 1 for t in THEMES})
+
+        place_ids, lats, lngs = [], [], []
+        scores = {t: [] for t in THEMES}
+        for doc in self.cafes_col.find({"location": {"$ne": None}}, projection):
+            coords = (doc.get("location") or {}).get("coordinates") or [None, None]
+            if coords[0] is None or coords[1] is None:
+                continue
+            place_ids.append(doc["place_id"])
+            lngs.append(float(coords[0]))
+            lats.append(float(coords[1]))
+            for t in THEMES:
+                scores[t].append(float(doc.get(f"score_{t}") or 0.0))
+
+        return (np.array(place_ids, dtype=object), np.array(lats), np.array(lngs),
+                {t: np.array(v) for t, v in scores.items()})
+
+    def build(self):
+        start = time.time()
+        place_ids, lats, lngs, scores = self._load_cafes()
+        if len(place_ids) == 0:
+            logger.error("❌ cafes 集合內沒有任何含座標的店家，無法建立情境分格。")
+            return
+
+        # 格子半對角線：保證格內任一點出發的 3km 都落在涵蓋範圍內
+        dlat, dlng = geohash_cell_size(TILE_PRECISION)
+        half_diag_m = haversine_to_many(0.0, 0.0, [dlat / 2], [dlng / 2])[0]
+        coverage_m = THEME_RADIUS_M + half_diag_m
+
+        # 將店家範圍向外擴張一個搜尋半徑 (1 度緯度約 111km)
+        pad_lat = coverage_m / 111000.0
+        pad_lng = coverage_m / (111000.0 * np.cos(np.radians(lats.mean())))
+        bounds = (lats.min() - pad_lat, lats.max() + pad_lat, lngs.min() - pad_lng, lngs.max() + pad_lng)
+
+        eligible = {t: scores[t] > THEME_MIN_SCORE for t in THEMES}
+        build_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        ops = []
+        cell_count = 0
+
+        for cell, c_lat, c_lng in iter_geohash_cells(*bounds, precision=TILE_PRECISION):
+            dists = haversine_to_many(c_lat, c_lng, lats, lngs)
+            in_range = dists <= coverage_m
+            if not in_range.any():
+                continue
+
+            themes_doc = {}
+            for t in THEMES:
+                idx = np.flatnonzero(in_range & eligible[t])
+                if idx.size == 0:
+                    continue
+                # 依情境分數由高到低，只留前 K 名
+                top = idx[np.argsort(-scores[t][idx], kind="stable")[:TILE_TOP_K]]
+                themes_doc[t] = place_ids[top].tolist()
+
+            if not themes_doc:
+                continue
+            ops.append(ReplaceOne({"_id": cell}, {"_id": cell, "themes": themes_doc, "build_id": build_id}, upsert=True))
+            cell_count += 1
+
+            if len(ops) >= 500:
+                self.tiles_col.bulk_write(ops, ordered=False)
+                ops = []
+
+        if ops:
+            self.tiles_col.bulk_write(ops, ordered=False)
+
+        # 清掉上一版殘留的格子，並更新版本戳記讓服務端重新載入
+        self.tiles_col.delete_many({"build_id": {"$ne": build_id}})
+        self.meta_col.update_one(
+            {"_id": "theme_tiles"},
+            {"$set": {
+                "build_id": build_id,
+                "precision": TILE_PRECISION,
+                "radius_m": THEME_RADIUS_M,
+                "top_k": TILE_TOP_K,
+                "cell_count": cell_count,
+                "built_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        logger.info(f"🎉 情境分格建立完成！共 {cell_count} 格 (精度 {TILE_PRECISION}, Top-{TILE_TOP_K})，耗時 {time.time() - start:.1f}s，版本: {build_id}")
+
+
+if __name__ == "__main__":
+    builder = ThemeTileBuilder(MONGO_URI, DB_NAME)
+    builder.build()
@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import logging
 from google.cloud import storage
@@ -9,6 +8,8 @@ from google.genai import types
 from dotenv import load_dotenv
 import vertexai
 from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from llm_src.utils.online_batch_runner import ConcurrentMicroBatchRunner, EMBED_BATCH_SIZE
+from llm_src.utils.embedding_cache import EmbeddingCache, EMBED_CACHE_ENABLED, EMBEDDING_DIMENSIONALITY, EMBEDDING_TASK_TYPE
 load_dotenv()
 
 # ==========================================
@@ -107,7 +108,7 @@ class OnlineMicroBatchLauncher:
         vertexai.init(project=project_id, location=location)
         self.storage_client = storage.Client(project=project_id)
         self.bucket_name = bucket_name
-        self.batch_size = 100
+        self.batch_size = EMBED_BATCH_SIZE
         self.max_retries = 3  # 🌟 設定每批次最大重試次數
 
 
@@ -122,88 +123,39 @@ class OnlineMicroBatchLauncher:
             error_msg = f"❌ GCS 找不到來源檔案: {input_path}"
             logger.error(error_msg)
             raise FileNotFoundError(error_msg)
+        in_blob.reload()  # 取得 generation，來源檔被覆寫後舊的進度清單就不再適用
 
         model = TextEmbeddingModel.from_pretrained(model_id)
 
-        # 斷點續傳機制
-        existing_blobs = list(bucket.list_blobs(prefix=output_folder))
-        existing_batches = [b.name for b in existing_blobs if "batch_" in b.name and b.name.endswith(".jsonl")]
-        
-        current_batch_index = len(existing_batches)
-        processed_count = current_batch_index * self.batch_size
+        # 新算出的向量順手寫進快取，下次 embed_builder 遇到相同文字就不必再送
+        cache = EmbeddingCache(bucket, model_id) if EMBED_CACHE_ENABLED else None
+
+        def embed(texts):
+            inputs = [TextEmbeddingInput(text=t, task_type=EMBEDDING_TASK_TYPE) for t in texts]
+            vectors = [e.values for e in model.get_embeddings(inputs, output_dimensionality=EMBEDDING_DIMENSIONALITY)]
+            if cache:
+                cache.add(texts, vectors)
+            return vectors
 
-        logger.info(f"♻️ 發現 {current_batch_index} 個已完成的分片。將從第 {processed_count} 筆資料開始接續執行...")
         # ==========================================
-        # 2. 流式讀取來源檔 (避免 OOM)
+        # 流式讀取來源檔 (避免 OOM)，併發送出、依配額自動調速，斷點續傳依進度清單
         # ==========================================
         logger.info(f"🚀 [Online 引擎] 開始以流式讀取處理資料...")
-        
-        # 只需要一個很小的暫存檔來存放當下的 100 筆
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-
-        with in_blob.open("r", encoding="utf-8") as f_in:
-            for _ in range(processed_count):
-                next(f_in, None)
-
-            batch = []
-            
-            for i, line in enumerate(f_in, start=processed_count):
-                if not line.strip(): continue
-                batch.append(json.loads(line))
-
-                # 當湊滿 100 筆，或是已經讀到檔案的最後一筆時，開始執行 AI 任務
-                if len(batch) == self.batch_size:
-                    self._process_and_upload_batch(batch, current_batch_index, output_folder, bucket, model, temp_dir)
-                    current_batch_index += 1
-                    batch = []
-            if batch:
-                self._process_and_upload_batch(batch, current_batch_index, output_folder, bucket, model, temp_dir)
-
+        runner = ConcurrentMicroBatchRunner(bucket, output_folder, embed,
+                                            batch_size=self.batch_size, max_retries=self.max_retries)
+        try:
+            with in_blob.open("r", encoding="utf-8") as f_in:
+                stats = runner.run(f_in, source=f"{input_path}#{in_blob.generation}")
+        finally:
+            # 中途失敗也把已算好的向量存起來，重跑時 embed_builder 就能直接命中
+            if cache:
+                cache.flush()
+                logger.info(f"💾 向量快取新增 {cache.counters['added']} 筆 ({cache.counters['parts_written']} 個分片)")
+
+        logger.info(f"📊 本輪完成 {stats['batches']} 個分片 / {stats['records']} 筆 (跳過 {stats['skipped']} 個已完成分片) | "
+                    f"{stats['records_per_sec']} 筆/秒 | 重試 {stats['retries']} 次 (限流 {stats['limiter_throttles']} 次) | "
+                    f"併發上限最高 {stats['limiter_peak_limit']}")
         logger.info(f"🎉 所有向量資料已成功分片寫入至 GCS 資料夾: gs://{self.bucket_name}/{output_folder}")
-    
-    def _process_and_upload_batch(self, batch, batch_index, output_folder, bucket, model, temp_dir):
-        texts = [item["content"] for item in batch]
-        success = False
-        
-        for attempt in range(self.max_retries):
-            try:
-                inputs = [TextEmbeddingInput(text=t, task_type="RETRIEVAL_DOCUMENT") for t in texts]
-                embeddings = model.get_embeddings(
-                    inputs,
-                    output_dimensionality=1536,
-                )
-                
-                # 將這 100 筆資料寫入本地暫存檔
-                # 檔名補零，例如 batch_00000.jsonl, batch_00001.jsonl
-                batch_filename = f"batch_{batch_index:05d}.jsonl"
-                local_batch_path = os.path.join(temp_dir, batch_filename)
-                
-                with open(local_batch_path, 'w', encoding='utf-8') as f_out:
-                    for j, embedding in enumerate(embeddings):
-                        result_record = batch[j]
-                        result_record["embedding_1536"] = embedding.values
-                        f_out.write(json.dumps(result_record, ensure_ascii=False) + '\n')
-                
-                # 上傳這個小分片到 GCS
-                gcs_destination = f"{output_folder}{batch_filename}"
-                out_blob = bucket.blob(gcs_destination)
-                out_blob.upload_from_filename(local_batch_path)
-                
-                # 上傳完畢立即刪除本地暫存檔，釋放空間
-                os.remove(local_batch_path)
-                
-                logger.info(f"✅ 完成分片上傳: {gcs_destination} (累積處理約 {(batch_index + 1) * self.batch_size} 筆)")
-                success = True
-                time.sleep(1) # API 速率控制
-                break
-                
-            except Exception as e:
-                logger.warning(f"⚠️ 分片 {batch_index} 發生錯誤 (第 {attempt+1}/{self.max_retries} 次): {e}")
-                time.sleep(5 * (attempt + 1))
-        
-        if not success:
-            raise Exception(f"❌ 分片 {batch_index} 重試失敗達上限，任務終止！")
 
 # ==========================================
 # [總司令部] 任務路由控制中心
@@ -224,10 +176,19 @@ if __name__ == "__main__":
         launcher = BatchJobLauncher(PROJECT_ID, LOCATION, BUCKET_NAME)
         launcher.submit(SOURCE_FILE, TASK_NAME, MODEL_ID)
         
+    elif TARGET_TASK == "SNIPPETS":
+        SOURCE_FILE = os.getenv("GCS_STAGE_C_SNIPPET_JSONL_PATH", "transform/stageC/vertex_job_reason_snippets.jsonl")
+        TASK_NAME = "reason_snippets"
+        MODEL_ID = "gemini-2.0-flash-001"
+
+        # 推薦短句與 Stage A 同樣走 Batch 引擎 (費用約為即時呼叫的一半)
+        launcher = BatchJobLauncher(PROJECT_ID, LOCATION, BUCKET_NAME)
+        launcher.submit(SOURCE_FILE, TASK_NAME, MODEL_ID)
+
     elif TARGET_TASK == "EMBEDDING":
         SOURCE_FILE = os.getenv("GCS_STAGE_C_EMBEDDING_JSONL_PATH", "transform/stageC/vertex_job_stage_c_embedding.jsonl")
         TASK_NAME = "embedding_generation"
-        MODEL_ID = "gemini-embedding-001"
+        MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "gemini-embedding-001")
         OUTPUT_FOLDER = os.getenv("GCS_EMBEDDING_RESULTS_OUTPUT", "batch_output/embedding_generation/")
 
         launcher = OnlineMicroBatchLauncher(PROJECT_ID, LOCATION, BUCKET_NAME)
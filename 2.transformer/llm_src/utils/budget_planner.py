@@ -0,0 +1,158 @@
+import os
+import json
+import logging
+import pandas as pd
+from io import BytesIO
+from google.cloud import storage
+from dotenv import load_dotenv
+from configs import budget_config as bc
+from llm_src.utils.token_budget import estimate_tokens
+from llm_src.utils.table_io import read_table
+from llm_src.utils.embedding_cache import EmbeddingCache, EMBED_CACHE_ENABLED, text_key
+from llm_src.utils.online_batch_runner import EMBED_BATCH_SIZE
+from llm_src.stage0_prep.review_prefilter_top50 import ReviewPreFilter
+from llm_src.stageA_extraction.A_StageA_Processor import StageA_OneStop_Processor
+from llm_src.stageC_embeddin.reason_snippet_builder import StageC_ReasonSnippet_Processor, NEGATIVE_TAGS
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# prompt 外框 (標題、分隔線、店名 / ID) 的固定開銷
+PROMPT_OVERHEAD_TOKENS = 40
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class PipelineBudgetPlanner:
+    """
+    [Dry-run] 依 configs/budget_config.py 試算這一輪管線會發出多少 LLM / embedding 呼叫與 token。
+    只讀 GCS 上的現有資料，不呼叫任何模型：
+        - 評論以 Stage 0 相同的品質排序蒸餾，再套各階段的配額與 token 預算
+        - Stage B 的店家總結 / 標籤這輪還沒產生，以上一輪留在 GCS 的檔案估算
+        - embedding 扣掉向量快取已有的文字
+    """
+    def __init__(self, project_id, bucket_name, gcs_raw_reviews_path, gcs_baseline_path, gcs_scored_data_path,
+                 gcs_name_regex_path, embedding_model_id):
+        self.client = storage.Client(project=project_id)
+        self.bucket = self.client.bucket(bucket_name)
+        self.prefilter = ReviewPreFilter(project_id, bucket_name, gcs_raw_reviews_path, None)
+        self.gcs_raw_reviews_path = gcs_raw_reviews_path
+        self.gcs_baseline_path = gcs_baseline_path
+        self.gcs_scored_data_path = gcs_scored_data_path
+        self.gcs_name_regex_path = gcs_name_regex_path
+        self.cache = EmbeddingCache(self.bucket, embedding_model_id) if EMBED_CACHE_ENABLED else None
+
+    def _load_json(self, path, default):
+        blob = self.bucket.blob(path) if path else None
+        if blob is None or not blob.exists():
+            logger.warning(f"⚠️ 找不到 {path}，相關階段以空資料估算")
+            return default
+        return json.loads(blob.download_as_text(encoding='utf-8'))
+
+    def _load_distilled_reviews(self) -> dict:
+        raw = pd.read_csv(BytesIO(self.bucket.blob(self.gcs_raw_reviews_path).download_as_bytes()))
+        distilled = self.prefilter.distill(raw)
+        return distilled.groupby('place_id')['content'].apply(list).to_dict()
+
+    def plan(self) -> dict:
+        reviews_map = self._load_distilled_reviews()
+        baseline = {str(item.get('place_id')): item for item in self._load_json(self.gcs_baseline_path, [])}
+        scored_map = self._load_json(self.gcs_scored_data_path, {})
+        plan = {}
+
+        # Stage 0：店名清洗 (每次呼叫送 NAME_CLEAN_BATCH_SIZE 家)
+        name_rows = 0
+        if self.gcs_name_regex_path and self.bucket.blob(self.gcs_name_regex_path).exists():
+            name_rows = len(read_table(self.bucket, self.gcs_name_regex_path, columns=['place_id']))
+        plan["stage0_name_clean"] = {"calls": _ceil_div(name_rows, bc.NAME_CLEAN_BATCH_SIZE), "items": name_rows}
+        plan["stage0_distill"] = {"stores": len(reviews_map), "reviews": sum(len(v) for v in reviews_map.values())}
+
+        # Stage A：官方主表的每家店一次呼叫
+        system_tokens = estimate_tokens(StageA_OneStop_Processor._build_system_instruction())
+        audit_input = audit_reviews = 0
+        for pid in (baseline or reviews_map):
+            selected = StageA_OneStop_Processor.select_reviews(reviews_map.get(pid, [])[:bc.REVIEWS_PER_STORE_AUDIT])
+            audit_reviews += len(selected)
+            audit_input += (system_tokens + PROMPT_OVERHEAD_TOKENS
+                            + estimate_tokens(StageA_OneStop_Processor.compact_baseline(baseline.get(pid, {})))
+                            + sum(estimate_tokens(r) + 1 for r in selected))
+        audit_calls = len(baseline or reviews_map)
+        plan["stageA_audit"] = {"calls": audit_calls, "reviews": audit_reviews, "input_tokens": audit_input,
+                                "max_output_tokens": audit_calls * bc.AUDIT_MAX_OUTPUT_TOKENS}
+
+        # Stage C：推薦短句 (有可用標籤的店才送；情境標籤以上一輪為準，這裡只看店家標籤)
+        snippet_tokens = estimate_tokens(StageC_ReasonSnippet_Processor._build_instruction())
+        snippet_calls = snippet_input = 0
+        for pid, store in scored_map.items():
+            tags = [t for t in store.get("metadata_for_filtering", {}).get("tags", []) if t not in NEGATIVE_TAGS]
+            if not tags:
+                continue
+            snippet_calls += 1
+            reviews = reviews_map.get(pid, [])[:bc.REVIEWS_PER_STORE_SNIPPET]
+            snippet_input += (snippet_tokens + PROMPT_OVERHEAD_TOKENS
+                              + estimate_tokens(store.get("content_for_embedding", "")[:bc.SNIPPET_SUMMARY_MAX_CHARS])
+                              + estimate_tokens(json.dumps(tags, ensure_ascii=False))
+                              + sum(estimate_tokens(str(r)[:bc.SNIPPET_MAX_CHARS_PER_REVIEW]) + 1 for r in reviews))
+        plan["stageC_snippets"] = {"calls": snippet_calls, "input_tokens": snippet_input,
+                                   "max_output_tokens": snippet_calls * bc.SNIPPET_MAX_OUTPUT_TOKENS}
+
+        # Stage C：向量 (店家總結 + 每店前幾則評論，扣掉快取命中)
+        texts = []
+        served_reviews = 0
+        for pid, store in scored_map.items():
+            texts.append(store.get("content_for_embedding", ""))
+            valid = [str(r).strip() for r in reviews_map.get(pid, []) if len(str(r).strip()) >= bc.MIN_EMBED_REVIEW_LENGTH]
+            selected = valid[:bc.REVIEWS_PER_STORE_EMBED]
+            texts.extend(selected)
+            served_reviews += min(len(selected), bc.REVIEWS_PER_STORE_SERVED)
+        keys = [text_key(t) for t in texts]
+        cached = self.cache.contains(keys) if self.cache else set()
+        misses = [t for t, k in zip(texts, keys) if k not in cached]
+        plan["stageC_embedding"] = {"texts": len(texts), "cache_hits": len(texts) - len(misses),
+                                    "calls": _ceil_div(len(misses), EMBED_BATCH_SIZE),
+                                    "input_tokens": sum(estimate_tokens(t) for t in misses)}
+
+        # Stage D：寫入 MongoDB 的文件數
+        plan["stageD_ingest"] = {"stores": len(scored_map), "reviews": served_reviews}
+        return plan
+
+    @staticmethod
+    def report(plan: dict):
+        logger.info("================ Pipeline Budget (dry-run) ================")
+        logger.info(f"📐 每店評論配額: 蒸餾 {bc.REVIEWS_PER_STORE_DISTILLED} / 審計 {bc.REVIEWS_PER_STORE_AUDIT} "
+                    f"(≤ {bc.AUDIT_REVIEW_TOKEN_BUDGET} tokens) / 短句 {bc.REVIEWS_PER_STORE_SNIPPET} / "
+                    f"向量 {bc.REVIEWS_PER_STORE_EMBED} / 寫入 {bc.REVIEWS_PER_STORE_SERVED}")
+        s0, d0 = plan["stage0_name_clean"], plan["stage0_distill"]
+        logger.info(f"🧹 Stage 0 店名清洗  : LLM 呼叫 {s0['calls']} 次 ({s0['items']} 家)")
+        logger.info(f"🧪 Stage 0 評論蒸餾  : {d0['stores']} 家 / {d0['reviews']} 則")
+        a = plan["stageA_audit"]
+        logger.info(f"🔍 Stage A 審計      : LLM 呼叫 {a['calls']} 次 | 評論 {a['reviews']} 則 | "
+                    f"輸入 ≈ {a['input_tokens']:,} tokens | 輸出上限 {a['max_output_tokens']:,} tokens")
+        c = plan["stageC_snippets"]
+        logger.info(f"✍️ Stage C 推薦短句  : LLM 呼叫 {c['calls']} 次 | "
+                    f"輸入 ≈ {c['input_tokens']:,} tokens | 輸出上限 {c['max_output_tokens']:,} tokens")
+        e = plan["stageC_embedding"]
+        hit_rate = e['cache_hits'] / e['texts'] if e['texts'] else 0.0
+        logger.info(f"🧬 Stage C 向量      : {e['texts']} 筆 (快取命中 {e['cache_hits']}，{hit_rate:.1%}) | "
+                    f"embedding 呼叫 {e['calls']} 次 | 輸入 ≈ {e['input_tokens']:,} tokens")
+        d = plan["stageD_ingest"]
+        logger.info(f"💾 Stage D 寫入      : 店家 {d['stores']} 筆 | 評論 {d['reviews']} 筆")
+        logger.info("===========================================================")
+
+
+if __name__ == "__main__":
+    CONFIG = {
+        "project_id": os.getenv("PROJECT_ID"),
+        "bucket_name": os.getenv("BUCKET_NAME"),
+        "gcs_raw_reviews_path": os.getenv("GCS_RAW_REVIEWS_PATH", "raw/comments/reviews_all.csv"),
+        "gcs_baseline_path": os.getenv("GCS_CAFE_DATA_FINAL_PATH", "transform/stage0/cafe_data_final.json"),
+        "gcs_scored_data_path": os.getenv("GCS_FINAL_SCORED_PATH", "transform/stageB/final_scored_data.json"),
+        "gcs_name_regex_path": os.getenv("GCS_NAME_REGEX_CLEAND"),
+        "embedding_model_id": os.getenv("EMBEDDING_MODEL_ID", "gemini-embedding-001")
+    }
+    planner = PipelineBudgetPlanner(**CONFIG)
+    PipelineBudgetPlanner.report(planner.plan())
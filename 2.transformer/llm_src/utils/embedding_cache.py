@@ -0,0 +1,131 @@
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# ==========================================
+# 參數配置區
+# ==========================================
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_PREFIX = os.getenv("GCS_EMBED_CACHE_PREFIX", "transform/stageC/embedding_cache/")
+EMBED_CACHE_FLUSH_ROWS = int(os.getenv("EMBED_CACHE_FLUSH_ROWS", 5000))  # 新向量累積幾筆寫成一個分片
+EMBED_CACHE_MAX_PARTS = int(os.getenv("EMBED_CACHE_MAX_PARTS", 32))      # 分片超過這個數量就在下次查詢時壓實
+
+EMBEDDING_DIMENSIONALITY = 1536
+EMBEDDING_TASK_TYPE = "RETRIEVAL_DOCUMENT"
+
+logger = logging.getLogger(__name__)
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    以內容定址的向量快取：(模型, 任務類型, 維度) 決定資料夾，資料夾內以 sha256(文字) 為鍵。
+    存成 GCS 上的 Parquet 分片 ({prefix}{model}_{task}_{dim}/part-*.parquet)，欄位為 text_sha256 + embedding (float32)；
+    每次只新增分片、不改舊分片，寫入失敗也不會弄壞既有快取。
+    """
+    def __init__(self, bucket, model_id: str, dimensionality: int = EMBEDDING_DIMENSIONALITY,
+                 task_type: str = EMBEDDING_TASK_TYPE, prefix: str = None, flush_rows: int = None):
+        self.bucket = bucket
+        self.dimensionality = dimensionality
+        self.folder = f"{prefix or EMBED_CACHE_PREFIX}{model_id}_{task_type}_{dimensionality}/"
+        self.flush_rows = max(1, flush_rows or EMBED_CACHE_FLUSH_ROWS)
+        self.schema = pa.schema([("text_sha256", pa.string()), ("embedding", pa.list_(pa.float32()))])
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_rows = 0
+        self._seq = 0
+        self.counters = {"added": 0, "parts_written": 0}
+
+    def _part_blobs(self) -> list:
+        return [b for b in self.bucket.list_blobs(prefix=self.folder) if b.name.endswith(".parquet")]
+
+    def _write_part(self, table: pa.Table):
+        self._seq += 1
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        name = f"{self.folder}part-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self._seq:04d}.parquet"
+        self.bucket.blob(name).upload_from_string(buffer.getvalue(), content_type="application/vnd.apache.parquet")
+        self.counters["parts_written"] += 1
+
+    def iter_hits(self, keys, compact: bool = None):
+        """
+        逐個分片串流讀取，產出 (key, 向量的 JSON 陣列字串)；同一個 key 只產出一次。
+        分片數超過 EMBED_CACHE_MAX_PARTS (或 compact=True) 時，順便把命中的向量重寫成新分片並刪掉舊分片，
+        這週沒用到的文字 (掉出 Top 30 的評論、改寫過的總結) 也就一併淘汰，快取大小跟著資料量走。
+        """
+        parts = self._part_blobs()
+        if not parts or not keys:
+            return
+        if compact is None:
+            compact = len(parts) > EMBED_CACHE_MAX_PARTS
+        wanted = pa.array(sorted(keys), type=pa.string())
+        seen = set()
+        for blob in parts:
+            parquet_file = pq.ParquetFile(io.BytesIO(blob.download_as_bytes()))
+            for batch in parquet_file.iter_batches(batch_size=self.flush_rows):
+                matched = batch.filter(pc.is_in(batch.column("text_sha256"), value_set=wanted))
+                if not matched.num_rows:
+                    continue
+                rows = []
+                for i, key in enumerate(matched.column("text_sha256").to_pylist()):
+                    if key not in seen:
+                        seen.add(key)
+                        rows.append(i)
+                matched = matched.take(pa.array(rows, type=pa.int64()))
+                if compact:
+                    self._append(pa.Table.from_batches([matched]).cast(self.schema))
+                # 在 Arrow 裡直接轉成最短的 float32 十進位字串並串成 JSON 陣列，
+                # 比轉成 Python float 再 json.dumps 快數倍，讀回來的 float32 值完全相同
+                vectors = pc.binary_join(matched.column("embedding").cast(pa.list_(pa.string())), ",")
+                for key, vector in zip(matched.column("text_sha256").to_pylist(), vectors.to_pylist()):
+                    yield key, f"[{vector}]"
+        if compact:
+            self.flush()
+            for blob in parts:
+                blob.delete()
+            logger.info(f"🗜️ 向量快取已壓實: {len(parts)} 個分片 -> {len(seen)} 筆")
+
+    def contains(self, keys) -> set:
+        """只讀 text_sha256 欄，回傳 keys 中已有向量的部分 (試算命中率用，不載入向量)"""
+        wanted = set(keys)
+        found = set()
+        for blob in self._part_blobs():
+            column = pq.read_table(io.BytesIO(blob.download_as_bytes()), columns=["text_sha256"]).column(0)
+            found.update(k for k in column.to_pylist() if k in wanted)
+        return found
+
+    def _append(self, table: pa.Table):
+        with self._lock:
+            self._pending.append(table)
+            self._pending_rows += table.num_rows
+            if self._pending_rows < self.flush_rows:
+                return
+            full, self._pending, self._pending_rows = self._pending, [], 0
+            self._write_part(pa.concat_tables(full))
+
+    def add(self, texts: list, vectors: list):
+        """記下新算好的向量 (多執行緒安全)，累積到 flush_rows 筆就寫成一個分片"""
+        if not texts:
+            return
+        table = pa.table({
+            "text_sha256": pa.array([text_key(t) for t in texts], type=pa.string()),
+            "embedding": pa.array([list(v) for v in vectors], type=pa.list_(pa.float32())),
+        })
+        with self._lock:
+            self.counters["added"] += len(texts)
+        self._append(table)
+
+    def flush(self):
+        with self._lock:
+            full, self._pending, self._pending_rows = self._pending, [], 0
+            if full:
+                self._write_part(pa.concat_tables(full))
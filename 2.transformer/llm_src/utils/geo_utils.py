@@ -0,0 +1,66 @@
+import math
+import numpy as np
+
+# 地球平均半徑 (公尺)，與 MongoDB $geoNear spherical 模式一致
+EARTH_RADIUS_M = 6371008.8
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lng, precision=6):
+    """將座標編碼為 geohash 字串 (需與 4.mongodb_serviceloop/geo.py 完全一致)"""
+    lat_rng = [-90.0, 90.0]
+    lng_rng = [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+
+    while len(chars) < precision:
+        rng, val = (lng_rng, lng) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+
+    return "".join(chars)
+
+
+def geohash_cell_size(precision):
+    """回傳指定精度下單一格子的 (緯度跨度, 經度跨度)，單位為度"""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def iter_geohash_cells(lat_min, lat_max, lng_min, lng_max, precision=6):
+    """列舉覆蓋指定範圍的所有格子，產出 (geohash, 中心緯度, 中心經度)"""
+    dlat, dlng = geohash_cell_size(precision)
+    lat_start = math.floor((lat_min + 90.0) / dlat) * dlat - 90.0
+    lng_start = math.floor((lng_min + 180.0) / dlng) * dlng - 180.0
+
+    lat = lat_start
+    while lat < lat_max:
+        lng = lng_start
+        while lng < lng_max:
+            c_lat, c_lng = lat + dlat / 2, lng + dlng / 2
+            yield geohash_encode(c_lat, c_lng, precision), c_lat, c_lng
+            lng += dlng
+        lat += dlat
+
+
+def haversine_to_many(lat, lng, lats, lngs):
+    """一點對多點的向量化球面距離 (公尺)"""
+    p1 = np.radians(lat)
+    p2 = np.radians(np.asarray(lats, dtype=float))
+    dlat = p2 - p1
+    dlng = np.radians(np.asarray(lngs, dtype=float) - lng)
+    a = np.sin(dlat / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
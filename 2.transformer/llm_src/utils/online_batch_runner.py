@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_src.utils.rate_control import AIMDLimiter, TokenBucket, is_throttled
+
+# ==========================================
+# 參數配置區
+# ==========================================
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))                    # 每個請求 / 分片的筆數
+EMBED_MAX_RPM = float(os.getenv("EMBED_MAX_RPM", 300))                        # 每分鐘最多送出幾個請求 (token bucket)
+EMBED_INITIAL_CONCURRENCY = int(os.getenv("EMBED_INITIAL_CONCURRENCY", 4))    # 起始併發數，之後由 AIMD 自動調整
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", 16))           # 併發上限
+EMBED_MAX_THROTTLE_RETRIES = int(os.getenv("EMBED_MAX_THROTTLE_RETRIES", 8))  # 單一分片被 429 擋回的重試上限
+EMBED_MANIFEST_FLUSH_SEC = float(os.getenv("EMBED_MANIFEST_FLUSH_SEC", 5))    # 進度清單最短寫回間隔
+
+MANIFEST_NAME = "_manifest.json"
+BATCH_ID_PATTERN = re.compile(r"batch_\d{5}")
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrentMicroBatchRunner:
+    """
+    即時 API 的併發微批次執行器 (不綁定特定模型，embed_fn(texts) -> [向量, ...] 由呼叫端提供)：
+        - 來源檔串流讀取，每 batch_size 筆非空行為一個分片，編號 batch_00000、batch_00001 ... 與來源順序固定對應
+        - 送出前先過 token bucket (RPM 上限)，在途分片數由 AIMD 控制：順利時慢慢加、遇到 429 砍半並退避重試
+        - 每個完成的分片記進 {output_folder}_manifest.json；續跑時只跳過清單上的分片，
+          來源檔或 batch_size 變了 (分片編號對不上) 就整批重跑
+    """
+    def __init__(self, bucket, output_folder: str, embed_fn, batch_size: int = None, max_retries: int = 3,
+                 max_rpm: float = None, initial_concurrency: int = None, max_concurrency: int = None,
+                 max_throttle_retries: int = None, base_backoff_sec: float = 1.0):
+        self.bucket = bucket
+        self.output_folder = output_folder if output_folder.endswith('/') else output_folder + '/'
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+        self.max_retries = max_retries
+        self.max_throttle_retries = max_throttle_retries or EMBED_MAX_THROTTLE_RETRIES
+        self.base_backoff_sec = base_backoff_sec
+
+        rpm = max_rpm or EMBED_MAX_RPM
+        self.rate_limiter = TokenBucket(rpm / 60.0, burst=max(1, int(rpm / 60.0)))
+        self.limiter = AIMDLimiter(initial=initial_concurrency or EMBED_INITIAL_CONCURRENCY,
+                                   maximum=max_concurrency or EMBED_MAX_CONCURRENCY)
+
+        self.manifest_path = f"{self.output_folder}{MANIFEST_NAME}"
+        self._lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+        self._completed = set()
+        self._source = None
+        self._last_flush = 0.0
+        self._failure = None
+        self.counters = {"batches": 0, "skipped": 0, "records": 0, "retries": 0}
+
+    # ------------------------------------------
+    # 進度清單
+    # ------------------------------------------
+    def _load_manifest(self, source: str) -> set:
+        blob = self.bucket.blob(self.manifest_path)
+        if not blob.exists():
+            return set()
+        try:
+            manifest = json.loads(blob.download_as_bytes())
+        except (ValueError, TypeError) as e:
+            logger.warning(f"⚠️ 進度清單無法解析，整批重跑: {e}")
+            return set()
+        if manifest.get("source") != source or manifest.get("batch_size") != self.batch_size:
+            logger.warning(f"⚠️ 進度清單屬於其他來源 ({manifest.get('source')}, batch_size={manifest.get('batch_size')})，"
+                           f"分片編號無法對應，整批重跑")
+            return set()
+        return set(manifest.get("completed", []))
+
+    def _flush_manifest(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < EMBED_MANIFEST_FLUSH_SEC:
+                return
+            self._last_flush = now
+            manifest = {"source": self._source, "batch_size": self.batch_size,
+                        "completed": sorted(self._completed), "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        # 上傳在鎖外進行，另一把鎖確保清單依序覆寫
+        with self._manifest_lock:
+            self.bucket.blob(self.manifest_path).upload_from_string(
+                json.dumps(manifest, ensure_ascii=False), content_type="application/json")
+
+    def _remove_stale_batches(self):
+        """
+        每次成功跑完 (含接續中斷的重跑) 都刪掉不在進度清單裡的分片，避免 Stage D 讀到舊向量：
+        整批重跑中途失敗時舊分片還在，接續那一輪同樣要清。
+        只動自己命名的 batch_00000 分片；同資料夾內其他來源的分片 (例如 batch_cached_*) 不碰。
+        """
+        stale = []
+        for blob in self.bucket.list_blobs(prefix=self.output_folder):
+            stem = blob.name[len(self.output_folder):]
+            if stem.endswith(".jsonl") and BATCH_ID_PATTERN.fullmatch(stem[:-len(".jsonl")]) \
+                    and stem[:-len(".jsonl")] not in self._completed:
+                stale.append(blob)
+        for blob in stale:
+            blob.delete()
+        if stale:
+            logger.info(f"🧹 已清除 {len(stale)} 個過期分片")
+
+    # ------------------------------------------
+    # 單一分片
+    # ------------------------------------------
+    def _embed_with_backoff(self, batch_id: str, texts: list) -> list:
+        errors = throttles = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                vectors = self.embed_fn(texts)
+                self.limiter.on_success()
+                return vectors
+            except Exception as e:
+                with self._lock:
+                    self.counters["retries"] += 1
+                if is_throttled(e):
+                    throttles += 1
+                    self.limiter.on_throttle()
+                    if throttles > self.max_throttle_retries:
+                        raise RuntimeError(f"分片 {batch_id} 連續被限流 {throttles} 次: {e}") from e
+                    # 指數退避加隨機抖動，避免同一波被擋的請求又同時打回去
+                    delay = min(60.0, self.base_backoff_sec * 2 ** (throttles - 1)) * random.uniform(0.5, 1.5)
+                    logger.warning(f"⏳ 分片 {batch_id} 遇到限流，{delay:.1f} 秒後重試 "
+                                   f"(併發上限降為 {int(self.limiter.limit)})")
+                else:
+                    errors += 1
+                    if errors >= self.max_retries:
+                        raise RuntimeError(f"分片 {batch_id} 重試失敗達上限: {e}") from e
+                    delay = 5 * errors
+                    logger.warning(f"⚠️ 分片 {batch_id} 發生錯誤 (第 {errors}/{self.max_retries} 次): {e}")
+                time.sleep(delay)
+
+    def _process_batch(self, batch_id: str, lines: list):
+        try:
+            if self._failure:
+                return
+            records = [json.loads(line) for line in lines]
+            vectors = self._embed_with_backoff(batch_id, [item["content"] for item in records])
+
+            payload = []
+            for record, vector in zip(records, vectors):
+                record["embedding_1536"] = list(vector)
+                payload.append(json.dumps(record, ensure_ascii=False))
+            # 直接從記憶體上傳，不經過本地暫存檔
+            self.bucket.blob(f"{self.output_folder}{batch_id}.jsonl").upload_from_string(
+                "\n".join(payload) + "\n", content_type="application/jsonl")
+
+            with self._lock:
+                self._completed.add(batch_id)
+                self.counters["batches"] += 1
+                self.counters["records"] += len(records)
+                done = self.counters["records"]
+            logger.info(f"✅ 完成分片上傳: {batch_id} (本輪累積 {done} 筆)")
+            self._flush_manifest()
+        except Exception as e:
+            logger.error(f"❌ {e}")
+            with self._lock:
+                self._failure = self._failure or e
+        finally:
+            self.limiter.release()
+
+    # ------------------------------------------
+    # 主流程
+    # ------------------------------------------
+    def run(self, lines, source: str) -> dict:
+        """
+        lines: 來源 JSONL 的逐行 iterator (例如 blob.open("r"))
+        source: 來源檔的識別 (路徑 + generation)，用來判斷進度清單是否仍適用
+        """
+        start = time.perf_counter()
+        self._source = source
+        self._completed = self._load_manifest(source)
+        resumed = bool(self._completed)
+        if resumed:
+            logger.info(f"♻️ 進度清單記載 {len(self._completed)} 個已完成分片，只補跑其餘分片")
+
+        def dispatch(index, batch):
+            batch_id = f"batch_{index:05d}"
+            if batch_id in self._completed:
+                with self._lock:
+                    self.counters["skipped"] += 1
+                return
+            # 拿到併發名額才送出，在途分片數 (也就是留在記憶體裡的批次) 受 AIMD 上限約束
+            self.limiter.acquire()
+            pool.submit(self._process_batch, batch_id, batch)
+
+        with ThreadPoolExecutor(max_workers=self.limiter.maximum) as pool:
+            batch, index = [], 0
+            for line in lines:
+                if self._failure:
+                    break
+                if not line.strip():
+                    continue
+                batch.append(line)
+                if len(batch) == self.batch_size:
+                    dispatch(index, batch)
+                    index += 1
+                    batch = []
+            if batch and not self._failure:
+                dispatch(index, batch)
+
+        self._flush_manifest(force=True)
+        if self._failure:
+            raise RuntimeError(f"❌ 向量任務中止，已完成的 {len(self._completed)} 個分片記錄於 {self.manifest_path}，"
+                               f"重新執行會從中斷處接續") from self._failure
+        self._remove_stale_batches()
+
+        elapsed = time.perf_counter() - start
+        return {
+            **self.counters,
+            "seconds": round(elapsed, 2),
+            "records_per_sec": round(self.counters["records"] / elapsed, 1) if elapsed else 0.0,
+            **{f"limiter_{k}": v for k, v in self.limiter.stats().items()},
+        }
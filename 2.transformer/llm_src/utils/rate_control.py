@@ -0,0 +1,86 @@
+import time
+import threading
+
+
+def is_throttled(error) -> bool:
+    """判斷 API 錯誤是不是配額 / 速率限制 (HTTP 429 / gRPC RESOURCE_EXHAUSTED)"""
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "Quota exceeded" in message
+
+
+class TokenBucket:
+    """
+    Token bucket 速率限制器：每秒補充 rate 個 token，最多累積 burst 個。
+    acquire() 拿不到 token 時會睡到補滿為止，多執行緒共用。
+    """
+    def __init__(self, rate_per_sec: float, burst: int = None):
+        self.rate = float(rate_per_sec)
+        self.capacity = float(burst or max(1, int(rate_per_sec)))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """
+    AIMD 併發上限 (與 TCP 壅塞控制同一套思路)：
+        - 每成功一整個窗口 (limit 次)，上限 +1 (加法增加)
+        - 遇到 429 時上限乘以 decrease_factor (乘法減少)；同一波在途請求一起撞到 429 只算一次
+    acquire() / release() 當成上限會變動的 semaphore 使用。
+    """
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32, decrease_factor: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.counters = {"successes": 0, "throttles": 0, "decreases": 0, "peak_limit": int(self.limit)}
+        self._cond = threading.Condition()
+        self._last_decrease_at = 0.0
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self.counters["successes"] += 1
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.counters["peak_limit"] = max(self.counters["peak_limit"], int(self.limit))
+            self._cond.notify_all()
+
+    def on_throttle(self, cooldown_sec: float = 1.0):
+        with self._cond:
+            self.counters["throttles"] += 1
+            now = time.monotonic()
+            # 降速後的冷卻期內，先前已送出的請求再回報 429 不重複砍半
+            if now - self._last_decrease_at < cooldown_sec:
+                return
+            self._last_decrease_at = now
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self.counters["decreases"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self.counters, "limit": round(self.limit, 2), "in_flight": self.in_flight}
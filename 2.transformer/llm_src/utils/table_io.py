@@ -0,0 +1,148 @@
+import io
+import ast
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ==========================================
+# Stage 之間交接表格的 schema
+# 列出的欄位寫入時強制轉成該型別 (list 欄位存成原生 list<string>，下游不必再 literal_eval)；
+# 其他欄位 (例如原始評論帶進來的欄位、各項特徵分數) 交給 pyarrow 推斷。
+# ==========================================
+PARQUET_ROW_GROUP_ROWS = 50000   # 寫入的 row group 大小
+PARQUET_READ_BATCH_ROWS = 10000  # 讀取時每批轉成 pandas 的筆數
+
+THEME_SCORE_FIELDS = ["score_workspace", "score_dating", "score_pet_friendly", "score_relax"]
+
+DISTILLED_REVIEWS_SCHEMA = {
+    "place_id": pa.string(),
+    "place_name": pa.string(),
+    "content": pa.string(),
+    "quality_score": pa.float64(),
+}
+
+SCENARIO_SCHEMA = {
+    "place_id": pa.string(),
+    "place_name": pa.string(),
+    **{col: pa.float64() for col in THEME_SCORE_FIELDS},
+    **{f"tags_{col}": pa.list_(pa.string()) for col in THEME_SCORE_FIELDS},
+}
+
+NAME_REGEX_SCHEMA = {
+    "place_id": pa.string(),
+    "regex_clean_name": pa.string(),
+    "branch": pa.string(),
+    "original_name": pa.string(),
+}
+
+NAME_CLEAN_TEMP_SCHEMA = {
+    "place_id": pa.string(),
+    "final_name": pa.string(),
+    "branch": pa.string(),
+}
+
+# name_cleaned_02 把 regex 結果與 AI 結果 merge，兩邊都有 branch，會變成 branch_x / branch_y
+NAME_CLEAN_SCHEMA = {
+    **{k: v for k, v in NAME_REGEX_SCHEMA.items() if k != "branch"},
+    "branch_x": pa.string(),
+    "final_name": pa.string(),
+    "branch_y": pa.string(),
+}
+
+
+def is_parquet(gcs_path: str) -> bool:
+    return str(gcs_path).lower().endswith(".parquet")
+
+
+def _to_arrow_value(value, arrow_type):
+    """CSV 時代留下的字串 list 或 NaN，轉成 schema 要的型別"""
+    if pa.types.is_list(arrow_type):
+        if isinstance(value, (list, tuple)):
+            return [str(v) for v in value]
+        if isinstance(value, str):
+            return decode_list_value(value)
+        return []
+    return value
+
+
+def decode_list_value(value):
+    """CSV 裡字串化的 list ("['店貓', '甜點']") 轉回 list；壞資料回傳空 list"""
+    if not isinstance(value, str):
+        return []
+    try:
+        parsed = ast.literal_eval(value)
+        return [str(v) for v in parsed] if isinstance(parsed, (list, tuple)) else []
+    except (ValueError, SyntaxError):
+        return []
+
+
+def write_table(bucket, gcs_path: str, df: pd.DataFrame, schema: dict = None):
+    """
+    把 DataFrame 寫到 GCS。副檔名 .parquet 依 schema 寫成 Parquet，
+    其他副檔名維持原本的 CSV (utf-8-sig)，讓環境變數仍指向舊 CSV 路徑時行為不變。
+    """
+    blob = bucket.blob(gcs_path)
+    if not is_parquet(gcs_path):
+        blob.upload_from_string(df.to_csv(index=False, encoding="utf-8-sig"), content_type="text/csv")
+        return
+
+    schema = schema or {}
+    fields = []
+    arrays = []
+    for col in df.columns:
+        arrow_type = schema.get(col)
+        values = df[col]
+        if arrow_type is None:
+            try:
+                arrays.append(pa.array(values, from_pandas=True))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # 混雜型別的 object 欄位 (原始 CSV 常見) 推斷不出來，退回字串
+                arrays.append(pa.array([str(v) if pd.notna(v) else None for v in values.tolist()], type=pa.string()))
+        elif pa.types.is_list(arrow_type):
+            arrays.append(pa.array([_to_arrow_value(v, arrow_type) for v in values.tolist()], type=arrow_type))
+        elif pa.types.is_string(arrow_type):
+            arrays.append(pa.array([str(v) if pd.notna(v) else None for v in values.tolist()], type=arrow_type))
+        else:
+            arrays.append(pa.array(values, type=arrow_type, from_pandas=True))
+        fields.append(pa.field(str(col), arrays[-1].type))
+
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_arrays(arrays, schema=pa.schema(fields)), buffer,
+                   compression="zstd", row_group_size=PARQUET_ROW_GROUP_ROWS)
+    blob.upload_from_string(buffer.getvalue(), content_type="application/vnd.apache.parquet")
+
+
+def read_table(bucket, gcs_path: str, columns: list = None, schema: dict = None) -> pd.DataFrame:
+    """
+    從 GCS 讀表格，只讀 columns 指定的欄位 (不存在的欄位略過)。
+    Parquet 的 list 欄位回傳 Python list；讀舊 CSV 時依 schema 把字串化的 list 欄位解回 list，
+    兩種格式交給下游的型別一致。
+    """
+    content = bucket.blob(gcs_path).download_as_bytes()
+
+    if is_parquet(gcs_path):
+        parquet_file = pq.ParquetFile(io.BytesIO(content))
+        names = parquet_file.schema_arrow.names
+        columns = [c for c in columns if c in names] if columns else names
+        # 分批轉成 pandas：一次轉整張表時 Arrow 與 pandas 兩份資料會同時在記憶體裡
+        parts = []
+        for batch in parquet_file.iter_batches(batch_size=PARQUET_READ_BATCH_ROWS, columns=columns):
+            part = batch.to_pandas()
+            for field in batch.schema:
+                # pandas 會把 list 欄位轉成 numpy array，這裡統一還原成 list
+                if pa.types.is_list(field.type):
+                    part[field.name] = [v if v is not None else [] for v in batch.column(field.name).to_pylist()]
+            parts.append(part)
+        if not parts:
+            return parquet_file.schema_arrow.empty_table().select(columns).to_pandas()
+        return pd.concat(parts, ignore_index=True)
+
+    usecols = (lambda c: c in columns) if columns else None
+    df = pd.read_csv(io.BytesIO(content), usecols=usecols, encoding="utf-8-sig")
+    for col, arrow_type in (schema or {}).items():
+        if col in df.columns and pa.types.is_list(arrow_type):
+            # 同一個字串只解析一次
+            codes, uniques = pd.factorize(df[col])
+            decoded = [decode_list_value(v) for v in uniques]
+            df[col] = [list(decoded[c]) if c >= 0 else [] for c in codes]
+    return df
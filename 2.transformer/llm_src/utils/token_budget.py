@@ -0,0 +1,33 @@
+import re
+
+# 中日韓文字與全形標點：Gemini 的 tokenizer 大約 1 字 1 token
+_WIDE_CHARS = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text) -> int:
+    """粗估 token 數 (不呼叫 count_tokens API)：中文約 1 字 1 token，其餘約 4 個字元 1 token"""
+    if not text:
+        return 0
+    text = str(text)
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def take_within_budget(texts, max_items: int = None, max_tokens: int = None, max_chars: int = None) -> list:
+    """
+    依序挑選文字 (呼叫端已按品質排序)：每則先截到 max_chars，
+    取滿 max_items 則或累積 token 超過 max_tokens 就停；第一則一定保留，避免預算設太小時整家店沒有素材。
+    """
+    selected, used = [], 0
+    for text in texts:
+        if max_items is not None and len(selected) >= max_items:
+            break
+        text = str(text)
+        if max_chars:
+            text = text[:max_chars]
+        cost = estimate_tokens(text)
+        if max_tokens is not None and selected and used + cost > max_tokens:
+            break
+        selected.append(text)
+        used += cost
+    return selected
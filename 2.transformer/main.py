@@ -28,9 +28,16 @@ TASK_ROUTING_TABLE = {
     # --- Stage C: 向量生成 ---
     "stageC_builder": "llm_src.stageC_embeddin.embed_builder",
     "stageC_launcher": "llm_src.utils.VertexAI_Launcher",  # 發射 Embedding 任務
+    "stageC_snippet_builder": "llm_src.stageC_embeddin.reason_snippet_builder",
+    "stageC_snippet_launcher": "llm_src.utils.VertexAI_Launcher",  # 發射推薦短句任務
+    "stageC_snippet_parser": "llm_src.stageC_embeddin.reason_snippet_parser",
     
     # --- Stage D: 終極資料庫寫入 ---
-    "stageD_ingestor": "llm_src.stageD_ingestion.mongo_ingestor"
+    "stageD_ingestor": "llm_src.stageD_ingestion.mongo_ingestor",
+    "stageD_theme_tiles": "llm_src.stageD_ingestion.theme_tile_builder",
+
+    # --- 工具: 工作量預算試算 (dry-run，不呼叫模型) ---
+    "budget_plan": "llm_src.utils.budget_planner"
 }
 
 def main():
@@ -63,6 +70,9 @@ def main():
     elif task_name == "stageC_launcher":
         env["TARGET_TASK"] = "EMBEDDING"
         logger.info("⚙️ 已動態注入環境變數: TARGET_TASK=EMBEDDING")
+    elif task_name == "stageC_snippet_launcher":
+        env["TARGET_TASK"] = "SNIPPETS"
+        logger.info("⚙️ 已動態注入環境變數: TARGET_TASK=SNIPPETS")
 
     # 使用 subprocess 執行，等同於在終端機輸入 python -m ...
     try:
@@ -0,0 +1,27 @@
+# geo.py
+import math
+
+# WGS84 橢球 (與 geopy.geodesic 相同)：長半徑與第一偏心率平方
+WGS84_A = 6378137.0
+WGS84_E2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+
+
+def _radii(lat_rad):
+    """WGS84 在此緯度的子午圈曲率半徑 M 與卯酉圈曲率半徑 N"""
+    w = 1 - WGS84_E2 * math.sin(lat_rad) ** 2
+    return WGS84_A * (1 - WGS84_E2) / w ** 1.5, WGS84_A / math.sqrt(w)
+
+
+def local_distance_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """城市尺度的橢球距離 (公尺)，10 公里以內與 geopy.geodesic 的差距在毫米等級 (同 4.mongodb_serviceloop/geo.py)"""
+    mid = math.radians((lat1 + lat2) / 2)
+    m, n = _radii(mid)
+    return math.hypot(m * math.radians(lat2 - lat1), n * math.cos(mid) * math.radians(lng2 - lng1))
+
+
+def bounding_box(lat: float, lng: float, radius_m: float) -> tuple:
+    """以 (lat, lng) 為中心、半徑 radius_m 的外接經緯度框 (min_lat, max_lat, min_lng, max_lng)"""
+    m, n = _radii(math.radians(lat))
+    dlat = math.degrees(radius_m * 1.01 / m)
+    dlng = math.degrees(radius_m * 1.01 / (n * max(math.cos(math.radians(lat)), 1e-6)))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
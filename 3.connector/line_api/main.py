@@ -33,10 +33,10 @@ from pydantic import BaseModel
 import gc
 from google import genai
 from google.genai import types
-from geopy.distance import geodesic
 from dotenv import load_dotenv
 # 自定義模組
 from database import db_client
+from geo import local_distance_meters, bounding_box
 
 
 # --- 設定與初始化 ---
@@ -133,7 +133,6 @@ async def recommend_cafes(
     if db is None:
          raise HTTPException(status_code=503, detail="Database not available")
 
-    user_loc = (lat, lng)
     final_data = []
 
     try:
@@ -212,13 +211,16 @@ async def recommend_cafes(
                
                 # A-3. [Python] 距離計算 + 評分公式復刻
                 filtered_results = []
+                min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, 3000)
                 for item in raw_results:
                     if not item.get('location') or 'coordinates' not in item['location']:
                         continue
 
-                    # 座標轉換 GeoJSON [lng, lat] -> Geopy (lat, lng)
-                    cafe_loc = (item['location']['coordinates'][1], item['location']['coordinates'][0])
-                    dist_meters = geodesic(user_loc, cafe_loc).meters
+                    # 座標轉換 GeoJSON [lng, lat]；先用外接框剔除明顯超過 3km 的店，框內才算精確距離
+                    c_lng, c_lat = item['location']['coordinates'][:2]
+                    if not (min_lat <= c_lat <= max_lat and min_lng <= c_lng <= max_lng):
+                        continue
+                    dist_meters = local_distance_meters(lat, lng, c_lat, c_lng)
                    
                     if dist_meters <= 3000:
                         item['dist_meters'] = int(dist_meters)
@@ -0,0 +1,251 @@
+# app/agents/ai_backend.py
+"""
+AI 後端切換：live (正常呼叫 Vertex) / record (呼叫 Vertex 並錄下 prompt 與回應) / replay (完全離線回放)
+
+錄製檔依 Agent 分檔存成 JSONL (例如 ChatAgent.jsonl、Embedding.jsonl)，key 為正規化後 prompt 的 SHA-256。
+prompt 裡的日期時間 (例如 ChatAgent 的「現在時間」) 會先換成佔位字串再算 hash，隔天回放也對得上。
+
+回放延遲 AI_REPLAY_LATENCY：
+    recorded          照錄製當下的實際耗時 (預設)
+    none              不等待
+    fixed:1.5         固定 1.5 秒
+    scale:0.5         錄製耗時 x 0.5
+    lognormal:1.2,0.6 中位數 1.2 秒、sigma 0.6 的長尾分佈
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from agents.resilience import heavy_tailed_latency
+
+logger = logging.getLogger("AI_Agent")
+
+AI_BACKEND_MODE = os.getenv("AI_BACKEND_MODE", "live").lower()
+AI_RECORD_DIR = os.getenv("AI_RECORD_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_recordings"))
+AI_REPLAY_LATENCY = os.getenv("AI_REPLAY_LATENCY", "recorded")
+AI_REPLAY_SEED = os.getenv("AI_REPLAY_SEED")
+
+# 只抹掉「日期時間 (星期X)」這種系統注入的時間，使用者自己打的「週五」不能動
+_DATETIME_RE = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?(?:\s*\(星期\s*[一二三四五六日]\))?")
+
+
+class ReplayMissError(LookupError):
+    """回放模式下找不到對應的錄製內容"""
+
+
+def _config_to_dict(generation_config):
+    if generation_config is None:
+        return None
+    to_dict = getattr(generation_config, "to_dict", None)
+    return to_dict() if callable(to_dict) else repr(generation_config)
+
+
+def prompt_key(agent_name: str, prompt, generation_config=None) -> str:
+    text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False, default=str)
+    normalized = _DATETIME_RE.sub("<DATETIME>", text)
+    # 縮排差異不影響語意，一併抹平
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    payload = json.dumps({"agent": agent_name, "prompt": normalized, "config": _config_to_dict(generation_config)},
+                         ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RecordingStore:
+    """每個 Agent 一份 JSONL；record 模式附加寫入，replay 模式啟動時整份載入記憶體"""
+    def __init__(self, record_dir: str = None):
+        self.record_dir = record_dir or AI_RECORD_DIR
+        self._entries = {}   # agent_name -> {key: entry}
+        self._lock = threading.Lock()
+        self.counters = {"recorded": 0, "replay_hits": 0, "replay_misses": 0}
+
+    def _path(self, agent_name: str) -> str:
+        return os.path.join(self.record_dir, f"{agent_name}.jsonl")
+
+    def _load(self, agent_name: str) -> dict:
+        if agent_name not in self._entries:
+            entries = {}
+            path = self._path(agent_name)
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            # 同一個 key 錄到多次時保留最後一次
+                            entries[entry["key"]] = entry
+            self._entries[agent_name] = entries
+            logger.info(f"📼 [AI 回放] 載入 {agent_name} 錄製 {len(entries)} 筆")
+        return self._entries[agent_name]
+
+    def entries(self, agent_name: str) -> list:
+        return list(self._load(agent_name).values())
+
+    def record(self, agent_name: str, key: str, prompt, response: dict, latency: float):
+        entry = {"key": key, "agent": agent_name, "prompt": prompt if isinstance(prompt, (str, list)) else str(prompt),
+                 "response": response, "latency": round(latency, 4), "recorded_at": time.time()}
+        with self._lock:
+            os.makedirs(self.record_dir, exist_ok=True)
+            with open(self._path(agent_name), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._load(agent_name)[key] = entry
+            self.counters["recorded"] += 1
+
+    def lookup(self, agent_name: str, key: str) -> dict:
+        with self._lock:
+            entry = self._load(agent_name).get(key)
+            self.counters["replay_hits" if entry else "replay_misses"] += 1
+        if not entry:
+            raise ReplayMissError(f"{agent_name} 沒有對應的錄製內容 (key={key[:12]})")
+        return entry
+
+
+class LatencyProfile:
+    def __init__(self, spec: str = None, seed=None):
+        self.spec = (spec or AI_REPLAY_LATENCY).strip().lower()
+        self.rng = random.Random(seed if seed is not None else AI_REPLAY_SEED)
+
+    def delay(self, recorded: float) -> float:
+        kind, _, arg = self.spec.partition(":")
+        if kind == "none":
+            return 0.0
+        if kind == "fixed":
+            return float(arg)
+        if kind == "scale":
+            return recorded * float(arg)
+        if kind == "lognormal":
+            median, _, sigma = arg.partition(",")
+            return heavy_tailed_latency(float(median), float(sigma or 0.6), rng=self.rng)
+        return recorded
+
+
+store = RecordingStore()
+latency_profile = LatencyProfile()
+
+
+def replay(agent_name: str, key: str) -> dict:
+    """查出錄製內容並依延遲設定等待，回傳整筆錄製資料"""
+    entry = store.lookup(agent_name, key)
+    delay = latency_profile.delay(entry.get("latency", 0.0))
+    if delay > 0:
+        time.sleep(delay)
+    return entry
+
+
+def _usage_to_dict(response) -> dict:
+    meta = getattr(response, "usage_metadata", None)
+    return {
+        "prompt_token_count": getattr(meta, "prompt_token_count", 0) or 0,
+        "cached_content_token_count": getattr(meta, "cached_content_token_count", 0) or 0,
+        "candidates_token_count": getattr(meta, "candidates_token_count", 0) or 0
+    }
+
+
+class RecordingModel:
+    """
+    包住真正的 GenerativeModel：照常呼叫，並把回應文字、用量與耗時寫入錄製檔。
+    對沖 (hedge) 會對同一個 prompt 同時送出兩次，只錄先回來的那一次，晚到的重複回應不寫入。
+    """
+    def __init__(self, model, agent_name: str):
+        self._model = model
+        self._agent_name = agent_name
+        self._inflight = {}      # key -> 進行中的呼叫數
+        self._recorded = set()   # 進行中且已錄過的 key
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        key = prompt_key(self._agent_name, prompt, generation_config)
+        with self._lock:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+        try:
+            start = time.perf_counter()
+            response = self._model.generate_content(prompt, generation_config=generation_config, **kwargs)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                first = key not in self._recorded
+                self._recorded.add(key)
+            if first:
+                try:
+                    store.record(self._agent_name, key, prompt,
+                                 {"text": response.text, "usage": _usage_to_dict(response)}, elapsed)
+                except Exception as e:
+                    logger.warning(f"⚠️ [AI 錄製] {self._agent_name} 寫入失敗: {e}")
+            return response
+        finally:
+            with self._lock:
+                self._inflight[key] -= 1
+                if not self._inflight[key]:
+                    del self._inflight[key]
+                    self._recorded.discard(key)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class ReplayModel:
+    """離線回放：介面與 GenerativeModel 相同 (generate_content / count_tokens)，不需要任何 GCP 連線"""
+    def __init__(self, agent_name: str):
+        self._agent_name = agent_name
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        entry = replay(self._agent_name, prompt_key(self._agent_name, prompt, generation_config))
+        return SimpleNamespace(
+            text=entry["response"]["text"],
+            usage_metadata=SimpleNamespace(**entry["response"].get("usage", {}))
+        )
+
+    def count_tokens(self, prompt):
+        # 只拿來印 Log；回放時以粗估字數代替，不必連線
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        return SimpleNamespace(total_tokens=len(text) // 2)
+
+
+def wrap_model(model, agent_name: str):
+    """依 AI_BACKEND_MODE 包裝 GenerativeModel；replay 模式下 model 可為 None"""
+    if AI_BACKEND_MODE == "replay":
+        return ReplayModel(agent_name)
+    if AI_BACKEND_MODE == "record" and model is not None:
+        return RecordingModel(model, agent_name)
+    return model
+
+
+# --- Embedding 模型 ---
+def _embedding_key(inputs, kwargs) -> str:
+    texts = [[getattr(i, "text", i), getattr(i, "task_type", None)] for i in inputs]
+    return prompt_key("Embedding", texts, json.dumps(kwargs, sort_keys=True))
+
+
+class RecordingEmbeddingModel:
+    def __init__(self, model):
+        self._model = model
+
+    def get_embeddings(self, inputs, **kwargs):
+        start = time.perf_counter()
+        embeddings = self._model.get_embeddings(inputs, **kwargs)
+        elapsed = time.perf_counter() - start
+        try:
+            store.record("Embedding", _embedding_key(inputs, kwargs), [getattr(i, "text", i) for i in inputs],
+                         {"values": [list(e.values) for e in embeddings]}, elapsed)
+        except Exception as e:
+            logger.warning(f"⚠️ [AI 錄製] Embedding 寫入失敗: {e}")
+        return embeddings
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class ReplayEmbeddingModel:
+    def get_embeddings(self, inputs, **kwargs):
+        entry = replay("Embedding", _embedding_key(inputs, kwargs))
+        return [SimpleNamespace(values=values) for values in entry["response"]["values"]]
+
+
+def wrap_embedding_model(model):
+    if AI_BACKEND_MODE == "replay":
+        return ReplayEmbeddingModel()
+    if AI_BACKEND_MODE == "record" and model is not None:
+        return RecordingEmbeddingModel(model)
+    return model
@@ -3,18 +3,68 @@ import os
 import logging
 import vertexai
 from vertexai.generative_models import GenerativeModel
+from agents.resilience import ResilientCaller
+from agents.ai_backend import AI_BACKEND_MODE, wrap_model
 
 logger = logging.getLogger("AI_Agent")
 
+# 斷路器跳脫時改用的便宜模型 (留空代表不降級，直接走各 Agent 的規則式備案)
+AGENT_FALLBACK_MODEL = os.getenv("AGENT_FALLBACK_MODEL", "gemini-2.5-flash-lite")
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", 20))
+
 class BaseAgent:
-    def __init__(self, model_name="gemini-2.5-flash"):
+    # 子類別可覆寫：每個 Agent 的期限與是否啟用對沖請求
+    deadline_seconds = AGENT_DEADLINE_SECONDS
+    hedge_enabled = False
+
+    def __init__(self, model_name="gemini-2.5-flash", system_instruction=None):
         # 取得 GCP 專案設定
         project_id = os.getenv("GCP_PROJECT_ID")
         location = os.getenv("GCP_LOCATION", "us-central1")
-        
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._fallback_model = None
+
+        # 每個 Agent 各自一組斷路器與延遲統計，互不影響
+        agent_name = self.__class__.__name__
+        deadline = float(os.getenv(f"{agent_name.upper()}_DEADLINE_SECONDS", self.deadline_seconds))
+        hedge = os.getenv(f"{agent_name.upper()}_HEDGE", str(self.hedge_enabled)).lower() == "true"
+        self.caller = ResilientCaller(agent_name, deadline_seconds=deadline, hedge=hedge)
+
+        # 📼 回放模式完全離線，不建立真正的 Vertex 模型
+        if AI_BACKEND_MODE == "replay":
+            self.model = wrap_model(None, agent_name)
+            logger.info(f"📼 {agent_name} 使用離線回放後端")
+            return
+
         try:
-            self.model = GenerativeModel(model_name)
+            self.model = wrap_model(GenerativeModel(model_name, system_instruction=system_instruction), agent_name)
             logger.info(f"✅ AI 大腦裝載成功，使用模型: {model_name}")
         except Exception as e:
             logger.error(f"❌ Vertex AI 初始化失敗: {e}")
-            self.model = None
\ No newline at end of file
+            self.model = None
+
+    def _get_fallback_model(self):
+        if not AGENT_FALLBACK_MODEL or AGENT_FALLBACK_MODEL == self.model_name or AI_BACKEND_MODE == "replay":
+            return None
+        if self._fallback_model is None:
+            try:
+                # 不經過 wrap_model：錄製 key 只看 Agent 與 prompt，備援模型的回應若被錄下，回放時會被當成主模型的答案
+                self._fallback_model = GenerativeModel(AGENT_FALLBACK_MODEL, system_instruction=self.system_instruction)
+            except Exception as e:
+                logger.error(f"❌ 備援模型 {AGENT_FALLBACK_MODEL} 初始化失敗: {e}")
+                return None
+        return self._fallback_model
+
+    def generate(self, prompt, generation_config=None, model=None):
+        """
+        所有 Agent 統一的呼叫入口 (同步)：套用期限、對沖與斷路器。
+        斷路器跳脫時改用備援模型；連備援都沒有就拋例外，由各 Agent 既有的 except 走規則式回應。
+        """
+        primary = model or self.model
+        fallback = self._get_fallback_model()
+        fallback_fn = (lambda: fallback.generate_content(prompt, generation_config=generation_config)) if fallback else None
+        return self.caller.call(
+            lambda: primary.generate_content(prompt, generation_config=generation_config),
+            fallback_fn=fallback_fn
+        )
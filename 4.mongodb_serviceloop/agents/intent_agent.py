@@ -6,6 +6,7 @@ from datetime import datetime
 from agents.base_agent import BaseAgent
 from vertexai.generative_models import GenerationConfig 
 from utils import get_taiwan_now
+from time_parser import parse_time_expression, TIME_PARSER_MIN_CONFIDENCE
 
 logger = logging.getLogger("Coffee_Recommender")
 
@@ -36,10 +37,27 @@ USER_INTENT_SYSTEM_PROMPT_TEMPLATE = """
 """
 
 class IntentAgent(BaseAgent):
-    def analyze_user_intent(self, user_message: str) -> dict:
-        if not self.model: return {}
+    deadline_seconds = 8.0
+    hedge_enabled = True
 
+    def analyze_user_intent(self, user_message: str, use_rules: bool = True) -> dict:
         now = get_taiwan_now() 
+
+        # ⚡ 先用本地規則解析常見時間說法 (明天早上、週五晚上7點...)，有把握就不必呼叫 LLM
+        if use_rules:
+            parsed = parse_time_expression(user_message, now)
+            if parsed["confidence"] >= TIME_PARSER_MIN_CONFIDENCE:
+                logger.info(f"⚡ [IntentAgent] 規則解析 | 信心: {parsed['confidence']:.2f} | has_time: {parsed['has_time']} | target_time: {parsed['target_time']}")
+                return {
+                    "has_time": parsed["has_time"],
+                    "target_time": parsed["target_time"],
+                    "time_flexibility": parsed["time_flexibility"],
+                    "intents": [],
+                    "source": "rules"
+                }
+
+        if not self.model: return {}
+
         weekday_map = ["一", "二", "三", "四", "五", "六", "日"]
         
         dynamic_system_prompt = USER_INTENT_SYSTEM_PROMPT_TEMPLATE.format(
@@ -54,10 +72,6 @@ class IntentAgent(BaseAgent):
         """
 
         try:
-            # 🌟 1. 計算輸入的 Token 數量
-            token_info = self.model.count_tokens(full_prompt)
-            input_tokens = token_info.total_tokens
-
             # ✂️ [瘦身] 精簡輸入 Log
             logger.info(f"🟢 [IntentAgent] 輸入 | 基準: {now.strftime('%Y-%m-%d %H:%M')} ({weekday_map[now.weekday()]}) | 訊息: \"{user_message}\"")
             logger.debug(f"==== 🟢 [IntentAgent] 完整 Prompt ====\n{full_prompt}\n======================================")
@@ -67,10 +81,12 @@ class IntentAgent(BaseAgent):
                 temperature=0.0
             )
 
-            # 🌟 2. 開始計時並呼叫 AI
+            # 🌟 開始計時並呼叫 AI
             start_time = time.time()
-            response = self.model.generate_content(full_prompt, generation_config=generation_config)
+            response = self.generate(full_prompt, generation_config=generation_config)
             elapsed_time = time.time() - start_time
+            # 🌟 Token 數直接讀回應的 usage_metadata，不再為了記 Log 多打一次 count_tokens API
+            input_tokens = getattr(getattr(response, "usage_metadata", None), "prompt_token_count", 0) or 0
 
             if response.text:
                 clean_text = response.text.replace("```json", "").replace("```", "").strip()
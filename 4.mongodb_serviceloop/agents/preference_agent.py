@@ -25,7 +25,33 @@ PREFERENCE_SYSTEM_PROMPT = """
     "analysis_summary": "簡短的一段話說明為什麼給出這樣的設定"
 }}
 """
+
+# 批次版：一次分析多位使用者，輸出以代號 (u1, u2...) 為 key，避免把 LINE user_id 送進 prompt
+PREFERENCE_BATCH_PROMPT = """
+【任務】
+你是一位頂級的「使用者行為與心理分析師」。
+以下是多位使用者各自的「搜尋紀錄」、「收藏清單」以及「黑名單與拒絕原因」，
+請「分別」為每一位使用者精煉出獨立的「咖啡廳偏好畫像 (Persona)」，不同使用者的資料不可混用。
+
+【輸入資料】(key 為使用者代號)
+{behavior_data}
+
+【輸出規定】
+請務必回傳 JSON 物件，key 與輸入的使用者代號完全相同，每個 value 格式如下：
+{{
+    "u1": {{
+        "persona_label": "給這個使用者的行為一句話精準定義，例如：深夜工作甜點控",
+        "preferred_tags": ["從資料中推斷出他最在意的 3~5 個正面特徵"],
+        "avoid_tags": ["從黑名單或拒絕原因中，推斷他最討厭的 2~3 個地雷特徵"],
+        "analysis_summary": "簡短的一段話說明為什麼給出這樣的設定"
+    }}
+}}
+"""
+
 class PreferenceAgent(BaseAgent):
+    # 背景批次任務，不必搶快，也不做對沖 (避免重複花錢)
+    deadline_seconds = 60.0
+
     async def analyze_user_preferences(self, behavior_data: dict) -> dict:
         if not self.model or not behavior_data: return {}
 
@@ -41,7 +67,7 @@ class PreferenceAgent(BaseAgent):
 
             # 確保不卡死 FastAPI 主線程
             response = await asyncio.to_thread(
-                self.model.generate_content,
+                self.generate,
                 full_prompt,
                 generation_config=generation_config
             )
@@ -55,4 +81,40 @@ class PreferenceAgent(BaseAgent):
 
         except Exception as e:
             logger.error(f"❌ Preference AI 偏好分析失敗: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    async def analyze_user_preferences_batch(self, behavior_by_user: dict) -> dict:
+        """一次 LLM 呼叫分析多位使用者，回傳 {user_id: persona}；失敗或缺漏的使用者不會出現在結果中"""
+        if not self.model or not behavior_by_user: return {}
+
+        alias_map = {f"u{i + 1}": uid for i, uid in enumerate(behavior_by_user)}
+        full_prompt = PREFERENCE_BATCH_PROMPT.format(
+            behavior_data=json.dumps({alias: behavior_by_user[uid] for alias, uid in alias_map.items()}, ensure_ascii=False)
+        )
+
+        try:
+            generation_config = GenerationConfig(
+                response_mime_type="application/json",
+                temperature=0.2
+            )
+
+            response = await asyncio.to_thread(
+                self.generate,
+                full_prompt,
+                generation_config=generation_config
+            )
+
+            if not response.text:
+                return {}
+            clean_text = response.text.replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(clean_text)
+            results = {
+                alias_map[alias]: persona for alias, persona in parsed.items()
+                if alias in alias_map and isinstance(persona, dict)
+            }
+            logger.info(f"🧠 [Preference AI] 批次更新偏好畫像: {len(results)}/{len(alias_map)} 位")
+            return results
+
+        except Exception as e:
+            logger.error(f"❌ Preference AI 批次偏好分析失敗: {e}")
+            return {}
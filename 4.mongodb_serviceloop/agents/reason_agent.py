@@ -31,6 +31,9 @@ REASON_SYSTEM_PROMPT = """
 """
 
 class ReasonAgent(BaseAgent):
+    deadline_seconds = 15.0
+    hedge_enabled = True
+
     async def generate_reasons_batch(self, user_query: str, cafes: list) -> dict:
         if not self.model or not cafes:
             return {}
@@ -59,10 +62,6 @@ class ReasonAgent(BaseAgent):
         )
 
         try:
-            # 🌟 1. 計算輸入的 Token 數量
-            token_info = self.model.count_tokens(full_prompt)
-            input_tokens = token_info.total_tokens
-            
             # ✂️ [瘦身] 精簡輸入 Log
             logger.info(f"🟢 [ReasonAgent] 輸入 | 需求: '{user_query}' | 候選: {len(cafes)} 家")
             logger.debug(f"==== 🟢 [ReasonAgent] 完整 Prompt ====\n{full_prompt}\n======================================")
@@ -72,14 +71,16 @@ class ReasonAgent(BaseAgent):
                 temperature=0.2 
             )
 
-            # 🌟 2. 開始計時並呼叫 AI
+            # 🌟 開始計時並呼叫 AI
             start_time = time.time()
             response = await asyncio.to_thread(
-                self.model.generate_content,
+                self.generate,
                 full_prompt,
                 generation_config=generation_config
             )
             elapsed_time = time.time() - start_time
+            # 🌟 Token 數直接讀回應的 usage_metadata，不再為了記 Log 多打一次 count_tokens API
+            input_tokens = getattr(getattr(response, "usage_metadata", None), "prompt_token_count", 0) or 0
 
             if response.text:
                 clean_text = response.text.replace("```json", "").replace("```", "").strip()
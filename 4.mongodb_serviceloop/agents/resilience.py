@@ -0,0 +1,188 @@
+# app/agents/resilience.py
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("AI_Agent")
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("AGENT_BREAKER_FAILURE_THRESHOLD", 5))   # 連續失敗幾次就跳脫
+BREAKER_RESET_SECONDS = float(os.getenv("AGENT_BREAKER_RESET_SECONDS", 30))         # 跳脫後多久放一個試探請求
+HEDGE_MIN_SAMPLES = int(os.getenv("AGENT_HEDGE_MIN_SAMPLES", 20))                   # 累積多少樣本後才開始對沖
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("AGENT_HEDGE_MIN_DELAY_SECONDS", 0.5))
+AGENT_EXECUTOR_WORKERS = int(os.getenv("AGENT_EXECUTOR_WORKERS", 32))
+AGENT_FALLBACK_EXECUTOR_WORKERS = int(os.getenv("AGENT_FALLBACK_EXECUTOR_WORKERS", 8))
+
+# 所有 Agent 共用的呼叫執行緒池：逾時的呼叫無法中斷，只能放著讓它自己結束
+_executor = ThreadPoolExecutor(max_workers=AGENT_EXECUTOR_WORKERS, thread_name_prefix="agent-call")
+# 備援模型獨立一個池：主模型卡住時，被放棄的主呼叫會佔滿上面的池，備援不能跟它們排同一條隊
+_fallback_executor = ThreadPoolExecutor(max_workers=AGENT_FALLBACK_EXECUTOR_WORKERS, thread_name_prefix="agent-fallback")
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路器跳脫中，主模型暫停呼叫"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """呼叫超過設定的期限"""
+
+
+class CircuitBreaker:
+    """
+    closed -> 連續失敗達門檻 -> open (直接拒絕) -> 冷卻時間到 -> half_open (放一個試探請求)
+    試探成功回到 closed，失敗則重新 open。
+    """
+    def __init__(self, name: str, failure_threshold: int = None, reset_seconds: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or BREAKER_RESET_SECONDS
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"🟢 [斷路器:{self.name}] 試探成功，恢復正常")
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"🔴 [斷路器:{self.name}] 連續失敗 {self._failures} 次，暫停呼叫 {self.reset_seconds:.0f}s")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """保留最近 N 次成功呼叫的耗時，用來估計 p95 作為對沖延遲"""
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class ResilientCaller:
+    """
+    包住一個同步呼叫 (例如 model.generate_content)：
+    - deadline：超過期限視為失敗並計入斷路器
+    - hedge：超過觀察到的 p95 還沒回來，就再送一次相同請求，先回來的贏
+    - 斷路器跳脫時改走 fallback (較便宜的模型)；沒有 fallback 就拋 CircuitOpenError，由呼叫端走規則式路徑
+    """
+    def __init__(self, name: str, deadline_seconds: float, hedge: bool = False, breaker: CircuitBreaker = None):
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0,
+                         "short_circuited": 0, "fallback_calls": 0}
+
+    def hedge_delay(self):
+        if not self.hedge or len(self.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        p95 = self.latency.percentile(0.95)
+        return max(HEDGE_MIN_DELAY_SECONDS, p95) if p95 is not None else None
+
+    def _run_with_deadline(self, fn, deadline_seconds: float, hedge_delay: float = None, executor=None):
+        executor = executor or _executor
+        start = time.monotonic()
+        futures = {executor.submit(fn): "primary"}
+        first_wait = min(hedge_delay, deadline_seconds) if hedge_delay else deadline_seconds
+        done, _ = wait(futures, timeout=first_wait, return_when=FIRST_COMPLETED)
+
+        if not done and hedge_delay and hedge_delay < deadline_seconds:
+            self.counters["hedges"] += 1
+            futures[executor.submit(fn)] = "hedge"
+
+        while not done:
+            remaining = deadline_seconds - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            # 其中一個失敗但另一個還在跑：繼續等另一個
+            if done and len(futures) > 1 and all(f.exception() for f in done) and len(done) < len(futures):
+                for f in done:
+                    futures.pop(f)
+                done = set()
+
+        if not done:
+            raise DeadlineExceededError(f"{self.name} 超過 {deadline_seconds:.1f}s 未回應")
+
+        winner = next(iter(done))
+        if futures.get(winner) == "hedge":
+            self.counters["hedge_wins"] += 1
+        return winner.result(), time.monotonic() - start
+
+    def call(self, fn, fallback_fn=None):
+        self.counters["calls"] += 1
+        if not self.breaker.allow():
+            self.counters["short_circuited"] += 1
+            if fallback_fn is None:
+                raise CircuitOpenError(f"{self.name} 斷路器跳脫中")
+            self.counters["fallback_calls"] += 1
+            result, _ = self._run_with_deadline(fallback_fn, self.deadline_seconds, executor=_fallback_executor)
+            return result
+
+        try:
+            result, elapsed = self._run_with_deadline(fn, self.deadline_seconds, self.hedge_delay())
+        except Exception as e:
+            self.counters["failures"] += 1
+            if isinstance(e, DeadlineExceededError):
+                self.counters["timeouts"] += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.latency.add(elapsed)
+        return result
+
+    def stats(self) -> dict:
+        p50, p95 = self.latency.percentile(0.5), self.latency.percentile(0.95)
+        return {
+            **self.counters,
+            "breaker_state": self.breaker.state,
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None
+        }
+
+
+def heavy_tailed_latency(median_seconds: float = 1.0, sigma: float = 0.8, stall_rate: float = 0.0, stall_seconds: float = 30.0, rng=random) -> float:
+    """模擬 Vertex 的長尾延遲 (log-normal + 偶發卡住)，供故障注入評測使用"""
+    if stall_rate and rng.random() < stall_rate:
+        return stall_seconds
+    return rng.lognormvariate(0, sigma) * median_seconds
@@ -0,0 +1,121 @@
+"""
+[故障注入] 以長尾延遲的假後端驗證 Agent 的期限、對沖與斷路器
+
+用法 (在 4.mongodb_serviceloop 目錄下，不需要 Vertex AI)：
+    python benchmarks/agent_fault_injection.py
+    python benchmarks/agent_fault_injection.py --requests 300 --stall-rate 0.05 --outage-at 150 --outage-len 60
+
+假後端延遲為 log-normal (中位數 --median-s) 並以 --stall-rate 的機率卡住 --stall-s 秒；
+--outage-at 之後的 --outage-len 個請求全部拋錯，模擬 Vertex 故障，觀察斷路器是否跳脫並改走備援模型。
+每種設定都跑同一份延遲序列，輸出 p50 / p95 / p99 / 最慢延遲與錯誤數。
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents import resilience  # noqa: E402
+from agents.resilience import ResilientCaller, CircuitOpenError, heavy_tailed_latency  # noqa: E402
+
+
+class FakeBackend:
+    """依照預先產生的延遲序列回應；同一個請求的對沖副本重新抽一次延遲 (模擬打到另一台機器)"""
+    def __init__(self, latencies, outage_range, seed):
+        self.latencies = latencies
+        self.outage_range = outage_range
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def make_call(self, idx, args):
+        attempts = {"n": 0}
+
+        def call():
+            self.calls += 1
+            attempts["n"] += 1
+            if idx in self.outage_range:
+                time.sleep(0.01)
+                raise RuntimeError("503 Service Unavailable (注入故障)")
+            if attempts["n"] == 1:
+                delay = self.latencies[idx]
+            else:
+                delay = heavy_tailed_latency(args.median_s, args.sigma, args.stall_rate, args.stall_s, rng=self.rng)
+            time.sleep(delay * args.time_scale)
+            return "primary"
+        return call
+
+
+def fallback_call(args):
+    time.sleep(args.median_s * 0.5 * args.time_scale)
+    return "fallback"
+
+
+def run(name, args, latencies, caller_factory):
+    backend = FakeBackend(latencies, range(args.outage_at, args.outage_at + args.outage_len), seed=42)
+    caller = caller_factory()
+    results, errors = [], 0
+
+    def one(idx):
+        start = time.perf_counter()
+        try:
+            if caller is None:
+                out = backend.make_call(idx, args)()
+            else:
+                out = caller.call(backend.make_call(idx, args), fallback_fn=lambda: fallback_call(args))
+        except (CircuitOpenError, TimeoutError, RuntimeError):
+            out = None
+        return (time.perf_counter() - start) / args.time_scale, out
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for elapsed, out in pool.map(one, range(args.requests)):
+            results.append(elapsed)
+            errors += out is None
+
+    ordered = sorted(results)
+    pct = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    print(f"📊 [{name:<14}] p50 {statistics.median(ordered):6.2f}s | p95 {pct(0.95):6.2f}s | p99 {pct(0.99):6.2f}s | "
+          f"最慢 {ordered[-1]:6.2f}s | 失敗 {errors:>3} | 後端呼叫 {backend.calls}")
+    if caller is not None:
+        print(f"   ↳ {caller.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median-s", type=float, default=1.5)
+    parser.add_argument("--sigma", type=float, default=0.7)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall-s", type=float, default=30.0)
+    parser.add_argument("--deadline-s", type=float, default=8.0)
+    parser.add_argument("--outage-at", type=int, default=120)
+    parser.add_argument("--outage-len", type=int, default=40)
+    parser.add_argument("--time-scale", type=float, default=0.02, help="實際 sleep 的縮放比例，預設 1/50 加速回放")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    latencies = [heavy_tailed_latency(args.median_s, args.sigma, args.stall_rate, args.stall_s) for _ in range(args.requests)]
+    # 對沖的門檻與樣本數依照縮放後的時間換算
+    resilience.HEDGE_MIN_DELAY_SECONDS *= args.time_scale
+    resilience.HEDGE_MIN_SAMPLES = min(resilience.HEDGE_MIN_SAMPLES, args.requests // 10)
+    print(f"🧪 {args.requests} 個請求 | 並行 {args.concurrency} | 中位數 {args.median_s}s | 卡住率 {args.stall_rate} "
+          f"| 故障區間 [{args.outage_at}, {args.outage_at + args.outage_len})")
+
+    deadline = args.deadline_s * args.time_scale
+    # 前兩組不啟用斷路器 (門檻設成無限大)，才看得出斷路器本身的效果
+    no_breaker = lambda name: resilience.CircuitBreaker(name, failure_threshold=10 ** 9)
+    run("無保護", args, latencies, lambda: None)
+    run("期限", args, latencies, lambda: ResilientCaller("deadline", deadline_seconds=deadline, breaker=no_breaker("deadline")))
+    run("期限+對沖", args, latencies, lambda: ResilientCaller("hedged", deadline_seconds=deadline, hedge=True, breaker=no_breaker("hedged")))
+    run("期限+對沖+斷路", args, latencies, lambda: ResilientCaller(
+        "breaker", deadline_seconds=deadline, hedge=True,
+        breaker=resilience.CircuitBreaker("breaker", reset_seconds=5 * args.median_s * args.time_scale)
+    ))
+
+
+if __name__ == "__main__":
+    main()
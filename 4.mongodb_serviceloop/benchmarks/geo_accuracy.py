@@ -0,0 +1,97 @@
+"""
+[評測] geo 模組的距離精度與速度 (對照 geopy.geodesic)
+
+⚠️ 需要 geopy：服務本身已不依賴 geopy (不在 requirements.txt)，執行前請先 pip install geopy
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/geo_accuracy.py
+    python benchmarks/geo_accuracy.py --pairs 50000 --max-error 1.0   # 誤差超過 1 公尺回傳 exit code 1
+
+在台北市範圍內隨機取點，比較 local_distance_meters / distances_from / 球面 haversine 與 geodesic 的差距，
+並確認 NearestPointIndex 找到的最近捷運站與逐站 geodesic 暴力搜尋一致。
+"""
+import os
+import sys
+import time
+import random
+import math
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geopy.distance import geodesic  # noqa: E402
+from geo import local_distance_meters, distances_from, NearestPointIndex  # noqa: E402
+from locations import ALL_LOCATIONS, MRT_LOCATIONS  # noqa: E402
+
+# 台北市 + 鄰近新北的範圍
+LAT_RANGE = (24.96, 25.21)
+LNG_RANGE = (121.45, 121.66)
+
+
+def haversine_meters(lat1, lng1, lat2, lng2):
+    """對照組：球面距離 (地球平均半徑，與 $geoNear spherical 相同)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--max-km", type=float, default=5.0, help="兩點最遠相距幾公里 (推薦半徑為 5km)")
+    parser.add_argument("--max-error", type=float, default=None, help="local_distance_meters 最大誤差 (公尺) 門檻")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    span = args.max_km / 111.0 / 1.5
+    pairs = []
+    for _ in range(args.pairs):
+        a = (rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE))
+        pairs.append((a, (a[0] + rng.uniform(-span, span), a[1] + rng.uniform(-span, span))))
+
+    start = time.perf_counter()
+    truth = [geodesic(a, b).meters for a, b in pairs]
+    t_geodesic = time.perf_counter() - start
+
+    print(f"🧪 台北範圍 {len(pairs)} 組點對 (相距 ≤ {args.max_km:g} km)")
+    results = {}
+    for name, fn in (("local_distance_meters", local_distance_meters), ("haversine_meters", haversine_meters)):
+        start = time.perf_counter()
+        values = [fn(a[0], a[1], b[0], b[1]) for a, b in pairs]
+        elapsed = time.perf_counter() - start
+        errors = [abs(v - t) for v, t in zip(values, truth)]
+        results[name] = max(errors)
+        print(f"📊 {name:<22} 最大誤差 {max(errors):8.4f} m | 平均 {sum(errors) / len(errors):8.4f} m | "
+              f"{elapsed / len(pairs) * 1e6:6.2f} µs/次 (geodesic {t_geodesic / len(pairs) * 1e6:6.1f} µs/次)")
+
+    # 一點對多點：以第一個點為使用者位置
+    origin = pairs[0][0]
+    lats, lngs = [b[0] for _, b in pairs], [b[1] for _, b in pairs]
+    start = time.perf_counter()
+    batch = distances_from(origin[0], origin[1], lats, lngs)
+    t_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    batch_truth = [geodesic(origin, (la, ln)).meters for la, ln in zip(lats, lngs)]
+    t_batch_geo = time.perf_counter() - start
+    print(f"📊 distances_from (一對 {len(lats)} 點) 最大誤差 {max(abs(x - y) for x, y in zip(batch, batch_truth)):8.4f} m | "
+          f"{t_batch * 1000:.2f} ms vs geodesic {t_batch_geo * 1000:.0f} ms ({t_batch_geo / t_batch:.0f}x)")
+
+    # 最近捷運站
+    index = NearestPointIndex(MRT_LOCATIONS)
+    cafes = [(rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)) for _ in range(500)]
+    start = time.perf_counter()
+    fast = index.nearest_many([c[0] for c in cafes], [c[1] for c in cafes])
+    t_nearest = time.perf_counter() - start
+    brute = [min(geodesic(c, p).meters for p in MRT_LOCATIONS.values()) for c in cafes]
+    worst = max(abs(x - y) for x, y in zip(fast, brute))
+    print(f"🚇 最近捷運站 ({len(index.names)} 站 x {len(cafes)} 家) 最大誤差 {worst:.4f} m | {t_nearest * 1000:.2f} ms")
+    legacy = [name for name in ALL_LOCATIONS if "站" in name]
+    print(f"   (舊版只比對名稱含「站」的地點，實際只有 {len(legacy)} 個: {legacy})")
+
+    if args.max_error is not None and results["local_distance_meters"] > args.max_error:
+        print(f"❌ local_distance_meters 最大誤差超過門檻 {args.max_error} m")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+[壓測] 突發 webhook 下的 event loop 阻塞時間：同步 LineBotApi 式呼叫 vs AsyncLineClient
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/line_client_burst.py --burst 50 --latency-ms 120
+
+兩種模式都對「假的 LINE API」送出同樣數量的 reply：
+- sync : 模擬同步 SDK 在 async handler 內直接呼叫 (網路等待以 time.sleep 表示，會卡住整個 loop)
+- async: 真正的 AsyncLineClient，底層以 httpx.MockTransport 模擬相同延遲
+同時跑一個每 10ms 醒來一次的心跳 task，量測它實際遲到多久 (= event loop 被阻塞的時間)。
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.line_client import AsyncLineClient  # noqa: E402
+
+HEARTBEAT_INTERVAL = 0.01
+
+
+async def heartbeat(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + HEARTBEAT_INTERVAL
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+def fake_sync_reply(latency: float):
+    # 同步 SDK 內部的 requests.post：整段網路等待都佔住 event loop 執行緒
+    time.sleep(latency)
+
+
+async def run_sync_mode(burst: int, latency: float):
+    async def handle_webhook(i):
+        fake_sync_reply(latency)
+    await asyncio.gather(*(handle_webhook(i) for i in range(burst)))
+
+
+async def run_async_mode(burst: int, latency: float):
+    async def fake_line_api(request: httpx.Request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={})
+
+    client = AsyncLineClient("dummy-token", transport=httpx.MockTransport(fake_line_api))
+    try:
+        msg = {"type": "text", "text": "bench"}
+        await asyncio.gather(*(client.send(f"token-{i}", msg, user_id=f"U{i}") for i in range(burst)))
+    finally:
+        await client.aclose()
+
+
+async def measure(mode: str, burst: int, latency: float) -> dict:
+    lags, stop = [], asyncio.Event()
+    hb = asyncio.create_task(heartbeat(lags, stop))
+    await asyncio.sleep(HEARTBEAT_INTERVAL * 3)  # 讓心跳先跑起來
+
+    start = time.perf_counter()
+    if mode == "sync":
+        await run_sync_mode(burst, latency)
+    else:
+        await run_async_mode(burst, latency)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await hb
+    lags_ms = sorted(l * 1000 for l in lags) or [0.0]
+    return {
+        "mode": mode,
+        "wall_s": elapsed,
+        "max_lag_ms": lags_ms[-1],
+        "p95_lag_ms": lags_ms[int(len(lags_ms) * 0.95) - 1] if len(lags_ms) > 1 else lags_ms[0],
+        "mean_lag_ms": statistics.mean(lags_ms),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--burst", type=int, default=50, help="同時湧入的 webhook 數")
+    parser.add_argument("--latency-ms", type=float, default=120, help="假 LINE API 單次延遲")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000.0
+    print(f"🔥 Burst = {args.burst} webhooks, LINE API latency = {args.latency_ms:.0f} ms")
+    for mode in ("sync", "async"):
+        r = asyncio.run(measure(mode, args.burst, latency))
+        print(f"  [{r['mode']:>5}] 總耗時 {r['wall_s']:.2f}s | loop 最大阻塞 {r['max_lag_ms']:.0f} ms | "
+              f"p95 {r['p95_lag_ms']:.1f} ms | 平均 {r['mean_lag_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
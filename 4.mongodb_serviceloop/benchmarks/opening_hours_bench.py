@@ -0,0 +1,134 @@
+"""
+[評測] OpeningHours (編譯一次 + 二分搜尋) vs 舊版每次重新解析 periods 的營業時間函式
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/opening_hours_bench.py
+    python benchmarks/opening_hours_bench.py --cafes 2000 --queries 50
+
+以 Stage D 的 periods 格式隨機產生店家 (含跨午夜、公休日、一天兩段)，對相同的 (店家, 時間) 組合分別呼叫
+舊版的 is_google_period_open / get_hours_until_close 與新版 OpeningHours，
+輸出耗時與結果不一致的筆數。以下兩種差異是刻意的行為修正，另外計數不算錯：
+    - 舊版把「打烊那一分鐘」算成營業中，新版算打烊
+    - 舊版營業到凌晨的店在 23:59 就算打烊 (距離打烊被低估)，新版會接上隔天凌晨那一段
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from opening_hours import OpeningHours  # noqa: E402
+
+
+# --- 舊版實作 (原 utils / scoring / main 內的邏輯)，留作對照 ---
+def legacy_is_open(periods, target_dt):
+    target_minutes = target_dt.hour * 60 + target_dt.minute
+    google_target_day = (target_dt.weekday() + 1) % 7
+    for period in periods:
+        if period.get('day') == google_target_day:
+            if period['open'] == 0 and period['close'] == 0:
+                if target_minutes == 0:
+                    return True
+                continue
+            if period['open'] <= target_minutes <= period['close']:
+                return True
+    return False
+
+
+def legacy_hours_until_close(opening_hours, ref_time):
+    periods = opening_hours.get('periods', [])
+    if not periods:
+        return 3.0
+    current_day = ref_time.isoweekday() % 7
+    current_mins = current_day * 1440 + ref_time.hour * 60 + ref_time.minute
+    for p in periods:
+        o_mins = p['day'] * 1440 + p['open']
+        c_day = (p['day'] + 1) % 7 if p['close'] < p['open'] else p['day']
+        c_mins = c_day * 1440 + p['close']
+        if c_mins < o_mins:
+            c_mins += 7 * 1440
+        check_mins = current_mins
+        if current_mins < o_mins and (current_mins + 7 * 1440) < c_mins:
+            check_mins += 7 * 1440
+        if o_mins <= check_mins < c_mins:
+            return (c_mins - check_mins) / 60.0
+    return 0.0
+
+
+def random_periods(rng):
+    """仿 mongo_ingestor.parse_opening_hours_to_periods 的輸出"""
+    periods = []
+    for day in range(7):
+        if rng.random() < 0.15:
+            continue  # 公休
+        slots = [(rng.choice([7, 8, 9, 10, 11, 12]) * 60, rng.choice([17, 18, 19, 20, 21, 22]) * 60)]
+        if rng.random() < 0.15:
+            slots = [(11 * 60, 14 * 60 + 30), (17 * 60, 21 * 60)]
+        elif rng.random() < 0.15:
+            slots = [(rng.choice([18, 19, 20]) * 60, rng.choice([1, 2, 3]) * 60)]  # 營業到隔天凌晨
+        for open_min, close_min in slots:
+            if close_min < open_min:
+                periods.append({"day": day, "open": open_min, "close": 1439, "is_overnight": True})
+                periods.append({"day": (day + 1) % 7, "open": 0, "close": close_min, "is_overnight": True})
+            else:
+                periods.append({"day": day, "open": open_min, "close": close_min, "is_overnight": False})
+    return sorted(periods, key=lambda x: (x['day'], x['open']))
+
+
+def timed(fn, pairs):
+    start = time.perf_counter()
+    results = [fn(cafe, t) for cafe, t in pairs]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cafes", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=20, help="每家店查詢幾個時間點")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    base = datetime(2026, 3, 2)  # 週一
+    cafes = [{"place_id": f"bench_{i}", "opening_hours": {"periods": random_periods(rng), "is_24_hours": False}}
+             for i in range(args.cafes)]
+    pairs = [(cafe, base + timedelta(minutes=rng.randrange(7 * 1440)))
+             for cafe in cafes for _ in range(args.queries)]
+    print(f"🧪 {args.cafes} 家店 x {args.queries} 個時間點 = {len(pairs)} 次查詢")
+
+    old_open, t_old_open = timed(lambda c, t: legacy_is_open(c["opening_hours"]["periods"], t), pairs)
+    old_close, t_old_close = timed(lambda c, t: legacy_hours_until_close(c["opening_hours"], t), pairs)
+
+    start = time.perf_counter()
+    for cafe in cafes:
+        OpeningHours.for_cafe(cafe)
+    t_compile = time.perf_counter() - start
+    new_open, t_new_open = timed(lambda c, t: OpeningHours.for_cafe(c).is_open(t), pairs)
+    new_close, t_new_close = timed(lambda c, t: OpeningHours.for_cafe(c).minutes_until_close(t) / 60.0, pairs)
+    _, t_next = timed(lambda c, t: OpeningHours.for_cafe(c).next_open(t), pairs)
+
+    def per_call(seconds):
+        return f"{seconds / len(pairs) * 1e6:6.2f} µs/次"
+
+    print(f"📊 是否營業      舊版 {per_call(t_old_open)} | 新版 {per_call(t_new_open)} | 加速 {t_old_open / t_new_open:.1f}x")
+    print(f"📊 距離打烊      舊版 {per_call(t_old_close)} | 新版 {per_call(t_new_close)} | 加速 {t_old_close / t_new_close:.1f}x")
+    print(f"📊 下次營業      新版 {per_call(t_next)}")
+    print(f"🧱 編譯 {len(cafes)} 家共 {t_compile * 1000:.1f} ms (每家 {t_compile / len(cafes) * 1e6:.1f} µs，之後依 place_id 記憶化)")
+
+    # 預期差異 1：舊版把打烊那一分鐘算營業中
+    open_mismatch = [(c, t) for (c, t), o, n in zip(pairs, old_open, new_open) if o != n]
+    boundary = sum(1 for c, t in open_mismatch
+                   if any(p["day"] == (t.weekday() + 1) % 7 and p["close"] == t.hour * 60 + t.minute
+                          for p in c["opening_hours"]["periods"]))
+    # 預期差異 2：舊版營業到凌晨的店在 23:59 就當作打烊，新版會接上隔天那一段
+    close_mismatch = [(t, o, n) for (_, t), o, n in zip(pairs, old_close, new_close) if abs(o - n) > 1 / 60 + 1e-9]
+    chained = sum(1 for t, o, n in close_mismatch if n > o and round(t.hour * 60 + t.minute + o * 60) == 1439)
+    close_diff = len(close_mismatch) - chained
+    print(f"🔍 是否營業不一致 {len(open_mismatch) - boundary} 筆 (打烊當分鐘的預期差異 {boundary} 筆)")
+    print(f"🔍 距離打烊不一致 {close_diff} 筆 (跨午夜接續的預期差異 {chained} 筆)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+[回放] 以錄製檔離線重跑所有 Agent / Embedding 呼叫，可當 CI 效能門檻
+
+先在有 Vertex 的環境錄製一段真實流量：
+    AI_BACKEND_MODE=record uvicorn main:app ...        # 錄製檔寫入 ai_recordings/*.jsonl
+
+之後在任何機器上 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/replay_agents.py                               # 照錄製延遲回放
+    python benchmarks/replay_agents.py --latency lognormal:1.2,0.6   # 改用指定的延遲分佈
+    python benchmarks/replay_agents.py --latency none --max-p95 0.05 # 只量本機開銷，p95 超標就回傳 exit code 1
+
+每筆錄製都會經過與線上相同的 ResilientCaller (期限 / 對沖 / 斷路器)，輸出每個 Agent 的命中率與延遲分位數。
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents import ai_backend  # noqa: E402
+from agents.ai_backend import LatencyProfile, RecordingStore, ReplayMissError  # noqa: E402
+from agents.resilience import ResilientCaller  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=ai_backend.AI_RECORD_DIR)
+    parser.add_argument("--latency", default="recorded")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--deadline-s", type=float, default=20.0)
+    parser.add_argument("--max-p95", type=float, default=None, help="任一 Agent 的 p95 (秒) 超過此值即失敗")
+    args = parser.parse_args()
+
+    ai_backend.store = RecordingStore(args.dir)
+    ai_backend.latency_profile = LatencyProfile(args.latency, seed=args.seed)
+
+    files = sorted(glob.glob(os.path.join(args.dir, "*.jsonl")))
+    if not files:
+        print(f"❌ {args.dir} 底下沒有錄製檔，請先以 AI_BACKEND_MODE=record 錄一段流量")
+        sys.exit(1)
+
+    print(f"📼 回放目錄 {args.dir} | 延遲設定 {args.latency}")
+    failed = False
+    for path in files:
+        agent_name = os.path.splitext(os.path.basename(path))[0]
+        entries = ai_backend.store.entries(agent_name)
+        caller = ResilientCaller(agent_name, deadline_seconds=args.deadline_s)
+        latencies, misses = [], 0
+        for entry in entries:
+            start = time.perf_counter()
+            try:
+                # 錄製時的 prompt / generation_config 已經含在 key 裡，直接以 key 回放
+                caller.call(lambda: ai_backend.replay(agent_name, entry["key"]))
+            except ReplayMissError:
+                misses += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+        if not latencies:
+            print(f"   {agent_name:<16} 無可回放的紀錄 (miss {misses})")
+            continue
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        recorded = [e.get("latency", 0.0) for e in entries]
+        print(f"📊 {agent_name:<16} {len(latencies):>5} 筆 | miss {misses} | p50 {statistics.median(ordered):.3f}s | "
+              f"p95 {p95:.3f}s | 錄製時 p50 {statistics.median(recorded):.3f}s")
+        if args.max_p95 is not None and p95 > args.max_p95:
+            print(f"   ❌ p95 {p95:.3f}s 超過門檻 {args.max_p95}s")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
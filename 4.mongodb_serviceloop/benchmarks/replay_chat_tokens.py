@@ -0,0 +1,96 @@
+"""
+[回放] ChatAgent 靜態前綴快取的 Token / 延遲比較
+
+用法 (在 4.mongodb_serviceloop 目錄下，需可連線 Vertex AI)：
+    python benchmarks/replay_chat_tokens.py --input conversations.jsonl
+    python benchmarks/replay_chat_tokens.py --export-from-mongo 200 --input conversations.jsonl   # 先從 interaction_logs 匯出
+
+conversations.jsonl 每行一則：
+    {"user_msg": "...", "chat_window": [...], "current_cart": [...], "last_session_cart": [...]}
+
+兩組 Agent 回放同一份對話：
+- instruction: 靜態前綴只走 system_instruction (僅靠隱式前綴快取)
+- cached     : 靜態前綴走 Vertex AI Context Cache
+輸出每組的平均輸入 Token、被快取的 Token 與平均延遲。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vertexai  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+
+def export_from_mongo(path: str, limit: int):
+    from database import db_client
+    db_client.connect()
+    db = db_client.get_db()
+    cursor = db['interaction_logs'].find(
+        {"action": {"$in": ["SEARCH", "INIT_PREF"]}, "user_msg": {"$nin": [None, ""]}},
+        {"_id": 0, "user_msg": 1}
+    ).sort("created_at_server", -1).limit(limit)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for doc in cursor:
+            f.write(json.dumps({"user_msg": doc["user_msg"], "chat_window": [], "current_cart": [], "last_session_cart": []}, ensure_ascii=False) + "\n")
+            count += 1
+    db_client.close()
+    print(f"📥 已從 interaction_logs 匯出 {count} 則訊息 -> {path}")
+
+
+def replay(agent, conversations: list) -> dict:
+    latencies = []
+    before = dict(agent.usage)
+    for conv in conversations:
+        start = time.perf_counter()
+        agent.manage_dialogue_and_cart(
+            user_msg=conv["user_msg"],
+            chat_window=conv.get("chat_window", []),
+            current_cart=conv.get("current_cart", []),
+            last_session_cart=conv.get("last_session_cart", [])
+        )
+        latencies.append(time.perf_counter() - start)
+    calls = max(1, agent.usage["calls"] - before["calls"])
+    return {
+        "avg_prompt_tokens": (agent.usage["prompt_tokens"] - before["prompt_tokens"]) / calls,
+        "avg_cached_tokens": (agent.usage["cached_tokens"] - before["cached_tokens"]) / calls,
+        "avg_latency_s": statistics.mean(latencies) if latencies else 0.0,
+        "p95_latency_s": sorted(latencies)[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else (latencies or [0.0])[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--export-from-mongo", type=int, default=0, help="先從 interaction_logs 匯出 N 則訊息到 --input")
+    args = parser.parse_args()
+
+    if args.export_from_mongo:
+        export_from_mongo(args.input, args.export_from_mongo)
+
+    with open(args.input, encoding="utf-8") as f:
+        conversations = [json.loads(line) for line in f if line.strip()]
+
+    vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location=os.getenv("GCP_LOCATION", "us-central1"))
+    from agents.chat_agent import ChatAgent
+
+    plain_agent = ChatAgent()
+    plain_agent._cache_disabled = True
+    cached_agent = ChatAgent()
+
+    print(f"🔁 回放 {len(conversations)} 則對話")
+    for name, agent in (("instruction", plain_agent), ("cached", cached_agent)):
+        r = replay(agent, conversations)
+        print(f"  [{name:>11}] 平均輸入 {r['avg_prompt_tokens']:.0f} tokens (其中快取 {r['avg_cached_tokens']:.0f}) | "
+              f"平均延遲 {r['avg_latency_s']:.2f}s | p95 {r['p95_latency_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+[回放] 快速分流器命中率與省下的 LLM 延遲
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/replay_fast_router.py --input messages.jsonl --names-file cafe_names.txt
+    python benchmarks/replay_fast_router.py --from-mongo 1000          # 直接讀 interaction_logs 與 cafes
+
+messages.jsonl 每行一則：
+    {"user_msg": "...", "current_cart": [...], "last_session_cart": [...], "ai_analysis": {...}}
+ai_analysis (ChatAgent 當時的輸出) 可省略；有的話會順便比對分流結果與 LLM 的購物車是否一致。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.fast_router import FastPathRouter  # noqa: E402
+
+
+def load_from_mongo(limit: int):
+    from dotenv import load_dotenv
+    from database import db_client
+    load_dotenv()
+    db_client.connect()
+    db = db_client.get_db()
+    messages = [
+        {"user_msg": d["user_msg"], "current_cart": [], "last_session_cart": [], "ai_analysis": d.get("ai_analysis")}
+        for d in db['interaction_logs'].find(
+            {"action": {"$in": ["SEARCH", "INIT_PREF"]}, "user_msg": {"$nin": [None, ""]}},
+            {"_id": 0, "user_msg": 1, "ai_analysis": 1}
+        ).sort("created_at_server", -1).limit(limit)
+    ]
+    names = []
+    for doc in db['cafes'].find({}, {"_id": 0, "final_name": 1, "original_name": 1}):
+        names.extend([doc.get("final_name"), doc.get("original_name")])
+    db_client.close()
+    return messages, names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input")
+    parser.add_argument("--names-file", help="每行一個店名")
+    parser.add_argument("--from-mongo", type=int, default=0)
+    parser.add_argument("--llm-latency-s", type=float, default=2.0, help="ChatAgent 單次平均耗時 (可從 /api/metrics 的 avg_llm_seconds 取得)")
+    args = parser.parse_args()
+
+    if args.from_mongo:
+        messages, names = load_from_mongo(args.from_mongo)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+        names = []
+        if args.names_file:
+            with open(args.names_file, encoding="utf-8") as f:
+                names = [line.strip() for line in f if line.strip()]
+
+    router = FastPathRouter(cafe_names=names)
+    agree, compared = 0, 0
+    misses = Counter()
+    start = time.perf_counter()
+    for m in messages:
+        result = router.route(m["user_msg"], m.get("current_cart", []), m.get("last_session_cart", []))
+        if result is None:
+            misses[m["user_msg"]] += 1
+            continue
+        recorded = m.get("ai_analysis") or {}
+        if recorded.get("updated_cart") is not None:
+            compared += 1
+            agree += set(recorded["updated_cart"]) == set(result["updated_cart"])
+    route_ms = (time.perf_counter() - start) * 1000 / max(1, len(messages))
+
+    s = router.stats()
+    print(f"🛣️ 回放 {s['total']} 則訊息 | 命中 {s['hits']} 則 ({s['hit_rate'] * 100:.1f}%) | 規則分佈: {s['rule_hits']}")
+    print(f"⏱️ 分流器平均 {route_ms:.3f} ms/則，估計省下 LLM 時間 {s['hits'] * args.llm_latency_s:.0f}s "
+          f"(每則命中約 {args.llm_latency_s:.1f}s)")
+    if compared:
+        print(f"🎯 與當時 LLM 購物車一致率: {agree}/{compared} ({agree / compared * 100:.1f}%)")
+    print("🔝 最常落到 LLM 的訊息:")
+    for msg, n in misses.most_common(10):
+        print(f"   {n:>4} × {msg}")
+
+
+if __name__ == "__main__":
+    main()
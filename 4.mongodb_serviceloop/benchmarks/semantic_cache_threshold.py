@@ -0,0 +1,83 @@
+"""
+[評測] 語意近似快取的相似度門檻 vs 命中率
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/semantic_cache_threshold.py --input queries.jsonl
+    python benchmarks/semantic_cache_threshold.py --from-mongo 2000
+    AI_BACKEND_MODE=replay python benchmarks/semantic_cache_threshold.py --input queries.jsonl   # 用錄製的向量離線跑
+
+queries.jsonl 每行一則：{"query": "中山站附近安靜咖啡", "lat": 25.05, "lng": 121.52}
+依時間順序把查詢丟進 SemanticQueryCache，對每個門檻輸出命中率，並列出門檻附近的配對供人工確認有沒有誤判。
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geo import geohash_encode  # noqa: E402
+from services.semantic_cache import SemanticQueryCache  # noqa: E402
+
+
+def load_from_mongo(limit: int):
+    from dotenv import load_dotenv
+    from database import db_client
+    load_dotenv()
+    db_client.connect()
+    logs = list(db_client.get_db()['interaction_logs'].find(
+        {"action": "SEARCH", "user_msg": {"$nin": [None, ""]}, "lat": {"$ne": None}},
+        {"_id": 0, "user_msg": 1, "lat": 1, "lng": 1}
+    ).sort("created_at_server", 1).limit(limit))
+    db_client.close()
+    return [{"query": d["user_msg"], "lat": d["lat"], "lng": d["lng"]} for d in logs]
+
+
+def embed_all(queries):
+    import vertexai
+    from dotenv import load_dotenv
+    from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+    from agents.ai_backend import AI_BACKEND_MODE, wrap_embedding_model
+    load_dotenv()
+    if AI_BACKEND_MODE != "replay":
+        vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location=os.getenv("GCP_LOCATION", "us-central1"))
+    model = wrap_embedding_model(None if AI_BACKEND_MODE == "replay" else TextEmbeddingModel.from_pretrained("gemini-embedding-001"))
+    vectors = {}
+    for q in {q["query"] for q in queries}:
+        vectors[q] = model.get_embeddings([TextEmbeddingInput(q, "RETRIEVAL_QUERY")], output_dimensionality=1536)[0].values
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input")
+    parser.add_argument("--from-mongo", type=int, default=0)
+    parser.add_argument("--precision", type=int, default=6)
+    parser.add_argument("--thresholds", default="0.86,0.88,0.90,0.92,0.94,0.96")
+    args = parser.parse_args()
+
+    if args.from_mongo:
+        queries = load_from_mongo(args.from_mongo)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    vectors = embed_all(queries)
+    print(f"🧪 {len(queries)} 則查詢 ({len(vectors)} 種不同字串) | geohash 精度 {args.precision}")
+
+    for threshold in [float(t) for t in args.thresholds.split(",")]:
+        cache = SemanticQueryCache(threshold=threshold, ttl_seconds=10 ** 9, max_entries=10 ** 9)
+        near_misses = []
+        for q in queries:
+            cell = geohash_encode(q["lat"], q["lng"], args.precision)
+            hit = cache.lookup(cell, vectors[q["query"]])
+            if hit is None:
+                cache.set(cell, vectors[q["query"]], q["query"], [])
+            elif hit[3] != q["query"] and hit[2] < threshold + 0.02:
+                near_misses.append((hit[2], hit[3], q["query"]))
+        s = cache.stats()
+        print(f"📊 門檻 {threshold:.2f} | 命中率 {s['hit_rate'] * 100:5.1f}% | 平均相似度 {s['avg_hit_similarity']}")
+        for sim, a, b in near_misses[:3]:
+            print(f"      {sim:.3f}  '{a}' ≈ '{b}'")
+
+
+if __name__ == "__main__":
+    main()
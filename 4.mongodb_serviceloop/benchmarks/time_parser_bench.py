@@ -0,0 +1,148 @@
+"""
+[評測] 規則式時間解析 vs IntentAgent (Gemini) 的準確率與延遲，語料取自線上真實訊息
+
+用法 (在 4.mongodb_serviceloop 目錄下)：
+    python benchmarks/time_parser_bench.py --from-mongo 2000               # 直接讀 interaction_logs
+    python benchmarks/time_parser_bench.py --input phrases.jsonl           # 讀匯出的訊息檔
+    python benchmarks/time_parser_bench.py --from-mongo 500 --with-agent   # 同時現場呼叫 IntentAgent 比較 (需可連線 Vertex AI)
+
+phrases.jsonl 每行一則 (欄位與 interaction_logs 相同，可直接用 mongoexport 匯出)：
+    {"user_msg": "...", "created_at_server": "2026-10-19 15:20", "ai_analysis": {"intent": {...}}}
+也可另外加上人工標註 "expected": "YYYY-MM-DD HH:MM" 或 null，有的話優先於記錄裡 LLM 的答案。
+
+準確率的標準答案是「當時線上 ChatAgent 解析出的 intent」(或人工標註)，規則解析以訊息的記錄時間當作現在時間重算，
+兩者結果一樣才算正確。規則解析信心不足 (會退回 LLM) 的句子另外統計，不計入規則的準確率；
+規則答錯的句子全部列出，新增的規則要先在這份語料上確認不會答錯再上線。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_taiwan_now  # noqa: E402
+from time_parser import parse_time_expression, TIME_PARSER_MIN_CONFIDENCE  # noqa: E402
+
+
+def _to_datetime(value):
+    if isinstance(value, dict) and "$date" in value:  # mongoexport 的 Extended JSON
+        value = value["$date"]
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    # 與 get_taiwan_now() 一樣以不帶時區的台灣時間比較
+    return value.replace(tzinfo=None) if value else None
+
+
+def _label(doc):
+    """標準答案：人工標註優先，否則用記錄裡 ChatAgent 的 intent；兩者都沒有的訊息不納入語料"""
+    if "expected" in doc:
+        return doc["expected"]
+    intent = (doc.get("ai_analysis") or {}).get("intent")
+    if not isinstance(intent, dict):
+        return "MISSING"
+    return intent.get("target_time") if intent.get("has_time") else None
+
+
+def load_from_mongo(limit: int):
+    from dotenv import load_dotenv
+    from database import db_client
+    load_dotenv()
+    db_client.connect()
+    docs = list(db_client.get_db()['interaction_logs'].find(
+        {"action": {"$in": ["SEARCH", "INIT_PREF"]}, "user_msg": {"$nin": [None, ""]},
+         "ai_analysis.intent": {"$exists": True}},
+        {"_id": 0, "user_msg": 1, "ai_analysis.intent": 1, "created_at_server": 1}
+    ).sort("created_at_server", -1).limit(limit))
+    db_client.close()
+    return docs
+
+
+def build_corpus(docs):
+    corpus = []
+    for doc in docs:
+        expected = _label(doc)
+        now = _to_datetime(doc.get("created_at_server"))
+        if expected == "MISSING" or now is None:
+            continue
+        corpus.append({"text": doc["user_msg"], "now": now, "expected": expected})
+    return corpus
+
+
+def evaluate_rules(corpus):
+    correct = handled = 0
+    latencies = []
+    for item in corpus:
+        start = time.perf_counter()
+        out = parse_time_expression(item["text"], item["now"])
+        latencies.append(time.perf_counter() - start)
+        if out["confidence"] < TIME_PARSER_MIN_CONFIDENCE:  # 規則解析放棄，交給 LLM
+            continue
+        handled += 1
+        got = out["target_time"] if out["has_time"] else None
+        if got == item["expected"]:
+            correct += 1
+        else:
+            print(f"   ✗ [rules] {item['text']!r} @ {item['now']:%Y-%m-%d %H:%M}: "
+                  f"預期 {item['expected']}，得到 {got} (信心 {out['confidence']:.2f})")
+    print(f"📊 [ rules] 處理 {handled}/{len(corpus)} 句 | 正確 {correct}/{handled} "
+          f"({correct / handled * 100 if handled else 0:.1f}%) | 平均延遲 {statistics.mean(latencies) * 1000:.3f} ms")
+
+
+def evaluate_agent(corpus):
+    """IntentAgent 只能以「現在」解析，因此拿同一時間點的規則結果比對，並量測每句的 LLM 延遲"""
+    import vertexai
+    from dotenv import load_dotenv
+    load_dotenv()
+    vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location=os.getenv("GCP_LOCATION", "us-central1"))
+    from agents.intent_agent import IntentAgent
+    agent = IntentAgent()
+
+    agree = handled = 0
+    latencies = []
+    for item in corpus:
+        start = time.perf_counter()
+        out = agent.analyze_user_intent(item["text"], use_rules=False)
+        latencies.append(time.perf_counter() - start)
+        rules = parse_time_expression(item["text"], get_taiwan_now())
+        if rules["confidence"] < TIME_PARSER_MIN_CONFIDENCE:
+            continue
+        handled += 1
+        got = out.get("target_time") if out.get("has_time") else None
+        agree += got == (rules["target_time"] if rules["has_time"] else None)
+    print(f"📊 [ agent] {len(corpus)} 句 | 規則可處理的 {handled} 句中結果一致 {agree} 句 | "
+          f"平均延遲 {statistics.mean(latencies) * 1000:.0f} ms | p95 "
+          f"{sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="匯出的 interaction_logs JSONL")
+    parser.add_argument("--from-mongo", type=int, default=0)
+    parser.add_argument("--with-agent", action="store_true")
+    args = parser.parse_args()
+
+    if args.from_mongo:
+        docs = load_from_mongo(args.from_mongo)
+    elif args.input:
+        with open(args.input, encoding="utf-8") as f:
+            docs = [json.loads(line) for line in f if line.strip()]
+    else:
+        parser.error("需要 --input 或 --from-mongo")
+
+    corpus = build_corpus(docs)
+    if not corpus:
+        print("⚠️ 沒有帶 intent 的訊息可評測")
+        return
+    with_time = sum(1 for item in corpus if item["expected"])
+    print(f"🕒 語料 {len(corpus)} 句 (其中指定時間 {with_time} 句)，信心門檻 {TIME_PARSER_MIN_CONFIDENCE}")
+
+    evaluate_rules(corpus)
+    if args.with_agent:
+        evaluate_agent(corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,15 @@ import random
 import logging
 import asyncio
 import re
+import time
 from pathlib import Path
 from contextlib import asynccontextmanager
 from urllib.parse import quote
 
 from fastapi import FastAPI, Request, Header, HTTPException
 from pydantic import BaseModel
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError, LineBotApiError
+from linebot import WebhookHandler
+from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, 
     LocationMessage, FlexSendMessage, PostbackEvent,
@@ -21,16 +22,22 @@ from linebot.models import (
 from dotenv import load_dotenv
 import vertexai
 from utils import get_taiwan_now
+from opening_hours import OpeningHours
 
 # 🔥 處理時間狀態
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 # 引入自定義模組
 from database import db_client
 from services.recommend_service import RecommendService
 from services.user_service import UserService
+from services.cache import TTLCache, get_ingest_version
+from services.line_client import AsyncLineClient
+from services.fast_router import FastPathRouter
+from services.persona_queue import PersonaUpdateQueue
 from agents.chat_agent import ChatAgent
 from agents.preference_agent import PreferenceAgent
+from agents import ai_backend
 
 # --- 強制抓取 .env ---
 current_file_path = Path(__file__).resolve()
@@ -50,7 +57,13 @@ logger.info(f"✅ 全域 Vertex AI 初始化完成 (Project: {GCP_PROJECT}, Loca
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     db_client.connect()
+    persona_queue.start()
+    # 對話總管的 Context Cache 在背景建立與延長，不佔用使用者請求的時間
+    context_cache_task = asyncio.create_task(chat_agent.run_context_cache_refresher())
     yield
+    context_cache_task.cancel()
+    await persona_queue.stop()
+    await line_client.aclose()
     db_client.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -61,6 +74,7 @@ class SimulatorRequest(BaseModel):
     user_id: str
     location: list[float]  # 格式預期為 [經度 lng, 緯度 lat]
     query: str
+    explain: bool = False  # 🔍 設為 true 時額外回傳所有候選的分數明細
 
 @app.post("/api/search")
 async def ai_simulator_search(req: SimulatorRequest):
@@ -74,7 +88,8 @@ async def ai_simulator_search(req: SimulatorRequest):
             lat=lat, 
             lng=lng, 
             user_id=req.user_id, 
-            user_query=req.query
+            user_query=req.query,
+            explain=req.explain
         )
         
         cafe_list = result.get("data", [])
@@ -90,26 +105,62 @@ async def ai_simulator_search(req: SimulatorRequest):
                 "tags": cafe.get('display_tags', [])
             })
             
-        return {
+        response = {
             "status": "success",
             "data": formatted_data
         }
+        if req.explain:
+            response["explain"] = result.get("explain", [])
+        return response
     except Exception as e:
         logger.error(f"❌ 模擬器請求失敗: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
+# === 服務內部快取與效能指標 (命中率等) ===
+@app.get("/api/metrics")
+async def service_metrics():
+    return {
+        "result_cache": recommend_service.result_cache.stats(),
+        "cafe_snapshot": recommend_service.cafe_snapshot.stats(),
+        "semantic_cache": recommend_service.semantic_cache.stats(),
+        "reason_snippets": recommend_service.reason_snippets.stats(),
+        "card_fragment_cache": card_fragment_cache.stats(),
+        "opening_hours_cache": OpeningHours.cache_stats(),
+        "line_client": line_client.stats,
+        "chat_agent_tokens": chat_agent.usage,
+        "fast_router": fast_router.stats(),
+        "persona_queue": persona_queue.stats(),
+        # 各 Agent 的斷路器狀態、逾時與對沖次數
+        "agents": {
+            agent.caller.name: agent.caller.stats()
+            for agent in (chat_agent, recommend_service.intent_agent, recommend_service.reason_agent, preference_agent)
+        },
+        "ai_backend": {"mode": ai_backend.AI_BACKEND_MODE, **ai_backend.store.counters}
+    }
+
+# 🚀 非阻塞 LINE 客戶端 (共用連線池)，取代同步的 LineBotApi
+line_client = AsyncLineClient(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
 handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
 
 recommend_service = RecommendService()
 user_service = UserService()
 chat_agent = ChatAgent()
+fast_router = FastPathRouter()
 preference_agent = PreferenceAgent()
+# 🕵️ 偏好畫像重算佇列：同一人短時間多次操作只重算一次，多人合併成一次 LLM 呼叫
+persona_queue = PersonaUpdateQueue(user_service, preference_agent)
 
 user_sessions = {}
 blacklist_sessions = {} 
 pending_search_sessions = {}  # 新增：紀錄「尚未定位」的待辦搜尋
 
+# 🧱 每家店 Flex 卡片的靜態片段 (店名、星等、地圖連結)，Stage D 重新匯入後自動失效
+card_fragment_cache = TTLCache(
+    "CardFragments",
+    ttl_seconds=int(os.getenv("CARD_FRAGMENT_TTL_SECONDS", 3600)),
+    max_entries=int(os.getenv("CARD_FRAGMENT_MAX_ENTRIES", 3000))
+)
+
 # --- 分類 10 標籤：按鈕翻譯字典 ---
 MACRO_TAG_MAPPING = {
     "絕對不限時": "不限時",
@@ -125,6 +176,10 @@ MACRO_TAG_MAPPING = {
 }
 
 # --- 輔助函式 ---
+def reply_in_background(reply_token, messages, user_id=None):
+    """同步 handler 專用：把送訊息排進 event loop 背景執行，webhook 不必等 LINE API 回應"""
+    asyncio.create_task(line_client.send(reply_token, messages, user_id=user_id))
+
 def get_standard_quick_reply():
     return QuickReply(items=[
         QuickReplyButton(action={"type": "location", "label": "📍 點我找附近的店"}),
@@ -213,101 +268,33 @@ def create_star_rating_box(rating, total_reviews):
 
 # --- 營業時間狀態產生器 ---
 def get_opening_status(cafe_data):
-    opening_hours = cafe_data.get("opening_hours")
-    if not opening_hours or "periods" not in opening_hours:
+    """依目前時間回傳 (狀態文字, 顏色)；營業時段由 OpeningHours 依 place_id 編譯並快取"""
+    hours = OpeningHours.for_cafe(cafe_data)
+    if not hours.has_data:
         return "", ""
+    if hours.is_24h:
+        return "24 小時營業", "#00B900"
 
-    periods = opening_hours.get("periods", [])
-    if not periods:
+    tw_now = get_taiwan_now()
+    close_at = hours.closes_at(tw_now)
+    if close_at:
+        # 營業到午夜的店顯示 23:59，不要變成「明日 00:00」
+        if close_at.hour == 0 and close_at.minute == 0:
+            close_at -= timedelta(minutes=1)
+        close_str = close_at.strftime("%H:%M")
+        if close_at.date() != tw_now.date():
+            return f"營業至明日 {close_str}", "#00B900"
+        return f"營業至 {close_str}", "#00B900"
+
+    open_at = hours.next_open(tw_now)
+    if not open_at:
         return "", ""
-    
-    if opening_hours.get("is_24_hours", False):
-        return "24 小時營業", "#00B900"
-    
-    def parse_time(val):
-        if val is None: return None
-        v = int(val)
-        if v > 1440 and v != 2359: return (v // 100) * 60 + (v % 100)
-        if v == 2359: return 1439
-        return v
-    
-    week_periods = []
-    for p in periods:
-        open_day = int(p.get("day", 0))
-        open_time = parse_time(p.get("open", 0))
-        close_time = parse_time(p.get("close"))
-
-        if close_time is None:
-            if open_time == 0: return "24 小時營業", "#00B900"
-            continue
-            
-        start_mins = open_day * 24 * 60 + open_time
-        close_day = open_day
-        if close_time < open_time:
-            close_day = (open_day + 1) % 7
-            
-        end_mins = close_day * 24 * 60 + close_time
-        if end_mins < start_mins: end_mins += 7 * 24 * 60
-        week_periods.append([start_mins, end_mins])
-
-    # 排序並合併相連的營業時間 (例如 23:59 接著 00:00)
-    week_periods.sort(key=lambda x: x[0])
-    merged = []
-    for p in week_periods:
-        if not merged:
-            merged.append(p)
-        else:
-            last_start, last_end = merged[-1]
-            if p[0] <= last_end + 1: # 容差 1 分鐘，完美接軌
-                merged[-1][1] = max(last_end, p[1])
-            else:
-                merged.append(p)
-
-    # 處理週末跨週一的循環
-    if merged and merged[-1][1] >= 7 * 24 * 60:
-        overflow = merged[-1][1] - 7 * 24 * 60
-        if merged[0][0] <= overflow + 1:
-            merged[0][0] = merged[-1][0] - 7 * 24 * 60
-            merged[-1][1] = merged[0][1] + 7 * 24 * 60
-
-    tw_now = datetime.utcnow() + timedelta(hours=8)
-    current_iso = tw_now.isoweekday()
-    current_day = 0 if current_iso == 7 else current_iso
-    current_mins = current_day * 24 * 60 + tw_now.hour * 60 + tw_now.minute
-
-    min_diff = float('inf')
-    next_open_info = None
-    day_map = {0: "週日", 1: "週一", 2: "週二", 3: "週三", 4: "週四", 5: "週五", 6: "週六"}
-
-    for start_abs, end_abs in merged:
-        for offset in [0, -7 * 24 * 60, 7 * 24 * 60]:
-            c_mins = current_mins + offset
-            if start_abs <= c_mins < end_abs:
-                close_day = (end_abs // (24 * 60)) % 7
-                close_time = end_abs % (24 * 60)
-                close_hour, close_min = close_time // 60, close_time % 60
-                
-                if close_time >= 1439: close_str = "23:59"
-                else: close_str = f"{close_hour:02d}:{close_min:02d}"
-                    
-                if close_day != current_day:
-                    return f"營業至明日 {close_str}", "#00B900"
-                return f"營業至 {close_str}", "#00B900"
-
-            diff = start_abs - c_mins
-            if 0 < diff < min_diff:
-                min_diff = diff
-                open_day = (start_abs // (24 * 60)) % 7
-                open_time = start_abs % (24 * 60)
-                open_hour, open_min = open_time // 60, open_time % 60
-                day_str = "明日" if open_day == (current_day + 1) % 7 else day_map[open_day]
-                next_open_info = f"下次營業 {day_str} {open_hour:02d}:{open_min:02d}"
-
-    if next_open_info: return next_open_info, "#f56565"
-    return "今日未營業", "#999999"
+    day_map = {0: "週一", 1: "週二", 2: "週三", 3: "週四", 4: "週五", 5: "週六", 6: "週日"}
+    day_str = "明日" if open_at.date() == tw_now.date() + timedelta(days=1) else day_map[open_at.weekday()]
+    return f"下次營業 {day_str} {open_at.strftime('%H:%M')}", "#f56565"
 
 # ✨ 修改：發送 4 大情境懶人包卡片
-def send_explore_categories(reply_token):
+def send_explore_categories(reply_token, user_id=None):
     def create_theme_card(title, img_url, theme_val):
         return {
             "type": "bubble", "size": "kilo", 
@@ -333,7 +320,7 @@ def send_explore_categories(reply_token):
     ]
 
     flex_message = FlexSendMessage(alt_text="四大情境探索", contents={"type": "carousel", "contents": bubbles})
-    line_bot_api.reply_message(reply_token, flex_message)
+    reply_in_background(reply_token, flex_message, user_id)
 
 # ✨ 顯示「我的收藏」或「我的黑名單」卡片
 def show_user_list(reply_token, user_id, list_type):
@@ -341,16 +328,15 @@ def show_user_list(reply_token, user_id, list_type):
     list_name = "收藏清單 ❤️" if list_type == "bookmarks" else "黑名單 🚫"
     
     if not cafes:
-        line_bot_api.reply_message(
+        reply_in_background(
             reply_token, 
-            TextSendMessage(text=f"您的{list_name}目前是空的喔！", quick_reply=get_standard_quick_reply())
+            TextSendMessage(text=f"您的{list_name}目前是空的喔！", quick_reply=get_standard_quick_reply()),
+            user_id
         )
         return
 
     bubbles = []
     for cafe in cafes[:3]: # 最多顯示 3 筆
-        shop_name = cafe.get("final_name", "未知店家")
-        original_name = cafe.get("original_name", shop_name)
         place_id = cafe.get('place_id', '')
         
         # 🔥 修改這裡：對齊 MongoDB 的巢狀欄位結構，正確抓出星星與評論數
@@ -358,9 +344,9 @@ def show_user_list(reply_token, user_id, list_type):
         rating = db_ratings.get("rating", cafe.get("rating", 0.0))
         total_reviews = db_ratings.get("review_amount", cafe.get("total_ratings", 0))
         
-        contact_info = cafe.get("contact", {})
-        db_map_url = contact_info.get("google_maps_url")
-        map_url = db_map_url if db_map_url else f"https://www.google.com/maps/search/?api=1&query={quote(original_name)}&query_place_id={place_id}"
+        fragment = get_card_fragment(dict(cafe, final_name=cafe.get("final_name", "未知店家")), rating, total_reviews)
+        shop_name = fragment["shop_name"]
+        map_url = fragment["map_url"]
         
         if list_type == "bookmarks":
             action_buttons = [
@@ -378,9 +364,9 @@ def show_user_list(reply_token, user_id, list_type):
                 "type": "box", "layout": "vertical", "spacing": "sm",
                 "contents": [
                     {"type": "text", "text": f"🏷️ {list_name}", "size": "xs", "color": "#ff6b6b" if list_type == "bookmarks" else "#718096", "weight": "bold"},
-                    {"type": "text", "text": shop_name, "weight": "bold", "size": "xl", "wrap": True},
+                    fragment["name_text"],
                     # ✨ 成功把正確的星星和評論數放進卡片裡！
-                    create_star_rating_box(rating, total_reviews)
+                    fragment["star_box"]
                 ]
             },
             "footer": {
@@ -401,17 +387,59 @@ def show_user_list(reply_token, user_id, list_type):
         contents={"type": "carousel", "contents": bubbles},
         quick_reply=get_list_view_quick_reply()
     )
-    line_bot_api.reply_message(reply_token, flex_message)
+    reply_in_background(reply_token, flex_message, user_id)
+
+# --- 🧱 卡片靜態片段 (依 place_id 快取) ---
+def get_card_fragment(cafe, rating=None, total_reviews=None):
+    """
+    回傳一家店卡片中「與請求無關」的部分：店名、星等列、地圖連結、postback 用的安全店名。
+    距離、營業狀態、標籤、推薦理由與按鈕資料仍由呼叫端每次動態組裝。
+    """
+    place_id = cafe.get('place_id', '')
+    if rating is None:
+        rating = cafe.get('rating', 0.0)
+    if total_reviews is None:
+        total_reviews = cafe.get('total_ratings', 0)
+
+    try:
+        ingest_version = get_ingest_version(db_client.get_db())
+        card_fragment_cache.sync_version(ingest_version)
+        OpeningHours.sync_version(ingest_version)
+    except Exception as e:
+        logger.warning(f"⚠️ 卡片快取版本檢查失敗: {e}")
+
+    # 星等與評論數也放進 key，避免不同來源 (推薦結果 / 收藏清單) 的數字不一致時拿到舊片段
+    cache_key = (place_id, rating, total_reviews)
+    fragment = card_fragment_cache.get(cache_key) if place_id else None
+    if fragment is not None:
+        return fragment
+
+    shop_name = cafe.get("final_name", "咖啡廳")
+    original_name = cafe.get("original_name", shop_name)
+    contact_info = cafe.get("contact", {}) or {}
+    db_map_url = contact_info.get("google_maps_url")
+
+    fragment = {
+        "shop_name": shop_name,
+        "safe_name": shop_name.replace('&', '及').replace('=', '-')[:20],
+        "name_text": {"type": "text", "text": shop_name, "weight": "bold", "size": "xl", "wrap": True},
+        "star_box": create_star_rating_box(rating, total_reviews),
+        "map_url": db_map_url if db_map_url else f"https://www.google.com/maps/search/?api=1&query={quote(original_name)}&query_place_id={place_id}"
+    }
+    if place_id:
+        card_fragment_cache.set(cache_key, fragment)
+    return fragment
 
 # --- 核心搜尋流程 ---
-async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_query=None, opening=None, closing=None, rejected_place_id=None, negative_reason=None, theme=None):
+async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_query=None, opening=None, closing=None, rejected_place_id=None, negative_reason=None, theme=None, pre_parsed_intent=None):
    result = await recommend_service.recommend(
         lat=lat, lng=lng, user_id=user_id, 
         user_query=user_query, 
         cafe_tag=tag,
         rejected_place_id=rejected_place_id,
         negative_reason=negative_reason,
-        theme=theme
+        theme=theme,
+        pre_parsed_intent=pre_parsed_intent
     )
    cafe_list = result.get("data", [])
 
@@ -451,13 +479,11 @@ async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_
                     "或是點擊下方按鈕換個地點找找看👇"
                 )
                 
-            try:
-                line_bot_api.reply_message(
-                    reply_token,
-                    TextSendMessage(text=reply_text, quick_reply=get_standard_quick_reply())
-                )
-            except LineBotApiError as e:
-                logger.warning(f"⚠️ 傳送失敗: {e.message}")
+            await line_client.send(
+                reply_token,
+                TextSendMessage(text=reply_text, quick_reply=get_standard_quick_reply()),
+                user_id
+            )
                 
             return # 🌟 找不到店就直接 return，終止後續的出菜流程！    
     
@@ -525,28 +551,20 @@ async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_
 
    bubbles = []
    for cafe in cafe_list:
-        shop_name = cafe.get("final_name", "咖啡廳")
-        original_name = cafe.get("original_name", shop_name)
         place_id = cafe.get('place_id', '')
+        # 🧱 靜態片段直接取快取，以下只組裝每次請求都會變的部分
+        fragment = get_card_fragment(cafe)
+        map_url = fragment["map_url"]
         
         display_tags = cafe.get('display_tags', [])
         
         dist_m = cafe.get('dist_meters', 0)
         dist_str = f"{dist_m / 1000:.1f} km" if dist_m >= 1000 else f"{int(dist_m)} m"
-        
-        rating = cafe.get('rating', 0.0) 
-        total_reviews = cafe.get('total_ratings', 0)
 
         raw_reason = cafe.get('custom_reason', '') 
         
         summary_text = clean_summary_text(raw_reason)
         
-        contact_info = cafe.get("contact", {})
-        
-        contact_info = cafe.get("contact", {})
-        db_map_url = contact_info.get("google_maps_url")
-        map_url = db_map_url if db_map_url else f"https://www.google.com/maps/search/?api=1&query={quote(original_name)}&query_place_id={place_id}"
-        
         open_text, open_color = get_opening_status(cafe)
         
         dist_time_contents = [
@@ -600,15 +618,15 @@ async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_
                 }
             )
         
-        safe_name = shop_name.replace('&', '及').replace('=', '-')[:20]
+        safe_name = fragment["safe_name"]
 
         bubbles.append({
             "type": "bubble",
             "body": {
                 "type": "box", "layout": "vertical", "spacing": "sm",
                 "contents": [
-                    {"type": "text", "text": shop_name, "weight": "bold", "size": "xl", "wrap": True},
-                    create_star_rating_box(rating, total_reviews),
+                    fragment["name_text"],
+                    fragment["star_box"],
                     {
                         "type": "box", "layout": "vertical", "spacing": "xs", "margin": "md",
                         "contents": info_box_contents
@@ -643,11 +661,8 @@ async def process_recommendation(reply_token, lat, lng, user_id, tag=None, user_
         reply_payload.append(TextSendMessage(text="還想找其他的嗎？", quick_reply=get_standard_quick_reply()))
         
    
-   # 🛡️ 加上防護罩：即使 Token 過期或重複，也不會讓伺服器崩潰
-   try:
-       line_bot_api.reply_message(reply_token, reply_payload)
-   except LineBotApiError as e:
-       logger.warning(f"⚠️ 傳送失敗 (Reply Token 已失效或被重複使用): {e.message}")
+   # 🛡️ Token 過期或重複時由 line_client 自動改用 Push 補送，不會讓伺服器崩潰
+   await line_client.send(reply_token, reply_payload, user_id)
 
 # --- Handlers ---
 @app.post("/callback")
@@ -662,6 +677,7 @@ async def callback(request: Request, x_line_signature: str = Header(None)):
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text(event):
+    line_client.track_event(event)
     # 🚀 秘訣：收到訊息瞬間，立刻把所有沉重的工作丟給背景執行！
     # 這樣主程式就能瞬間結束，立刻回傳 200 OK 給 LINE，徹底阻止 LINE 啟動「超時重試」機制
     asyncio.create_task(background_handle_text(event))
@@ -672,9 +688,7 @@ async def background_handle_text(event):
 
     if user_msg == "重置":
         if user_id in user_sessions: del user_sessions[user_id]
-        try:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="🔄 對話狀態已重置。", quick_reply=get_standard_quick_reply()))
-        except: pass
+        await line_client.send(event.reply_token, TextSendMessage(text="🔄 對話狀態已重置。", quick_reply=get_standard_quick_reply()), user_id)
         return
 
     loc = user_service.get_user_location(user_id)
@@ -698,18 +712,20 @@ async def background_handle_text(event):
             QuickReplyButton(action=PostbackAction(label="不要，下次再看看", data=f"action=confirm_blacklist&id={target_place_id}&ans=no"))
         ])
         
-        try:
-            line_bot_api.reply_message(
-                event.reply_token, 
-                TextSendMessage(text=f"了解，因為「{user_msg}」。\n\n請問要將這家店加入黑名單（以後不再推薦）嗎？", quick_reply=quick_reply)
-            )
-        except: pass
+        await line_client.send(
+            event.reply_token, 
+            TextSendMessage(text=f"了解，因為「{user_msg}」。\n\n請問要將這家店加入黑名單（以後不再推薦）嗎？", quick_reply=quick_reply),
+            user_id
+        )
         return
     
     # 一般流程
     is_old_user = user_service.check_user_exists(user_id)
 
     if loc:
+        # ⏳ 先顯示「輸入中」動畫，LLM 思考期間使用者不會以為機器人當掉
+        asyncio.create_task(line_client.start_loading(user_id))
+
         # 🧠 1. 喚醒記憶：獲取使用者 RAM
         user_state = user_service.get_user_state(user_id)
         chat_window = user_state.get("chat_window", [])
@@ -725,13 +741,19 @@ async def background_handle_text(event):
                 current_cart = []
                 chat_window = []
 
-        # 🤖 3. 呼叫終極大腦
-        ai_result = chat_agent.manage_dialogue_and_cart(
-            user_msg=user_msg,
-            chat_window=chat_window,
-            current_cart=current_cart,
-            last_session_cart=last_session_cart
-        )
+        # 🛣️ 3. 先走規則式快速分流 (單一標籤 / 地點 / 店名)，不確定時才呼叫終極大腦
+        ai_result = fast_router.route(user_msg, current_cart, last_session_cart, db=db_client.get_db())
+        if ai_result is None:
+            llm_start = time.time()
+            # 同步的 Gemini 呼叫丟到執行緒，不卡住 event loop 上其他使用者的請求
+            ai_result = await asyncio.to_thread(
+                chat_agent.manage_dialogue_and_cart,
+                user_msg=user_msg,
+                chat_window=chat_window,
+                current_cart=current_cart,
+                last_session_cart=last_session_cart
+            )
+            fast_router.record_llm_call(time.time() - llm_start)
 
         mode = ai_result.get("mode", "search")
         reply_text = ai_result.get("reply", "")
@@ -749,9 +771,7 @@ async def background_handle_text(event):
 
         # 💬 6. 執行分支：如果是純聊天或隔夜反問，直接回覆並結束
         if mode == "chat":
-            try:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text, quick_reply=get_standard_quick_reply()))
-            except: pass
+            await line_client.send(event.reply_token, TextSendMessage(text=reply_text, quick_reply=get_standard_quick_reply()), user_id)
             return
 
         # 🔎 7. 執行分支：進入 Search 模式
@@ -774,17 +794,17 @@ async def background_handle_text(event):
             event.reply_token, lat, lng, user_id, 
             tag=primary_tag, 
             user_query=search_term, 
-            opening=opening, closing=closing
+            opening=opening, closing=closing,
+            pre_parsed_intent=ai_result.get("intent") # 🧠 對話總管已解析好時間意圖，推薦引擎不必再呼叫 IntentAgent
         )
         return
 
-    try:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請先點擊下方按鈕分享位置，我才能幫您找附近的店喔！👇", quick_reply=get_standard_quick_reply()))
-    except: pass
+    await line_client.send(event.reply_token, TextSendMessage(text="請先點擊下方按鈕分享位置，我才能幫您找附近的店喔！👇", quick_reply=get_standard_quick_reply()), user_id)
 
 
 @handler.add(MessageEvent, message=LocationMessage)
 def handle_location(event):
+    line_client.track_event(event)
     lat, lng = event.message.latitude, event.message.longitude
     user_id = event.source.user_id
     
@@ -805,13 +825,14 @@ def handle_location(event):
             QuickReplyButton(action=PostbackAction(label="🗣️ 朋友聚會", data="action=onboarding&tag=熱鬧")),
             QuickReplyButton(action=PostbackAction(label="☕ 復古文青", data="action=onboarding&tag=復古")),
         ])
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="👋 初次見面！請問想找哪類咖啡廳？", quick_reply=quick_reply))
+        reply_in_background(event.reply_token, TextSendMessage(text="👋 初次見面！請問想找哪類咖啡廳？", quick_reply=quick_reply), user_id)
         return 
 
     asyncio.create_task(process_recommendation(event.reply_token, lat, lng, user_id=user_id))
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
+    line_client.track_event(event)
     user_id = event.source.user_id
     params = dict(item.split('=', 1) for item in event.postback.data.split('&') if '=' in item)
     action = params.get('action')
@@ -823,15 +844,16 @@ def handle_postback(event):
 
     # ✨ 新增：處理「看完了」收起清單的動作
     if action == "close_list":
-        line_bot_api.reply_message(
+        reply_in_background(
             event.reply_token, 
-            TextSendMessage(text="OK！隨時可以再呼叫我找店喔 👇", quick_reply=get_standard_quick_reply())
+            TextSendMessage(text="OK！隨時可以再呼叫我找店喔 👇", quick_reply=get_standard_quick_reply()),
+            user_id
         )
         return
 
     # ✨ 新增：呼叫 4 大分類探索卡片
     if action == "explore":
-        send_explore_categories(event.reply_token)
+        send_explore_categories(event.reply_token, user_id)
         return
     
     # ✨ 新增：處理情境懶人包的點擊
@@ -844,7 +866,7 @@ def handle_postback(event):
             user_service.update_user_state(user_id, [], [theme_names.get(theme, "")], [])
             asyncio.create_task(process_recommendation(event.reply_token, lat, lng, user_id=user_id, theme=theme))
         else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="📍 請先分享位置，我才能幫您找附近的店喔！", quick_reply=get_standard_quick_reply()))
+            reply_in_background(event.reply_token, TextSendMessage(text="📍 請先分享位置，我才能幫您找附近的店喔！", quick_reply=get_standard_quick_reply()), user_id)
         return
     
     # ✨ 新增：處理情境懶人包的點擊
@@ -857,7 +879,7 @@ def handle_postback(event):
             user_service.update_user_state(user_id, [], [theme_names.get(theme, "")], [])
             asyncio.create_task(process_recommendation(event.reply_token, lat, lng, user_id=user_id, theme=theme, opening=op_msg))
         else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="📍 請先分享位置，我才能幫您找附近的店喔！", quick_reply=get_standard_quick_reply()))
+            reply_in_background(event.reply_token, TextSendMessage(text="📍 請先分享位置，我才能幫您找附近的店喔！", quick_reply=get_standard_quick_reply()), user_id)
         return
 
     if action == "quick_tag":
@@ -870,9 +892,10 @@ def handle_postback(event):
             asyncio.create_task(process_recommendation(event.reply_token, lat, lng, user_id=user_id, tag=mapped_tag, opening=op, closing=cl))
         else:
             pending_search_sessions[user_id] = ui_tag
-            line_bot_api.reply_message(
+            reply_in_background(
                 event.reply_token, 
-                TextSendMessage(text=f"收到！你想找「{ui_tag}」對吧？\n請點擊下方 📍 點我找附近的店，我馬上幫你找！", quick_reply=get_standard_quick_reply())
+                TextSendMessage(text=f"收到！你想找「{ui_tag}」對吧？\n請點擊下方 📍 點我找附近的店，我馬上幫你找！", quick_reply=get_standard_quick_reply()),
+                user_id
             )
         return
 
@@ -881,7 +904,7 @@ def handle_postback(event):
         user_service.log_action(user_id, "INIT_PREF", "SYSTEM_INIT", reason=tag, lat=lat, lng=lng)
         
         if not loc:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="📍 定位過期，請重新發送！", quick_reply=get_standard_quick_reply()))
+            reply_in_background(event.reply_token, TextSendMessage(text="📍 定位過期，請重新發送！", quick_reply=get_standard_quick_reply()), user_id)
             return
         
         user_service.update_user_location(user_id, lat, lng, tag=tag)
@@ -904,9 +927,10 @@ def handle_postback(event):
         user_service.remove_from_list(user_id, list_type, place_id)
         
         list_name = "收藏" if list_type == "bookmarks" else "黑名單"
-        line_bot_api.reply_message(
+        reply_in_background(
             event.reply_token, 
-            TextSendMessage(text=f"✅ 已將該店從{list_name}移除！", quick_reply=get_list_view_quick_reply()) # 移除後依然保持清單按鈕
+            TextSendMessage(text=f"✅ 已將該店從{list_name}移除！", quick_reply=get_list_view_quick_reply()), # 移除後依然保持清單按鈕
+            user_id
         )
         return
     
@@ -921,14 +945,15 @@ def handle_postback(event):
             
         if ans == "yes":
             user_service.log_action(user_id, "NO", place_id, lat=lat, lng=lng)
+            asyncio.create_task(asyncio.to_thread(user_service.record_persona_signal, user_id, "NO", place_id))
             user_service.add_to_user_list(user_id, "blacklist", place_id) # 寫入永久黑名單陣列
             reply_text = "🚫 已加入永久黑名單！正在為您尋找其他更適合的店家... 🔄"
             # 🌟 雙軌機制 3：確認加入永久黑名單，觸發 AI 學習地雷
-            asyncio.create_task(background_update_persona(user_id))
+            persona_queue.schedule(user_id)
         else:
             reply_text = "👌 沒問題！48小時後會再次解鎖。正在為您尋找其他店家... 🔄"
                 
-        line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+        asyncio.create_task(line_client.push_message(user_id, TextSendMessage(text=reply_text)))
         
         if loc:
             asyncio.create_task(process_recommendation(
@@ -936,17 +961,19 @@ def handle_postback(event):
                 rejected_place_id=place_id, negative_reason=negative_reason 
             ))
         else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請重新傳送位置📍", quick_reply=get_standard_quick_reply()))
+            reply_in_background(event.reply_token, TextSendMessage(text="請重新傳送位置📍", quick_reply=get_standard_quick_reply()), user_id)
         return
 
     place_id = params.get('id')
     
     if action == "yes":
         user_service.log_action(user_id, "YES", place_id, lat=lat, lng=lng)
-        asyncio.create_task(background_update_persona(user_id))
-        line_bot_api.reply_message(
+        asyncio.create_task(asyncio.to_thread(user_service.record_persona_signal, user_id, "YES", place_id))
+        persona_queue.schedule(user_id)
+        reply_in_background(
             event.reply_token, 
-            TextSendMessage(text=f"已記住您喜歡【{shop_name}】✨\n還想找其他的嗎？", quick_reply=get_standard_quick_reply())
+            TextSendMessage(text=f"已記住您喜歡【{shop_name}】✨\n還想找其他的嗎？", quick_reply=get_standard_quick_reply()),
+            user_id
         )
     elif action == "no":
         user_sessions[user_id] = place_id
@@ -959,17 +986,19 @@ def handle_postback(event):
             QuickReplyButton(action=PostbackAction(label="沒有插座", data=f"reason=no_plug&id={place_id}")),
             QuickReplyButton(action=PostbackAction(label="單純不想去", data=f"reason=change_only&id={place_id}")),
         ])
-        line_bot_api.reply_message(
+        reply_in_background(
             event.reply_token, 
-            TextSendMessage(text=f"請問不喜歡【{shop_name}】的原因是？\n(此店已為您暫時隱藏 48 小時 🕒)", quick_reply=quick_reply)
+            TextSendMessage(text=f"請問不喜歡【{shop_name}】的原因是？\n(此店已為您暫時隱藏 48 小時 🕒)", quick_reply=quick_reply),
+            user_id
         )
         
     elif action == "keep":
         user_service.log_action(user_id, "KEEP", place_id, lat=lat, lng=lng)
+        asyncio.create_task(asyncio.to_thread(user_service.record_persona_signal, user_id, "KEEP", place_id))
         user_service.add_to_user_list(user_id, "bookmarks", place_id) # 寫入資料庫陣列
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"已將【{shop_name}】加入收藏 ❤️\n要繼續找其他店家嗎？", quick_reply=get_standard_quick_reply()))
+        reply_in_background(event.reply_token, TextSendMessage(text=f"已將【{shop_name}】加入收藏 ❤️\n要繼續找其他店家嗎？", quick_reply=get_standard_quick_reply()), user_id)
         # 🌟 雙軌機制 2：加入收藏，觸發 AI 分析喜好
-        asyncio.create_task(background_update_persona(user_id))
+        persona_queue.schedule(user_id)
     elif params.get('reason'):
         if user_id in user_sessions: del user_sessions[user_id]
         reason = params.get('reason')
@@ -995,20 +1024,11 @@ def handle_postback(event):
             QuickReplyButton(action=PostbackAction(label="不要，下次再看看", data=f"action=confirm_blacklist&id={place_id}&ans=no"))
         ])
         
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg_text, quick_reply=quick_reply))
+        reply_in_background(event.reply_token, TextSendMessage(text=msg_text, quick_reply=quick_reply), user_id)
 
 @handler.add(FollowEvent)
 def handle_follow(event):
+    line_client.track_event(event)
+    user_id = event.source.user_id
     welcome_text = "嗨！我是 AI 咖啡助手 ☕\n請點擊下方按鈕分享位置，讓我為您推薦！👇"
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=welcome_text, quick_reply=get_standard_quick_reply()))
-    
-    
-# === 加在 main.py 的最下面 ===
-async def background_update_persona(user_id: str):
-    """背景執行：收集資料 -> 呼叫 PreferenceAgent -> 存入資料庫"""
-    logger.info(f"🕵️ 啟動背景偏好分析任務 (User: {user_id})...")
-    behavior_data = user_service.get_behavior_data_for_analysis(user_id)
-    
-    if behavior_data["frequently_bookmarked_tags"] or behavior_data["rejected_features_or_reasons"]:
-        persona_data = await preference_agent.analyze_user_preferences(behavior_data)
-        user_service.save_user_persona(user_id, persona_data)
\ No newline at end of file
+    reply_in_background(event.reply_token, TextSendMessage(text=welcome_text, quick_reply=get_standard_quick_reply()), user_id)
@@ -0,0 +1,174 @@
+# app/opening_hours.py
+import os
+import bisect
+from datetime import datetime, timedelta
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+# 編譯結果只跟店家資料有關：以 place_id 記憶化，Stage D 重新匯入 (資料版本變更) 時整包清空。
+# 這條路徑每次請求要查上百次，刻意用普通 dict 而不是 TTLCache，省掉鎖與 LRU 維護的開銷
+OPENING_HOURS_MEMO_MAX_ENTRIES = int(os.getenv("OPENING_HOURS_MEMO_MAX_ENTRIES", 20000))
+_memo = {}
+_memo_state = {"version": None, "hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _to_minutes(val):
+    """periods 內的時間：Stage D 寫入的是當日分鐘數；舊資料可能是 HHMM，23:59 視為當天結束"""
+    if val is None:
+        return None
+    v = int(val)
+    if v > DAY_MINUTES and v != 2359:
+        v = (v // 100) * 60 + (v % 100)
+    if v in (1439, 2359):
+        return DAY_MINUTES
+    return v
+
+
+def week_minute(t: datetime) -> int:
+    """datetime -> 週分鐘數 (Google 慣例：週日 = 0)"""
+    return ((t.weekday() + 1) % 7) * DAY_MINUTES + t.hour * 60 + t.minute
+
+
+class OpeningHours:
+    """
+    一家店編譯好的營業時段：排序、合併後的半開區間 [開門, 打烊) (週分鐘數)，查詢皆為二分搜尋。
+    跨午夜的時段 (Stage D 拆成兩筆) 與跨週日/週一的時段都會接起來；打烊那一分鐘視為已打烊。
+    """
+    __slots__ = ("has_data", "is_24h", "starts", "ends", "wraps")
+
+    def __init__(self, opening_hours: dict = None):
+        opening_hours = opening_hours or {}
+        periods = opening_hours.get("periods") or []
+        self.has_data = bool(opening_hours.get("is_24_hours") or periods)
+        self.is_24h = bool(opening_hours.get("is_24_hours"))
+        self.starts, self.ends, self.wraps = [], [], False
+        if self.is_24h:
+            return
+
+        intervals = []
+        for p in periods:
+            if not isinstance(p, dict) or p.get("day") is None:
+                continue
+            day = int(p["day"]) % 7
+            open_min = _to_minutes(p.get("open", 0)) or 0
+            close_min = _to_minutes(p.get("close"))
+            if close_min is None:
+                # Google 慣例：只有 open 00:00、沒有 close 代表全天營業
+                if open_min == 0:
+                    self.is_24h = True
+                    return
+                continue
+            if close_min == open_min:
+                continue  # open:0, close:0 這種零長度的殘留資料
+            start = day * DAY_MINUTES + open_min
+            end = day * DAY_MINUTES + close_min
+            if close_min < open_min:
+                end += DAY_MINUTES
+            # 超出週六深夜的部分折回週日開頭
+            if end > WEEK_MINUTES:
+                intervals.append([0, end - WEEK_MINUTES])
+                end = WEEK_MINUTES
+            intervals.append([start, end])
+
+        intervals.sort()
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:  # 容差 1 分鐘，接起 23:59 -> 00:00
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        if merged and merged[0][0] == 0 and merged[-1][1] == WEEK_MINUTES:
+            if len(merged) == 1:
+                self.is_24h = True
+                return
+            self.wraps = True  # 週六營業到週日凌晨：最後一段與第一段其實是同一段
+        self.starts = [s for s, _ in merged]
+        self.ends = [e for _, e in merged]
+
+    @classmethod
+    def for_cafe(cls, cafe: dict) -> "OpeningHours":
+        """取得 (並記憶化) 店家的編譯結果"""
+        place_id = cafe.get("place_id")
+        compiled = _memo.get(place_id) if place_id else None
+        if compiled is not None:
+            _memo_state["hits"] += 1
+            return compiled
+        compiled = cls(cafe.get("opening_hours"))
+        if place_id:
+            _memo_state["misses"] += 1
+            if len(_memo) >= OPENING_HOURS_MEMO_MAX_ENTRIES:
+                _memo.clear()
+            _memo[place_id] = compiled
+        return compiled
+
+    @staticmethod
+    def sync_version(version):
+        if version != _memo_state["version"]:
+            if _memo:
+                _memo_state["invalidations"] += 1
+            _memo.clear()
+            _memo_state["version"] = version
+
+    @staticmethod
+    def cache_stats() -> dict:
+        hits, misses = _memo_state["hits"], _memo_state["misses"]
+        total = hits + misses
+        return {
+            "size": len(_memo),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "invalidations": _memo_state["invalidations"],
+            "version": _memo_state["version"]
+        }
+
+    def _index(self, minute: int) -> int:
+        """包含 minute 的區間索引；不在營業時段內回傳 -1"""
+        i = bisect.bisect_right(self.starts, minute) - 1
+        return i if i >= 0 and minute < self.ends[i] else -1
+
+    def is_open(self, t: datetime) -> bool:
+        return self.is_24h or self._index(week_minute(t)) >= 0
+
+    def minutes_until_close(self, t: datetime):
+        """距離打烊的分鐘數；未營業回傳 0，全天營業回傳 24 小時，沒有營業時間資料回傳 None"""
+        if not self.has_data:
+            return None
+        if self.is_24h:
+            return DAY_MINUTES
+        minute = week_minute(t)
+        i = self._index(minute)
+        if i < 0:
+            return 0
+        end = self.ends[i]
+        if self.wraps and i == len(self.ends) - 1:
+            end = WEEK_MINUTES + self.ends[0]
+        return end - minute
+
+    def closes_at(self, t: datetime):
+        """營業中時回傳打烊的時間點，否則回傳 None"""
+        minutes = self.minutes_until_close(t)
+        if not minutes or self.is_24h:
+            return None
+        return t.replace(second=0, microsecond=0) + timedelta(minutes=minutes)
+
+    def next_open(self, t: datetime):
+        """下一次開門的時間點 (現在營業中則找下一段)；沒有任何營業時段回傳 None"""
+        if self.is_24h or not self.starts:
+            return None
+        minute = week_minute(t)
+        i = bisect.bisect_right(self.starts, minute)
+        # 週日 00:00 那段是前一晚延續下來的，不算「開門」
+        first = 1 if self.wraps else 0
+        if i < first:
+            i = first
+        if i < len(self.starts):
+            delta = self.starts[i] - minute
+        elif first < len(self.starts):
+            delta = WEEK_MINUTES + self.starts[first] - minute
+        else:
+            return None
+        return t.replace(second=0, microsecond=0) + timedelta(minutes=delta)
+
@@ -0,0 +1,98 @@
+# app/services/cache.py
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("Coffee_Recommender")
+
+_INGEST_CHECK_SECONDS = int(os.getenv("INGEST_VERSION_CHECK_SECONDS", 60))
+_ingest_state = {"version": None, "checked_at": None}
+
+
+def get_ingest_version(db):
+    """
+    讀取 Stage D 寫入的資料版本 (pipeline_meta.ingest)，每分鐘最多查一次 DB。
+    任何依賴店家資料的快取只要比對這個版本，就能在重新匯入後自動失效。
+    """
+    now = time.monotonic()
+    checked_at = _ingest_state["checked_at"]
+    if checked_at is None or now - checked_at >= _INGEST_CHECK_SECONDS:
+        _ingest_state["checked_at"] = now
+        try:
+            meta = db['pipeline_meta'].find_one({"_id": "ingest"}, {"version": 1}) or {}
+            _ingest_state["version"] = meta.get("version")
+        except Exception as e:
+            logger.warning(f"⚠️ 讀取資料版本失敗，沿用舊版本: {e}")
+    return _ingest_state["version"]
+
+
+class TTLCache:
+    """執行緒安全的 TTL + LRU 快取，附命中率統計與資料版本失效機制"""
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 1000):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def sync_version(self, version):
+        """資料版本變更時 (重新匯入)，整包清空"""
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if self._data:
+                logger.info(f"♻️ [{self.name}] 偵測到資料版本 {self.version} -> {version}，清空 {len(self._data)} 筆快取")
+                self.invalidations += 1
+            self._data.clear()
+            self.version = version
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            # get() 只會清掉被查到的過期項目；沒人再查的舊 key 在這裡定期掃掉，快取大小才會跟著 TTL 而不是一路長到 max_entries
+            if now >= self._next_sweep:
+                for k in [k for k, (expires_at, _) in self._data.items() if expires_at < now]:
+                    del self._data[k]
+                self._next_sweep = now + min(60.0, self.ttl_seconds)
+            self._data[key] = (now + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "version": self.version
+        }
@@ -0,0 +1,72 @@
+# app/services/cafe_snapshot.py
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger("Coffee_Recommender")
+
+# 算分漏斗 (scoring.py)、營業時間、推薦短句與卡片輸出會讀到的店家欄位；其餘 (尤其 1536 維的 vector) 不進快取
+CANDIDATE_FIELDS = (
+    "place_id", "final_name", "original_name", "location", "opening_hours", "contact", "attributes",
+    "ratings", "rating", "total_ratings", "user_ratings_total", "mrt_distance", "stats",
+    "tags", "ai_tags", "scores", "summary", "reason_snippets",
+)
+
+
+class CafeSnapshot:
+    """
+    候選名單快取共用的店家快照：place_id -> 精簡店家資料 (不含向量) + float32 向量。
+    共用快取 / 語意快取的每筆只存 place_id，命中時從這裡組回候選，
+    同一家店不論出現在幾筆快取裡都只佔一份記憶體；大小上限就是店家總數，資料版本變更時整包清空。
+    """
+    def __init__(self):
+        self.version = None
+        self._docs = {}      # place_id -> 精簡店家資料
+        self._vectors = {}   # place_id -> array('f')，一維約 4 bytes (Python list 約 32 bytes)
+        self._lock = threading.Lock()
+
+    def sync_version(self, version):
+        if version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                self._docs.clear()
+                self._vectors.clear()
+                self.version = version
+
+    def put(self, cafes: list) -> list:
+        """記下 (或更新) 這批店家，回傳依原順序的 place_id"""
+        place_ids = []
+        with self._lock:
+            for cafe in cafes:
+                pid = cafe.get("place_id")
+                if not pid:
+                    continue
+                place_ids.append(pid)
+                self._docs[pid] = {k: cafe[k] for k in CANDIDATE_FIELDS if k in cafe}
+                vector = cafe.get("vector")
+                if vector:
+                    self._vectors[pid] = array("f", vector)
+        return place_ids
+
+    def hydrate(self, place_ids, extras: dict = None, with_vector: bool = False) -> list:
+        """
+        組回候選名單 (每筆都是新的淺拷貝，算分寫入的欄位不會污染快照)。
+        extras：place_id -> 這筆快取自己的欄位 (例如融合分數)；with_vector：需要算 Persona 親和度時才帶向量。
+        """
+        results = []
+        with self._lock:
+            for pid in place_ids:
+                doc = self._docs.get(pid)
+                if doc is None:
+                    continue
+                item = dict(doc)
+                if extras and pid in extras:
+                    item.update(extras[pid])
+                if with_vector and pid in self._vectors:
+                    item["vector"] = self._vectors[pid]
+                results.append(item)
+        return results
+
+    def stats(self) -> dict:
+        return {"cafes": len(self._docs), "vectors": len(self._vectors), "version": self.version}
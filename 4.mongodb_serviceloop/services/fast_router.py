@@ -0,0 +1,209 @@
+# app/services/fast_router.py
+import os
+import re
+import time
+import random
+import logging
+import threading
+from constants import STANDARD_TAGS
+from locations import ALL_LOCATIONS
+from services.cache import get_ingest_version
+
+logger = logging.getLogger("Coffee_Recommender")
+
+# 句子裡除了標籤 / 地點以外，只允許出現這些無意義贅字，否則就交給 LLM
+FILLER_WORDS = [
+    "幫我找", "我想找", "我想去", "有沒有", "咖啡廳", "咖啡店", "附近", "推薦", "一下", "好了", "改去", "換去",
+    "想要", "的店", "站", "找", "的", "有", "呢", "嗎", "吧", "去", "在"
+]
+# 互斥標籤：加入其中一個時，要把購物車裡的另一個拔掉
+OPPOSITE_TAGS = {"限時": "不限時", "不限時": "限時", "停車方便": "停車困難", "停車困難": "停車方便"}
+TAG_ALIASES = {"wifi": "Wi-Fi", "wi-fi": "Wi-Fi", "有插座": "插座", "筆電": "工作友善", "貓": "店貓", "狗": "店狗"}
+_PUNCT_RE = re.compile(r"[\s,，。.!！?？~～、]+")
+
+CAFE_NAME_REFRESH_SECONDS = int(os.getenv("FAST_ROUTER_NAME_REFRESH_SECONDS", 600))
+
+
+class FastPathRouter:
+    """
+    ChatAgent 前面的規則式分流器：只處理「一看就懂」的訊息 (單一標籤、地點、標籤 + 地點、完整店名)，
+    直接產出與 ChatAgent 相同結構的結果；只要有一點不確定就回傳 None，交給 LLM。
+    """
+    def __init__(self, cafe_names: list = None):
+        vocab = {t.lower(): ("tag", t) for t in STANDARD_TAGS}
+        vocab.update({alias: ("tag", tag) for alias, tag in TAG_ALIASES.items()})
+        vocab.update({loc.lower(): ("loc", loc) for loc in ALL_LOCATIONS})
+        # 長詞優先，避免「南港」先吃掉「南港展覽館」、「限時」先吃掉「不限時」
+        self._vocab = sorted(vocab.items(), key=lambda kv: len(kv[0]), reverse=True)
+        self._fillers = sorted(FILLER_WORDS, key=len, reverse=True)
+
+        self._static_names = cafe_names is not None
+        self._names = self._build_name_index(cafe_names or [])
+        self._names_version = None
+        self._names_checked_at = None
+        self._lock = threading.Lock()
+
+        self.counters = {"total": 0, "hits": 0, "llm_calls": 0, "llm_seconds": 0.0}
+        self.rule_hits = {"tag": 0, "location": 0, "tag_location": 0, "cafe_name": 0}
+
+    # --- 店名索引 (Stage D 重新匯入後更新) ---
+    @staticmethod
+    def _build_name_index(names) -> dict:
+        index = {}
+        reserved = {t.lower() for t in STANDARD_TAGS} | {l.lower() for l in ALL_LOCATIONS}
+        for name in names:
+            if not name:
+                continue
+            key = _PUNCT_RE.sub("", name).lower()
+            if len(key) >= 2 and key not in reserved:
+                index.setdefault(key, name)
+        return index
+
+    def _maybe_refresh_names(self, db):
+        if self._static_names or db is None:
+            return
+        now = time.monotonic()
+        if self._names_checked_at is not None and now - self._names_checked_at < CAFE_NAME_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if self._names_checked_at is not None and now - self._names_checked_at < CAFE_NAME_REFRESH_SECONDS:
+                return
+            self._names_checked_at = now
+            version = get_ingest_version(db)
+            if self._names and version == self._names_version:
+                return
+            names = []
+            for doc in db['cafes'].find({}, {"_id": 0, "final_name": 1, "original_name": 1}):
+                names.extend([doc.get("final_name"), doc.get("original_name")])
+            self._names = self._build_name_index(names)
+            self._names_version = version
+            logger.info(f"🛣️ [快速分流] 店名索引更新：{len(self._names)} 筆 (版本 {version})")
+
+    # --- 解析 ---
+    def _parse(self, text: str):
+        """把訊息拆成 (地點, 標籤)；有任何無法辨識的殘留字就回傳 None"""
+        remaining = text.lower()
+        locs, tags = [], []
+        for word, (kind, canonical) in self._vocab:
+            if word in remaining:
+                remaining = remaining.replace(word, " ")
+                target = locs if kind == "loc" else tags
+                if canonical not in target:
+                    target.append(canonical)
+        for filler in self._fillers:
+            remaining = remaining.replace(filler, " ")
+        if _PUNCT_RE.sub("", remaining):
+            return None
+        return locs, tags
+
+    def parse_tags(self, text: str):
+        """只取出句子裡的標準標籤；含有無法辨識的自由文字時回傳 None (推薦理由據此決定要不要叫 LLM)"""
+        parsed = self._parse(_PUNCT_RE.sub(" ", text or "").strip())
+        return parsed[1] if parsed else None
+
+    @staticmethod
+    def _is_location(item: str) -> bool:
+        return item in ALL_LOCATIONS or item.rstrip("站") in ALL_LOCATIONS or item.endswith("區")
+
+    def _reply_texts(self, label: str):
+        openings = [
+            f"收到！馬上幫你撈幾家「{label}」的寶藏愛店... 🔍",
+            f"沒問題！「{label}」交給我，網友大推的馬上來 ⚡",
+            f"OK！正在特搜「{label}」的好去處... ☕"
+        ]
+        closings = [
+            "這幾家網評都超讚，快去踩點看看！",
+            "希望有你喜歡的，不滿意可以再跟我說條件喔！✨",
+            "氣氛都很不錯，挑一家去坐坐吧！🚀"
+        ]
+        return random.choice(openings), random.choice(closings)
+
+    def route(self, user_msg: str, current_cart: list = None, last_session_cart: list = None, db=None):
+        """回傳與 ChatAgent.manage_dialogue_and_cart 相同格式的 dict；不確定時回傳 None"""
+        self.counters["total"] += 1
+        current_cart = list(current_cart or [])
+        last_session_cart = last_session_cart or []
+
+        text = _PUNCT_RE.sub(" ", user_msg or "").strip()
+        if not text or len(text) > 30:
+            return None
+        # 劇本 D (跨日反問) 需要 LLM 的語氣與判斷
+        if not current_cart and last_session_cart:
+            return None
+
+        try:
+            self._maybe_refresh_names(db)
+        except Exception as e:
+            logger.warning(f"⚠️ [快速分流] 店名索引更新失敗: {e}")
+
+        # 購物車裡有店名時，追加條件的語意 (要不要清掉店名) 交給 LLM 判斷
+        if any(_PUNCT_RE.sub("", c).lower() in self._names for c in current_cart):
+            return None
+
+        # 1. 完整店名：清掉風格條件，只保留地點 + 店名
+        name = self._names.get(_PUNCT_RE.sub("", text).lower())
+        if name:
+            kept_locs = [c for c in current_cart if self._is_location(c)][:1]
+            updated_cart = kept_locs + [name]
+            return self._hit("cafe_name", name, {
+                "keyword": " ".join(updated_cart), "tags": [], "cart_action": "clear" if not kept_locs else "replace",
+                "updated_cart": updated_cart
+            })
+
+        parsed = self._parse(text)
+        if not parsed:
+            return None
+        locs, tags = parsed
+        # 多個地點 (中間點) 或什麼都沒抓到 -> LLM
+        if len(locs) > 1 or (not locs and not tags):
+            return None
+
+        updated_cart = current_cart
+        if locs:
+            updated_cart = [c for c in updated_cart if not self._is_location(c)] + locs
+        for tag in tags:
+            opposite = OPPOSITE_TAGS.get(tag)
+            if opposite in updated_cart:
+                updated_cart.remove(opposite)
+            if tag not in updated_cart:
+                updated_cart.append(tag)
+
+        cart_tags = [t for t in updated_cart if t in STANDARD_TAGS]
+        result_tags = (tags + [t for t in cart_tags if t not in tags])[:3]
+        rule = "tag_location" if locs and tags else ("location" if locs else "tag")
+        return self._hit(rule, " ".join(locs + tags), {
+            "keyword": " ".join(updated_cart), "tags": result_tags,
+            "cart_action": "replace" if locs else "add", "updated_cart": updated_cart
+        })
+
+    def _hit(self, rule: str, label: str, fields: dict) -> dict:
+        self.counters["hits"] += 1
+        self.rule_hits[rule] += 1
+        opening, closing = self._reply_texts(label)
+        result = {"mode": "search", "reply": "", "opening": opening, "closing": closing, "router": rule}
+        result.update(fields)
+        # 購物車只剩標籤 / 地點 / 店名時，確定沒有時間條件，推薦引擎不必再呼叫 IntentAgent；
+        # 若殘留舊的時間條件 (例如「早上9點營業」)，就不附 intent，交給推薦引擎解析
+        known = set(STANDARD_TAGS) | set(self._names.values())
+        if all(c in known or self._is_location(c) for c in fields["updated_cart"]):
+            result["intent"] = {"has_time": False, "target_time": None, "open_now": True}
+        logger.info(f"🛣️ [快速分流] 命中規則 {rule} | 購物車: {fields['updated_cart']}")
+        return result
+
+    def record_llm_call(self, seconds: float):
+        self.counters["llm_calls"] += 1
+        self.counters["llm_seconds"] += seconds
+
+    def stats(self) -> dict:
+        total, hits = self.counters["total"], self.counters["hits"]
+        llm_calls = self.counters["llm_calls"]
+        avg_llm = self.counters["llm_seconds"] / llm_calls if llm_calls else 0.0
+        return {
+            "total": total,
+            "hits": hits,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "rule_hits": dict(self.rule_hits),
+            "avg_llm_seconds": round(avg_llm, 3),
+            # 以實際 LLM 平均耗時估算：每次命中省下一次 ChatAgent 呼叫
+            "est_seconds_saved": round(hits * avg_llm, 1)
+        }
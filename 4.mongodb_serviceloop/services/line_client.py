@@ -0,0 +1,178 @@
+# app/services/line_client.py
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+
+import httpx
+
+logger = logging.getLogger("Coffee_Recommender")
+
+LINE_API_BASE = "https://api.line.me/v2/bot"
+
+# Reply Token 官方有效期約 1 分鐘，保留緩衝：超過就直接改走 push
+REPLY_TOKEN_MAX_AGE_SECONDS = float(os.getenv("LINE_REPLY_TOKEN_MAX_AGE_SECONDS", 50))
+LINE_API_MAX_RETRIES = int(os.getenv("LINE_API_MAX_RETRIES", 3))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 這些錯誤發生時請求還沒送到 LINE，重送不會造成重複訊息
+PRE_DELIVERY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# 單次 API 呼叫的結果：已送達 / 確定沒送達 / 不確定 (逾時或 5xx，LINE 可能已經處理)
+SENT, NOT_SENT, UNKNOWN = "sent", "not_sent", "unknown"
+
+
+def _to_payload(messages) -> list:
+    """接受 line-bot-sdk 的 SendMessage 物件 (或已是 dict)，轉成 Messaging API 的 JSON"""
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return [m.as_json_dict() if hasattr(m, "as_json_dict") else m for m in messages]
+
+
+class AsyncLineClient:
+    """
+    非阻塞的 LINE Messaging API 客戶端：
+    - 共用 keep-alive 連線池，不再每次呼叫都重新握手
+    - 429 / 5xx / 網路錯誤以指數退避 + 全抖動 (full jitter) 重試；
+      reply 沒有 Retry-Key，只在確定還沒送達時 (連線失敗、429) 重試
+    - 依 reply token 的年紀決定 reply 或 push，reply 確定沒送達時才改推播
+    """
+    def __init__(self, channel_access_token: str, transport: httpx.AsyncBaseTransport = None, max_retries: int = None):
+        self.max_retries = LINE_API_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = 0.3
+        self.backoff_cap = 4.0
+        self._client = httpx.AsyncClient(
+            base_url=LINE_API_BASE,
+            headers={"Authorization": f"Bearer {channel_access_token}"},
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+            transport=transport
+        )
+        self._token_issued_at = OrderedDict()  # reply_token -> webhook 事件時間 (epoch 秒)
+        self.stats = {"reply": 0, "push": 0, "reply_fallback_push": 0, "reply_unknown": 0, "retries": 0, "failures": 0}
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    # --- Reply Token 年紀追蹤 ---
+    def track_event(self, event):
+        """webhook 進來時記下事件時間，之後才能判斷 reply token 是否快過期"""
+        reply_token = getattr(event, "reply_token", None)
+        timestamp = getattr(event, "timestamp", None)
+        if not reply_token or not timestamp:
+            return
+        self._token_issued_at[reply_token] = timestamp / 1000.0
+        while len(self._token_issued_at) > 5000:
+            self._token_issued_at.popitem(last=False)
+
+    def reply_token_age(self, reply_token: str):
+        issued_at = self._token_issued_at.get(reply_token)
+        return None if issued_at is None else time.time() - issued_at
+
+    # --- 底層 HTTP ---
+    async def _request(self, path: str, payload: dict, retry_key: str = None, max_retries: int = None,
+                       retry_ambiguous: bool = True) -> str:
+        """
+        回傳 SENT / NOT_SENT / UNKNOWN。
+        retry_ambiguous=False 時 (沒有 Retry-Key 可去重的呼叫)，逾時與 5xx 不重試，直接回報 UNKNOWN。
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else None
+        outcome = NOT_SENT
+
+        for attempt in range(max_retries + 1):
+            delay = None
+            try:
+                resp = await self._client.post(path, json=payload, headers=headers)
+                if resp.status_code < 300:
+                    return SENT
+                # push 帶了 Retry-Key，409 代表前一次其實已經送達
+                if resp.status_code == 409 and retry_key:
+                    return SENT
+                if resp.status_code not in RETRYABLE_STATUS:
+                    logger.warning(f"⚠️ LINE API {path} 失敗 ({resp.status_code}): {resp.text[:200]}")
+                    break
+                retry_after = resp.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    delay = float(retry_after)
+                reason = f"HTTP {resp.status_code}"
+                # 429 是在處理前就被擋下；5xx 則可能已經送出
+                ambiguous = resp.status_code != 429
+            except httpx.TransportError as e:
+                reason = type(e).__name__
+                ambiguous = not isinstance(e, PRE_DELIVERY_ERRORS)
+
+            # 有 Retry-Key 的呼叫重試也不會重複，不確定的狀態只會發生在不能去重的呼叫
+            outcome = UNKNOWN if ambiguous and not retry_key else NOT_SENT
+            if ambiguous and not retry_ambiguous:
+                logger.warning(f"⚠️ LINE API {path} 結果不明 ({reason})，可能已送達，不重試")
+                break
+            if attempt >= max_retries:
+                logger.warning(f"⚠️ LINE API {path} 重試 {max_retries} 次仍失敗: {reason}")
+                break
+            if delay is None:
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+        self.stats["failures"] += 1
+        return outcome
+
+    async def _post(self, path: str, payload: dict, retry_key: str = None, max_retries: int = None) -> bool:
+        return await self._request(path, payload, retry_key=retry_key, max_retries=max_retries) == SENT
+
+    # --- Messaging API ---
+    async def _reply(self, reply_token: str, messages) -> str:
+        # reply 沒有 Retry-Key：第一次若已送達，重送只會拿到 400 (token 已用過)，所以不確定時不重試
+        outcome = await self._request("/message/reply", {"replyToken": reply_token, "messages": _to_payload(messages)},
+                                      retry_ambiguous=False)
+        if outcome == SENT:
+            self.stats["reply"] += 1
+        elif outcome == UNKNOWN:
+            self.stats["reply_unknown"] += 1
+        self._token_issued_at.pop(reply_token, None)  # Reply Token 只能用一次
+        return outcome
+
+    async def reply_message(self, reply_token: str, messages) -> bool:
+        return await self._reply(reply_token, messages) == SENT
+
+    async def push_message(self, to: str, messages) -> bool:
+        # 同一則推播的所有重試共用 Retry-Key，避免使用者收到重複訊息
+        ok = await self._post("/message/push", {"to": to, "messages": _to_payload(messages)}, retry_key=str(uuid.uuid4()))
+        if ok:
+            self.stats["push"] += 1
+        return ok
+
+    async def start_loading(self, chat_id: str, seconds: int = 20) -> bool:
+        """顯示「輸入中」動畫 (秒數需為 5 的倍數，最多 60)；純 UX 用途，失敗不重試"""
+        seconds = max(5, min(60, int(seconds) // 5 * 5))
+        return await self._post("/chat/loading/start", {"chatId": chat_id, "loadingSeconds": seconds}, max_retries=0)
+
+    async def send(self, reply_token: str, messages, user_id: str = None) -> bool:
+        """
+        優先用免費的 reply；token 太舊 (例如 LLM 跑太久) 或 reply 確定沒送達時，改用 push 補送。
+        reply 結果不明 (逾時、5xx) 時不補送，寧可少一則也不讓使用者收到兩次、多花一則推播額度。
+        沒有 user_id 時無法推播，只能盡力 reply。
+        """
+        age = self.reply_token_age(reply_token) if reply_token else None
+        if reply_token and (age is None or age < REPLY_TOKEN_MAX_AGE_SECONDS):
+            outcome = await self._reply(reply_token, messages)
+            if outcome == SENT:
+                return True
+            if outcome == UNKNOWN:
+                logger.warning("⚠️ Reply 結果不明，可能已送達，不改用 Push 以免重複")
+                return False
+            if not user_id:
+                return False
+            logger.info("📨 Reply 確定沒送達，改用 Push 補送")
+        elif reply_token:
+            logger.info(f"⏰ Reply Token 已過 {age:.0f} 秒，直接改用 Push")
+
+        if not user_id:
+            return False
+        ok = await self.push_message(user_id, messages)
+        if ok and reply_token:
+            self.stats["reply_fallback_push"] += 1
+        return ok
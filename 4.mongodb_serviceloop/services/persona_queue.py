@@ -0,0 +1,138 @@
+# app/services/persona_queue.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("Coffee_Recommender")
+
+PERSONA_DEBOUNCE_SECONDS = float(os.getenv("PERSONA_DEBOUNCE_SECONDS", 20))       # 最後一次操作後靜置多久才重算
+PERSONA_MAX_WAIT_SECONDS = float(os.getenv("PERSONA_MAX_WAIT_SECONDS", 120))      # 連續操作時最多延後多久
+PERSONA_MIN_INTERVAL_SECONDS = float(os.getenv("PERSONA_MIN_INTERVAL_SECONDS", 300))  # 同一人兩次重算的最短間隔
+PERSONA_BATCH_SIZE = int(os.getenv("PERSONA_BATCH_SIZE", 8))
+PERSONA_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("PERSONA_SHUTDOWN_TIMEOUT_SECONDS", 10))  # 關機時最多等多久
+
+
+class PersonaUpdateQueue:
+    """
+    偏好畫像重算佇列：同一位使用者短時間內的多次收藏 / 喜歡 / 拒絕只會觸發一次重算 (last-write-wins)，
+    背景 worker 會把到期的多位使用者合併成一次 PreferenceAgent 批次呼叫。
+    """
+    def __init__(self, user_service, preference_agent):
+        self.user_service = user_service
+        self.preference_agent = preference_agent
+        self._pending = {}    # user_id -> [首次請求時間, 到期時間]
+        self._last_run = OrderedDict()   # user_id -> 上次重算時間 (依時間先後排列，方便從頭清掉過期的)
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.counters = {"requested": 0, "coalesced": 0, "recomputed": 0, "skipped_no_signal": 0, "llm_calls": 0}
+
+    def schedule(self, user_id: str):
+        """同步 / 非同步 handler 都可直接呼叫；只更新到期時間，不做任何 I/O"""
+        now = time.monotonic()
+        self.counters["requested"] += 1
+        # 超過最短間隔的重算紀錄已不會再影響到期時間，從最舊的開始清掉，字典不會隨使用者總數一路長大
+        while self._last_run:
+            oldest_uid, oldest_at = next(iter(self._last_run.items()))
+            if now - oldest_at < PERSONA_MIN_INTERVAL_SECONDS:
+                break
+            del self._last_run[oldest_uid]
+        entry = self._pending.get(user_id)
+        if entry:
+            self.counters["coalesced"] += 1
+            first_at = entry[0]
+        else:
+            first_at = now
+
+        due = min(now + PERSONA_DEBOUNCE_SECONDS, first_at + PERSONA_MAX_WAIT_SECONDS)
+        last_run = self._last_run.get(user_id)
+        if last_run is not None:
+            due = max(due, last_run + PERSONA_MIN_INTERVAL_SECONDS)
+        self._pending[user_id] = [first_at, due]
+        self._wakeup.set()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # 關機前只補做已到期的 (還在防抖 / 最短間隔內的本來就不該馬上重算)，且整體有時間上限，不拖住關機
+        now = time.monotonic()
+        due_users = [uid for uid, (_, due) in self._pending.items() if due <= now]
+        try:
+            await asyncio.wait_for(self._flush(due_users), timeout=PERSONA_SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ [Persona 佇列] 關機前處理超過 {PERSONA_SHUTDOWN_TIMEOUT_SECONDS:g} 秒，放棄剩下的使用者")
+        if self._pending:
+            logger.info(f"🕵️ [Persona 佇列] 關機時略過 {len(self._pending)} 位未到期 / 未處理的使用者")
+
+    async def _flush(self, user_ids: list):
+        for i in range(0, len(user_ids), PERSONA_BATCH_SIZE):
+            try:
+                await self._process(user_ids[i:i + PERSONA_BATCH_SIZE])
+            except Exception as e:
+                logger.error(f"❌ [Persona 佇列] 批次處理失敗: {e}")
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due_users = [uid for uid, (_, due) in self._pending.items() if due <= now]
+            if due_users:
+                await self._flush(due_users)
+                continue
+
+            next_due = min((due for _, due in self._pending.values()), default=None)
+            timeout = None if next_due is None else max(0.0, next_due - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, user_ids: list):
+        for uid in user_ids:
+            self._pending.pop(uid, None)
+            self._last_run[uid] = time.monotonic()
+            self._last_run.move_to_end(uid)
+
+        # Mongo 查詢是同步的，丟到 thread 避免卡住 event loop
+        behaviors = await asyncio.gather(*(asyncio.to_thread(self.user_service.get_behavior_data_for_analysis, uid) for uid in user_ids))
+        batch = {}
+        for uid, data in zip(user_ids, behaviors):
+            if data["frequently_bookmarked_tags"] or data["rejected_features_or_reasons"]:
+                batch[uid] = data
+            else:
+                self.counters["skipped_no_signal"] += 1
+        if not batch:
+            return
+
+        logger.info(f"🕵️ [Persona 佇列] 重算 {len(batch)} 位使用者的偏好畫像 (單次 LLM 呼叫)")
+        self.counters["llm_calls"] += 1
+        if len(batch) == 1:
+            uid, data = next(iter(batch.items()))
+            personas = {uid: await self.preference_agent.analyze_user_preferences(data)}
+        else:
+            personas = await self.preference_agent.analyze_user_preferences_batch(batch)
+
+        for uid, persona in personas.items():
+            if persona:
+                await asyncio.to_thread(self.user_service.save_user_persona, uid, persona)
+                self.counters["recomputed"] += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pending": len(self._pending),
+            # 原本每次請求都會觸發一次完整重算 (3 次 Mongo 查詢 + 1 次 LLM)
+            "recomputations_avoided": self.counters["coalesced"],
+            # 批次合併後少打的 LLM 次數
+            "llm_calls_saved": max(0, self.counters["recomputed"] - self.counters["llm_calls"])
+        }
@@ -0,0 +1,64 @@
+# app/services/reason_snippets.py
+import os
+import logging
+from services.fast_router import FastPathRouter
+
+logger = logging.getLogger("Coffee_Recommender")
+
+# 套模板後超過這個長度就不再補充其他標籤，避免卡片被截斷
+REASON_SNIPPET_MAX_LENGTH = int(os.getenv("REASON_SNIPPET_MAX_LENGTH", 32))
+
+
+class ReasonSnippetPicker:
+    """
+    推薦理由的離線短句挑選器：Stage C 已替每家店的標籤與四大情境各寫好一句 (cafes.reason_snippets)，
+    使用者的需求能拆成標準標籤時直接挑句子；拆不出來的自由文字、或店家沒有對應短句時才交給 ReasonAgent。
+    """
+    def __init__(self, query_parser: FastPathRouter = None):
+        # 只借用快速分流器的詞庫做標籤解析，不需要店名索引
+        self.query_parser = query_parser or FastPathRouter(cafe_names=[])
+        self.counters = {"requests": 0, "free_text_requests": 0, "snippet_hits": 0, "llm_cafes": 0, "llm_calls": 0}
+
+    def wanted_tags(self, search_query: str = None, cafe_tag: str = None):
+        """回傳 (使用者要的標籤, 是否為規則拆不出來的自由文字)"""
+        self.counters["requests"] += 1
+        tags = [t.strip() for t in cafe_tag.split(",") if t.strip()] if cafe_tag else []
+        if not search_query:
+            return tags, False
+        parsed = self.query_parser.parse_tags(search_query)
+        if parsed is None:
+            self.counters["free_text_requests"] += 1
+            return tags, True
+        return parsed + [t for t in tags if t not in parsed], False
+
+    def pick(self, cafe: dict, wanted_tags: list, theme: str = None):
+        """挑出並套用短句；沒有可用短句時回傳 None"""
+        snippets = cafe.get("reason_snippets") or {}
+        if theme:
+            text = snippets.get("themes", {}).get(theme)
+        else:
+            tag_snippets = snippets.get("tags", {})
+            covered = [t for t in wanted_tags if t in tag_snippets]
+            text = tag_snippets[covered[0]] if covered else None
+            if text:
+                # 輕度模板：使用者同時要的其他條件，店家也有的話補一句
+                others = [t for t in wanted_tags if t != covered[0] and t in (cafe.get("tags") or [])]
+                extended = f"{text}，也有{'、'.join(others[:2])}" if others else text
+                if len(extended) <= REASON_SNIPPET_MAX_LENGTH:
+                    text = extended
+        if text:
+            self.counters["snippet_hits"] += 1
+        return text
+
+    def record_llm_call(self, cafe_count: int):
+        self.counters["llm_calls"] += 1
+        self.counters["llm_cafes"] += cafe_count
+
+    def stats(self) -> dict:
+        hits, llm_cafes = self.counters["snippet_hits"], self.counters["llm_cafes"]
+        total = hits + llm_cafes
+        return {
+            **self.counters,
+            # 需要推薦理由的店家中，由離線短句直接供應的比例
+            "snippet_rate": round(hits / total, 4) if total else 0.0
+        }
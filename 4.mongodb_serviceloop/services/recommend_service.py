@@ -1,4 +1,5 @@
 # app/services/recommend_service.py
+import os
 import logging
 import traceback
 import asyncio
@@ -6,31 +7,79 @@ from typing import Any, Dict, List, Optional
 import json
 from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
 from database import db_client
-from utils import is_google_period_open, get_taiwan_now
+from utils import get_taiwan_now
 from locations import ALL_LOCATIONS
 from agents.intent_agent import IntentAgent
 from agents.reason_agent import ReasonAgent
+from agents.ai_backend import AI_BACKEND_MODE, wrap_embedding_model
 from google import genai 
 from services.scoring import process_and_score_cafes
+from services.theme_tiles import ThemeTileIndex
+from services.cache import TTLCache, get_ingest_version
+from services.semantic_cache import SemanticQueryCache, fusion_extras
+from services.cafe_snapshot import CafeSnapshot
+from services.reason_snippets import ReasonSnippetPicker
+from geo import geohash_encode, distances_from
+from opening_hours import OpeningHours
 from datetime import datetime, timedelta  
 from constants import STANDARD_TAGS
 
 logger = logging.getLogger("Coffee_Recommender")
 
+RESULT_CACHE_PRECISION = int(os.getenv("RESULT_CACHE_PRECISION", 6))  # geohash 精度 (6 ≈ 1.2km x 0.6km)
+RESULT_CACHE_SLOT_MINUTES = int(os.getenv("RESULT_CACHE_SLOT_MINUTES", 30))
+SEMANTIC_CACHE_PRECISION = int(os.getenv("SEMANTIC_CACHE_PRECISION", 6))
+
 class RecommendService:
     def __init__(self):
         self.intent_agent = IntentAgent()
         self.reason_agent = ReasonAgent()
+        self.theme_tiles = ThemeTileIndex()
+        # 快取共用的店家快照：快取裡只存 place_id，店家資料 (不含 1536 維向量) 與向量各只存一份
+        self.cafe_snapshot = CafeSnapshot()
+        # 非個人化請求 (純定位 / 按鈕標籤) 的共用候選名單快取 (值為 place_id 清單)
+        self.result_cache = TTLCache(
+            "ResultCache",
+            ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", 300)),
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 2000))
+        )
+        # 打字查詢的語意近似快取：同一地理格內意思幾乎相同的查詢共用融合後的候選名單
+        self.semantic_cache = SemanticQueryCache()
+        # Stage C 預生成的推薦短句挑選器 (取代大部分 ReasonAgent 呼叫)
+        self.reason_snippets = ReasonSnippetPicker()
         
         # 初始化 Vertex AI 的向量模型
         try:
-            # 使用 Google 最新一代的企業級文本嵌入模型
-            self.embedding_model = TextEmbeddingModel.from_pretrained("gemini-embedding-001")
+            # 使用 Google 最新一代的企業級文本嵌入模型 (回放模式不連線，直接讀錄製檔)
+            base_model = None if AI_BACKEND_MODE == "replay" else TextEmbeddingModel.from_pretrained("gemini-embedding-001")
+            self.embedding_model = wrap_embedding_model(base_model)
             logger.info("✅ Vertex AI Embedding 模型初始化成功！")
         except Exception as e:
             logger.error(f"❌ Vertex AI Embedding 初始化失敗: {e}")
             self.embedding_model = None
 
+    @staticmethod
+    def _personalize_cached_candidates(candidates: list, blacklist_ids: list, lat: float, lng: float) -> list:
+        """共用名單的個人化後處理：排除該使用者的黑名單，並以他自己的位置重算距離"""
+        banned = set(blacklist_ids or [])
+        # 淺拷貝，後續算分會寫入欄位，不能污染共用快取
+        results = [dict(cafe) for cafe in candidates if cafe.get('place_id') not in banned]
+        located = [item for item in results if (item.get('location') or {}).get('coordinates')]
+        if located:
+            dists = distances_from(lat, lng, [i['location']['coordinates'][1] for i in located],
+                                   [i['location']['coordinates'][0] for i in located])
+            for item, d in zip(located, dists):
+                item['dist_meters'] = d
+        return results
+
+    @staticmethod
+    def _time_slot(check_time) -> str:
+        """營業時間過濾以半小時為一格，同一格內的候選名單可以共用"""
+        if not check_time:
+            return "any"
+        slot_minute = check_time.minute // RESULT_CACHE_SLOT_MINUTES * RESULT_CACHE_SLOT_MINUTES
+        return f"{check_time.strftime('%Y-%m-%d %H')}:{slot_minute:02d}"
+
     def get_embedding(self, text: str) -> Optional[List[float]]:
         try:
             if not self.embedding_model: 
@@ -57,11 +106,14 @@ class RecommendService:
                         user_query: str = None, cafe_tag: str = None,
                         rejected_place_id: str = None,  # 🌟 新增：使用者剛剛拒絕的店家 ID
                         negative_reason: str = None,     # 🌟 新增：使用者拒絕的原因
-                        theme: str = None
+                        theme: str = None,
+                        explain: bool = False,          # 🔍 新增：回傳所有候選的分數明細 (除錯 / 模擬器用)
+                        pre_parsed_intent: dict = None  # 🧠 新增：ChatAgent 已解析好的時間意圖，有給就不再呼叫 IntentAgent
                         ) -> Dict[str, Any]:
         try:
             db = db_client.get_db()
             if db is None: return {"data": []}
+            OpeningHours.sync_version(get_ingest_version(db))
 
             # 🔥檢查到底有沒有收到 user_query
             logger.info(f"🔥 DEBUG: 收到 user_query = '{user_query}'")
@@ -121,10 +173,15 @@ class RecommendService:
             target_datetime = None
             ai_intent = {}
             
-            if user_query: # 注意：這裡依然傳入完整的 user_query 給 AI，讓 AI 知道完整情境
-                ai_intent = self.intent_agent.analyze_user_intent(user_query)
+            if user_query and pre_parsed_intent is not None:
+                # ⚡ 對話總管已在同一次 LLM 呼叫中解析好時間意圖，省掉第二次串行呼叫
+                ai_intent = pre_parsed_intent
+                logger.info(f"🧠 沿用對話總管解析的意圖: {ai_intent}")
+            elif user_query: # 注意：這裡依然傳入完整的 user_query 給 AI，讓 AI 知道完整情境
+                ai_intent = await asyncio.to_thread(self.intent_agent.analyze_user_intent, user_query)
                 # logger.info(f"🧠 AI 意圖分析結果: {ai_intent}")
-                
+
+            if user_query:
                 if ai_intent and ai_intent.get("has_time"):
                     target_datetime = ai_intent.get("target_time")
                     filter_open_now = False # 既然有指定未來時間，就不該強制要求「現在」有營業
@@ -152,6 +209,10 @@ class RecommendService:
                     logger.info("🌙 [深夜特權] 偵測到「深夜」標籤，強制關閉營業時間檢查！")
                     check_time = None
                     filter_open_now = False
+                elif ai_intent.get("open_now") is False:
+                    logger.info("🕒 [時間過濾] 使用者不在意目前是否營業，關閉營業時間檢查")
+                    check_time = None
+                    filter_open_now = False
                 else:
                     check_time = taiwan_now
                     filter_open_now = True  # 順手把狀態切為 True，維持邏輯一致性
@@ -160,20 +221,13 @@ class RecommendService:
             # 定義內部過濾函式
             def filter_by_opening_hours(candidates):
                 if not check_time: return candidates
-                open_cafes = []
-                for cafe in candidates:
-                    opening_hours = cafe.get('opening_hours', {})
-                    if not opening_hours: continue
-                    if opening_hours.get('is_24_hours'):
-                        open_cafes.append(cafe)
-                        continue
-                    if is_google_period_open(opening_hours.get('periods', []), check_time):
-                        open_cafes.append(cafe)
-                return open_cafes
+                # 每家店的營業時段只編譯一次 (依 place_id 快取)，這裡只剩二分搜尋
+                return [cafe for cafe in candidates if OpeningHours.for_cafe(cafe).is_open(check_time)]
 
             # === 4. 取得雙軌黑名單與 AI Persona ===
             blacklist_ids = []
             user_persona = {}
+            persona_vector = None
             if user_id:
                 user_info = db['users'].find_one({"user_id": user_id}) or {}
 
@@ -184,6 +238,8 @@ class RecommendService:
 
                 # 提取 AI 畫像
                 user_persona = user_info.get("ai_persona", {})
+                # 收藏 / 黑名單即時累積的偏好向量 (見 UserService.update_persona_vector)
+                persona_vector = user_info.get("persona_vector")
 
                 # 軌道 B：48 小時冷卻名單 (Soft Ban)
                 forty_eight_hours_ago = taiwan_now - timedelta(hours=48)
@@ -222,25 +278,32 @@ class RecommendService:
             final_candidates = [] # 🌟 所有路徑找出來的候選名單，通通丟進這裡，先不算分！
             # === 🔥 情境高速公路 (點擊四大情境按鈕時觸發) ===
             final_data = [] # 用來裝最後排好序的店家
+            explanations = [] if explain else None
             
             if theme:
                 logger.info(f"🚀 情境高速公路 : {theme}")
                 score_field = f"score_{theme}"
                 
-                pipeline_c = [
-                    {"$geoNear": {
-                        "near": {"type": "Point", "coordinates": [current_search_lng, current_search_lat]},
-                        "distanceField": "dist_meters", "maxDistance": 3000, "spherical": True
-                    }},
-                    {"$match": {score_field: {"$gt": 0.4}}}
-                ]
-                if blacklist_ids: 
-                    pipeline_c.append({"$match": {"place_id": {"$nin": blacklist_ids}}})
+                # ⚡ 優先查離線預算的 geohash 分格名單 (純記憶體)，尚未建立時才退回即時聚合
+                path_c_results = self.theme_tiles.lookup(db, theme, current_search_lat, current_search_lng, blacklist_ids=blacklist_ids, limit=30)
                 
-                pipeline_c.append({"$sort": {score_field: -1}})
-                pipeline_c.append({"$limit": 30}) 
-                
-                path_c_results = list(db['cafes'].aggregate(pipeline_c))
+                if path_c_results is None:
+                    pipeline_c = [
+                        {"$geoNear": {
+                            "near": {"type": "Point", "coordinates": [current_search_lng, current_search_lat]},
+                            "distanceField": "dist_meters", "maxDistance": 3000, "spherical": True
+                        }},
+                        {"$match": {score_field: {"$gt": 0.4}}}
+                    ]
+                    if blacklist_ids: 
+                        pipeline_c.append({"$match": {"place_id": {"$nin": blacklist_ids}}})
+                    
+                    pipeline_c.append({"$sort": {score_field: -1}})
+                    pipeline_c.append({"$limit": 30}) 
+                    
+                    path_c_results = list(db['cafes'].aggregate(pipeline_c))
+                else:
+                    logger.info(f"🧩 [情境分格] 命中記憶體名單，共 {len(path_c_results)} 家候選")
                 open_results = filter_by_opening_hours(path_c_results)
                 
                 final_data = open_results[:3]
@@ -299,14 +362,52 @@ class RecommendService:
                             item['match_type'] = 'name' 
                         final_candidates = name_results
 
-            if not final_candidates:
+            # === ⚡ 非個人化共用快取：純定位 / 按鈕標籤 (沒有打字) 的請求，附近的人拿到的候選名單都一樣 ===
+            # 快取的是「套用黑名單、冷卻與 Persona 之前」的名單，個人化部分在命中後才做 (便宜的後處理)
+            result_cache_key = None
+            served_from_cache = False
+            if not user_query and not theme and not final_candidates:
+                self.result_cache.sync_version(get_ingest_version(db))
+                self.cafe_snapshot.sync_version(get_ingest_version(db))
+                result_cache_key = (geohash_encode(current_search_lat, current_search_lng, RESULT_CACHE_PRECISION), cafe_tag or "", self._time_slot(check_time))
+
+                cached_ids = self.result_cache.get(result_cache_key)
+                if cached_ids is not None:
+                    served_from_cache = True
+                    cached_candidates = self.cafe_snapshot.hydrate(cached_ids, with_vector=bool(persona_vector))
+                    final_candidates = self._personalize_cached_candidates(cached_candidates, blacklist_ids, current_search_lat, current_search_lng)
+                    logger.info(f"⚡ [共用快取] 命中 {result_cache_key}，候選 {len(final_candidates)} 家 (命中率: {self.result_cache.stats()['hit_rate']:.0%})")
+
+            tag_list = []
+            if cafe_tag: tag_list.extend([t.strip() for t in cafe_tag.split(",")])
+            if ai_intent and ai_intent.get("extracted_keywords"):
+                # 把 AI 抓到的關鍵字也當作標籤去碰碰運氣
+                tag_list.extend(ai_intent["extracted_keywords"])
+
+            # === ⚡ 語意近似快取：打字查詢先算向量，同一地理格 / 標籤 / 時段內有夠像的近期查詢就直接沿用它的融合名單 ===
+            query_vector = None
+            semantic_cache_key = None
+            if search_query and not theme and not final_candidates and not served_from_cache:
+                query_vector = self.get_embedding(search_query)
+                if query_vector:
+                    self.semantic_cache.sync_version(get_ingest_version(db))
+                    self.cafe_snapshot.sync_version(get_ingest_version(db))
+                    semantic_cache_key = (
+                        geohash_encode(current_search_lat, current_search_lng, SEMANTIC_CACHE_PRECISION),
+                        tuple(sorted(set(tag_list))), self._time_slot(check_time)
+                    )
+                    hit = self.semantic_cache.lookup(semantic_cache_key, query_vector, blacklist_ids)
+                    if hit is not None:
+                        cached_ids, cached_extras, similarity, cached_query = hit
+                        served_from_cache = True
+                        cached_candidates = self.cafe_snapshot.hydrate(cached_ids, extras=cached_extras, with_vector=bool(persona_vector))
+                        final_candidates = self._personalize_cached_candidates(cached_candidates, blacklist_ids, current_search_lat, current_search_lng)
+                        logger.info(f"⚡ [語意快取] '{search_query}' ≈ '{cached_query}' (相似度 {similarity:.3f})，沿用 {len(final_candidates)} 家候選 "
+                                    f"(命中率: {self.semantic_cache.stats()['hit_rate']:.0%})")
+
+            if not final_candidates and not served_from_cache:
                 # === RAG (向量語意搜尋/標籤篩選) +距離篩選 ===
                 logger.info(f"🌍 [預先篩選] 啟動地理/標籤搜尋作為基底...")
-                tag_list = []
-                if cafe_tag: tag_list.extend([t.strip() for t in cafe_tag.split(",")])
-                if ai_intent and ai_intent.get("extracted_keywords"):
-                    # 把 AI 抓到的關鍵字也當作標籤去碰碰運氣
-                    tag_list.extend(ai_intent["extracted_keywords"])
                     
                 # 建立基底過濾條件 (方圓 5 公里內)
                 geo_pipeline = [
@@ -318,8 +419,9 @@ class RecommendService:
                     }}
                 ]
                 
-                # 黑名單與標籤過濾
-                if blacklist_ids: 
+                # 黑名單與標籤過濾 (可共用快取的請求改在取回後才排除黑名單；
+                # 因此下方「不到 15 家就放寬」是以未排除黑名單的家數判斷，共用名單才不會因人而異)
+                if blacklist_ids and result_cache_key is None: 
                     geo_pipeline.append({"$match": {"place_id": {"$nin": blacklist_ids}}})
                 
                 strict_pipeline = list(geo_pipeline)
@@ -365,7 +467,7 @@ class RecommendService:
                 # === 🎯 步驟二：再執行從合格名單中做向量語意排序 ===
                 if search_query and valid_place_ids and not theme:
                     logger.info(f"🔍 [精確打擊] 在 {len(valid_place_ids)} 家合格店中，尋找最符合 '{search_query}' 的語意...")
-                    query_vector = self.get_embedding(search_query)
+                    query_vector = query_vector or self.get_embedding(search_query)
                     
                     if query_vector:
                         # 故意把向量搜尋的範圍拉大 (numCandidates: 200, limit: 100)
@@ -433,6 +535,21 @@ class RecommendService:
                     logger.info("⚠️ 跳過向量搜尋，直接使用地理與標籤篩選結果")
                     final_candidates = filter_by_opening_hours(base_candidates)
 
+                if result_cache_key is not None:
+                    # 只快取 place_id：完整文件 (含向量) 一筆約 50KB，250 家的名單就是十幾 MB
+                    cached_ids = self.cafe_snapshot.put(final_candidates)
+                    self.result_cache.set(result_cache_key, cached_ids)
+                    cached_candidates = self.cafe_snapshot.hydrate(cached_ids, with_vector=bool(persona_vector))
+                    final_candidates = self._personalize_cached_candidates(cached_candidates, blacklist_ids, current_search_lat, current_search_lng)
+                elif semantic_cache_key is not None and final_candidates:
+                    # 這份名單已排除本次使用者的黑名單，記下來供之後判斷能不能給別人沿用
+                    # 同樣只存 place_id + 這次的融合分數，店家資料與向量放在共用快照
+                    cached_ids = self.cafe_snapshot.put(final_candidates)
+                    cached_extras = fusion_extras(final_candidates)
+                    self.semantic_cache.set(semantic_cache_key, query_vector, search_query, cached_ids, cached_extras, excluded_ids=blacklist_ids)
+                    cached_candidates = self.cafe_snapshot.hydrate(cached_ids, extras=cached_extras, with_vector=bool(persona_vector))
+                    final_candidates = self._personalize_cached_candidates(cached_candidates, blacklist_ids, current_search_lat, current_search_lng)
+
             # 🌟🌟🌟 === 終極交接：呼叫外部的統一算分漏斗 === 🌟🌟🌟
             if not theme: # 🛡️ 防護罩 4：情境搜尋已經自己排好前3名，不需要過這個漏斗！
                 # ✨ 1. 喚醒冷卻機制：撈取過去 24 小時推薦過的店家
@@ -465,7 +582,9 @@ class RecommendService:
                     ignore_time_penalty=ignore_time,
                     user_persona=user_persona,
                     recommend_history=recommend_history,
-                    target_time=check_time 
+                    target_time=check_time,
+                    explanations=explanations,
+                    persona_vector=persona_vector
                 )
                 logger.info(f"🏆 算分完成！最終選出 {len(final_data)} 家推薦名單。")
 
@@ -526,18 +645,26 @@ class RecommendService:
                 return sorted_tags
             
             # === 🔥 [新增] 智能分流：讓 AI 動態生成客製化推薦理由 ===
+            # 1. 先用 Stage C 預生成的短句：需求能拆成標準標籤 (或是情境按鈕) 時直接挑句子
+            wanted_tags, is_free_text = self.reason_snippets.wanted_tags(None if theme else search_query, cafe_tag)
             personalized_reasons = {}
-            
-            # 🧠 關鍵邏輯：只有在「有輸入文字 (search_query)」且「不是點擊情境按鈕 (not theme)」時，才呼叫 AI 大魔王
-            if search_query and not theme and final_data:
-                logger.info(f"🧠 [智能分流] 偵測到複雜文字需求 '{search_query}'，啟動 AI 客製化理由生成...")
+            for r in final_data:
+                snippet = None if is_free_text else self.reason_snippets.pick(r, wanted_tags, theme)
+                if snippet:
+                    personalized_reasons[str(r.get("place_id", r.get("_id")))] = snippet
+
+            # 2. 🧠 只有「有輸入文字」且「不是情境按鈕」、又沒有現成短句的店，才呼叫 AI 大魔王
+            llm_targets = [r for r in final_data if str(r.get("place_id", r.get("_id"))) not in personalized_reasons]
+            if search_query and not theme and llm_targets:
+                logger.info(f"🧠 [智能分流] 需求 '{search_query}' 有 {len(llm_targets)} 家沒有現成短句，啟動 AI 客製化理由生成...")
+                self.reason_snippets.record_llm_call(len(llm_targets))
                 try:
                     # 呼叫外包出去的 ReasonAgent
-                    personalized_reasons = await self.reason_agent.generate_reasons_batch(search_query, final_data)
+                    personalized_reasons.update(await self.reason_agent.generate_reasons_batch(search_query, llm_targets))
                 except Exception as e:
                     logger.error(f"⚠️ AI 生成理由失敗，將自動退回預設文字: {e}")
             else:
-                logger.info("⚡ [智能分流] 點擊情境按鈕或無複雜需求，跳過 AI 生成以確保極速體驗！")
+                logger.info(f"⚡ [智能分流] 使用離線短句 {len(personalized_reasons)} 家，跳過 AI 生成以確保極速體驗！")
  
             # === 格式化輸出 ===
             formatted_response = []
@@ -564,8 +691,8 @@ class RecommendService:
                 
                 # 🌟 終極版智能分流顯示邏輯：
                 if theme or not search_query:
-                    # 情況 A：點擊情境按鈕，或「單純傳送定位」時 -> 強制給空字串，隱藏文字區塊，版面極簡化！
-                    custom_reason = ""
+                    # 情況 A：點擊情境按鈕、標籤按鈕或「單純傳送定位」時 -> 有現成短句才顯示，否則給空字串隱藏文字區塊，版面極簡化！
+                    custom_reason = personalized_reasons.get(place_id_str, "")
                 else:
                     # 情況 B：如果是手動打字 -> 優先拿 AI 寫好的客製化理由，如果 AI 失敗再退回 raw_summary。
                     custom_reason = personalized_reasons.get(place_id_str, raw_summary)
@@ -587,11 +714,14 @@ class RecommendService:
                     "custom_reason": custom_reason , # ✨ 把 AI 寫好的這句話傳給前端
                     "ui_score": r.get("ui_score", 0) # ✨ 新增：把總分裝進去準備送給 LINE Bot
                 })
-            return {
+            response = {
                 "data": formatted_response,
                 "center_lat": current_search_lat,
                 "center_lng": current_search_lng
             }
+            if explain:
+                response["explain"] = explanations
+            return response
 
         except Exception as e:
             # 🛡️ [維持原版] 完整錯誤軌跡
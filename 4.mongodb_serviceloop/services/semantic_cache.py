@@ -0,0 +1,134 @@
+# app/services/semantic_cache.py
+import os
+import time
+import logging
+import operator
+import threading
+from array import array
+from collections import OrderedDict
+from utils import unit_vector
+
+logger = logging.getLogger("Coffee_Recommender")
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))   # 餘弦相似度門檻
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 600))
+SEMANTIC_CACHE_PER_CELL = int(os.getenv("SEMANTIC_CACHE_PER_CELL", 32))          # 每個地理格最多保留幾個查詢
+SEMANTIC_CACHE_MAX_CELLS = int(os.getenv("SEMANTIC_CACHE_MAX_CELLS", 2000))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 5000))  # 所有地理格合計的查詢數上限
+
+# 融合檢索時按查詢算出的欄位；店家本身的資料從 CafeSnapshot 組回，每筆快取只另外記這幾個
+FUSION_FIELDS = ("vector_score", "macro_score", "micro_score", "matched_review", "match_type")
+
+
+def fusion_extras(candidates: list) -> dict:
+    """place_id -> 這次查詢的融合分數與命中評論"""
+    return {c["place_id"]: {k: c[k] for k in FUSION_FIELDS if k in c} for c in candidates if c.get("place_id")}
+
+
+class SemanticQueryCache:
+    """
+    近似查詢快取：同一個地理格 (含標籤與時段) 內，語意向量夠接近的打字查詢共用同一份融合後的候選名單，
+    省掉地理預篩、兩次向量搜尋與回查 cafes。
+    每筆只存 place_id 與融合分數 (店家資料由 CafeSnapshot 組回)，查詢向量以 float32 存；
+    總筆數受 max_entries 限制，超過時從最久沒用到的地理格開始淘汰。
+    名單建立時排除了當時使用者的黑名單，所以只有「當時排除的店 ⊆ 目前使用者黑名單」才能沿用，
+    否則會漏掉這位使用者本來看得到的店。
+    """
+    def __init__(self, threshold: float = None, ttl_seconds: float = None,
+                 per_cell: int = None, max_cells: int = None, max_entries: int = None):
+        self.threshold = threshold if threshold is not None else SEMANTIC_CACHE_THRESHOLD
+        self.ttl_seconds = ttl_seconds or SEMANTIC_CACHE_TTL_SECONDS
+        self.per_cell = per_cell or SEMANTIC_CACHE_PER_CELL
+        self.max_cells = max_cells or SEMANTIC_CACHE_MAX_CELLS
+        self.max_entries = max_entries or SEMANTIC_CACHE_MAX_ENTRIES
+        self.version = None
+        self._cells = OrderedDict()  # cell_key -> [entry, ...] (新的在後)
+        self._size = 0               # 所有地理格的 entry 總數
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "blocked_by_blacklist": 0, "similarity_sum": 0.0}
+
+    def sync_version(self, version):
+        if version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                if self._cells:
+                    logger.info(f"♻️ [語意快取] 資料版本 {self.version} -> {version}，清空 {len(self._cells)} 格")
+                self._cells.clear()
+                self._size = 0
+                self.version = version
+
+    def lookup(self, cell_key, query_vector, blacklist_ids=None):
+        """回傳 (place_id 清單, 融合欄位 {place_id: {...}}, 相似度, 當時的查詢字串)；沒有夠像的查詢時回傳 None"""
+        unit = unit_vector(query_vector)
+        if not unit:
+            return None
+        banned = set(blacklist_ids or [])
+        now = time.monotonic()
+        best, best_sim, blocked = None, self.threshold, False
+
+        with self._lock:
+            entries = self._cells.get(cell_key)
+            if entries:
+                alive = [e for e in entries if e["expires_at"] > now]
+                self._size -= len(entries) - len(alive)
+                entries[:] = alive
+                for entry in entries:
+                    sim = sum(map(operator.mul, unit, entry["vector"]))
+                    if sim < best_sim:
+                        continue
+                    if not entry["excluded"] <= banned:
+                        blocked = True
+                        continue
+                    best, best_sim = entry, sim
+                self._cells.move_to_end(cell_key)
+
+            if best is None:
+                self.counters["misses"] += 1
+                self.counters["blocked_by_blacklist"] += blocked
+                return None
+            self.counters["hits"] += 1
+            self.counters["similarity_sum"] += best_sim
+        return best["place_ids"], best["extras"], best_sim, best["query"]
+
+    def set(self, cell_key, query_vector, query_text: str, place_ids: list, extras: dict = None, excluded_ids=None):
+        unit = unit_vector(query_vector)
+        if not unit:
+            return
+        entry = {
+            "vector": array("f", unit), "query": query_text, "place_ids": tuple(place_ids), "extras": extras or {},
+            "excluded": frozenset(excluded_ids or []), "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        with self._lock:
+            entries = self._cells.setdefault(cell_key, [])
+            entries.append(entry)
+            self._size += 1
+            if len(entries) > self.per_cell:
+                self._size -= len(entries) - self.per_cell
+                del entries[:-self.per_cell]
+            self._cells.move_to_end(cell_key)
+            while len(self._cells) > self.max_cells:
+                self._size -= len(self._cells.popitem(last=False)[1])
+            # 總量上限：從最久沒用到的地理格逐筆淘汰最舊的查詢
+            while self._size > self.max_entries:
+                oldest_key, oldest = next(iter(self._cells.items()))
+                oldest.pop(0)
+                self._size -= 1
+                if not oldest:
+                    del self._cells[oldest_key]
+
+    def stats(self) -> dict:
+        hits, misses = self.counters["hits"], self.counters["misses"]
+        total = hits + misses
+        return {
+            "threshold": self.threshold,
+            "cells": len(self._cells),
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "avg_hit_similarity": round(self.counters["similarity_sum"] / hits, 4) if hits else None,
+            "blocked_by_blacklist": self.counters["blocked_by_blacklist"],
+            "version": self.version
+        }
@@ -0,0 +1,104 @@
+# app/services/theme_tiles.py
+import os
+import time
+import logging
+import threading
+from typing import Optional
+from geo import geohash_encode, local_distance_meters
+
+logger = logging.getLogger("Coffee_Recommender")
+
+# 服務端只需要這些欄位來完成營業時間檢查與出菜 (刻意排除 1536 維的 vector)
+CAFE_SNAPSHOT_PROJECTION = {"_id": 0, "vector": 0, "field_hashes": 0}
+
+
+class ThemeTileIndex:
+    """
+    情境按鈕專用的記憶體名單：由 stageD_theme_tiles 離線預算每個 geohash 格子的 Top-K，
+    服務端只需查格子 + 黑名單 / 距離 / 營業時間複檢，不需要任何 aggregation。
+    """
+    def __init__(self):
+        self.refresh_seconds = int(os.getenv("THEME_TILE_REFRESH_SECONDS", 600))
+        # 載入失敗時不必等滿整個檢查週期，短暫間隔後就重試 (失敗期間所有情境請求都走較慢的 $geoNear)
+        self.retry_seconds = int(os.getenv("THEME_TILE_RETRY_SECONDS", 30))
+        self.tiles = {}       # cell -> {theme: [place_id, ...]}
+        self.cafes = {}       # place_id -> 店家快照
+        self.precision = None
+        self.radius_m = 3000.0
+        self.top_k = None     # 每格每情境最多保留幾家 (離線建表的 THEME_TILE_TOP_K)
+        self.build_id = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _maybe_refresh(self, db):
+        if time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return
+            try:
+                self._load(db)
+            except Exception:
+                self._next_check = now + self.retry_seconds
+                raise
+            self._next_check = now + self.refresh_seconds
+
+    def _load(self, db):
+        meta = db['pipeline_meta'].find_one({"_id": "theme_tiles"})
+        if not meta or meta.get("build_id") == self.build_id:
+            return
+
+        start = time.time()
+        tiles = {doc["_id"]: doc.get("themes", {}) for doc in db['theme_tiles'].find({"build_id": meta["build_id"]})}
+        place_ids = {pid for themes in tiles.values() for ids in themes.values() for pid in ids}
+        cafes = {doc["place_id"]: doc for doc in db['cafes'].find({"place_id": {"$in": list(place_ids)}}, CAFE_SNAPSHOT_PROJECTION)}
+
+        self.tiles, self.cafes = tiles, cafes
+        self.precision = int(meta.get("precision", 6))
+        self.radius_m = float(meta.get("radius_m", 3000))
+        self.top_k = int(meta["top_k"]) if meta.get("top_k") else None
+        self.build_id = meta["build_id"]
+        logger.info(f"🧩 [情境分格] 載入版本 {self.build_id}: {len(tiles)} 格 / {len(cafes)} 家店，耗時 {time.time() - start:.2f}s")
+
+    def lookup(self, db, theme: str, lat: float, lng: float, blacklist_ids: list = None, limit: int = 30) -> Optional[list]:
+        """
+        回傳依情境分數排序、已通過黑名單與距離複檢的候選名單。
+        尚未建立分格時回傳 None，讓呼叫端退回原本的 $geoNear 聚合。
+        每格名單只有涵蓋範圍內的前 top_k 家：名單被截斷過、又在黑名單 / 距離複檢後湊不滿 limit 時，
+        範圍內可能還有排在 top_k 之後的店，同樣回傳 None 交給聚合，結果才會與即時查詢一致。
+        """
+        try:
+            self._maybe_refresh(db)
+        except Exception as e:
+            logger.warning(f"⚠️ [情境分格] 載入失敗，退回即時聚合: {e}")
+
+        if self.build_id is None:
+            return None
+
+        cell = geohash_encode(lat, lng, self.precision)
+        place_ids = self.tiles.get(cell, {}).get(theme, [])
+        banned = set(blacklist_ids or [])
+
+        results = []
+        for pid in place_ids:
+            if pid in banned:
+                continue
+            cafe = self.cafes.get(pid)
+            if not cafe or not cafe.get("location"):
+                continue
+            c_lng, c_lat = cafe["location"]["coordinates"][:2]
+            dist = local_distance_meters(lat, lng, c_lat, c_lng)
+            if dist > self.radius_m:
+                continue
+            # 淺拷貝一份，避免後續流程寫入欄位時污染共用快照
+            item = dict(cafe)
+            item["dist_meters"] = dist
+            results.append(item)
+            if len(results) >= limit:
+                break
+
+        if len(results) < limit and self.top_k and len(place_ids) >= self.top_k:
+            logger.info(f"🧩 [情境分格] {cell}/{theme} 複檢後只剩 {len(results)} 家 (名單已截斷於 Top-{self.top_k})，退回即時聚合")
+            return None
+        return results
@@ -1,11 +1,19 @@
 # app/services/user_service.py
+import os
 import logging
 from datetime import datetime
 from database import db_client
-from utils import get_taiwan_now
+from utils import get_taiwan_now, unit_vector
 
 logger = logging.getLogger("Coffee_Recommender")
 
+# 偏好向量的衰減係數：每多一次互動，舊的訊號權重乘上這個值 (越小越重視最近的行為)
+PERSONA_VECTOR_DECAY = float(os.getenv("PERSONA_VECTOR_DECAY", 0.9))
+# 各行為對偏好向量的方向：收藏 / 喜歡往店家靠近，確認黑名單往反方向推
+PERSONA_VECTOR_SIGNS = {"KEEP": 1.0, "YES": 1.0, "NO": -1.0}
+# 同一人幾乎同時按了兩次 (例如連點收藏) 時，條件式寫入衝突的重試次數
+PERSONA_VECTOR_MAX_RETRIES = int(os.getenv("PERSONA_VECTOR_MAX_RETRIES", 3))
+
 class UserService:
     
     def get_user_location(self, user_id: str):
@@ -82,6 +90,59 @@ class UserService:
                 upsert=True
             )
 
+    def record_persona_signal(self, user_id: str, action: str, place_id: str):
+        """
+        收藏 / 喜歡 / 黑名單後更新偏好向量；呼叫端以 asyncio.to_thread 在背景執行，
+        1536 維的讀寫不佔用 webhook 的回應時間，失敗也不影響主流程
+        """
+        if action not in PERSONA_VECTOR_SIGNS or not place_id:
+            return
+        try:
+            self.update_persona_vector(user_id, place_id, PERSONA_VECTOR_SIGNS[action])
+        except Exception as e:
+            logger.warning(f"⚠️ [User Service] 偏好向量更新失敗 (不影響主流程): {e}")
+
+    def update_persona_vector(self, user_id: str, place_id: str, sign: float):
+        """
+        以店家的語意向量增量更新使用者偏好向量 (指數衰減加權平均)：
+        mean_new = (decay * weight * mean_old + sign * v) / (decay * weight + 1)
+        寫入時比對讀到的 weight 與更新時間 (compare-and-set)，同一人兩次更新交錯時晚到的那次會重讀重算，
+        不會互相覆蓋掉對方的訊號
+        """
+        db = db_client.get_db()
+        cafe = db['cafes'].find_one({"place_id": place_id}, {"_id": 0, "vector": 1})
+        cafe_vec = unit_vector((cafe or {}).get("vector"))
+        if not cafe_vec:
+            return
+
+        for _ in range(PERSONA_VECTOR_MAX_RETRIES):
+            user = db['users'].find_one(
+                {"user_id": user_id},
+                {"_id": 0, "persona_vector": 1, "persona_vector_weight": 1, "persona_vector_updated_at": 1}
+            )
+            if user is None:  # log_action 已先 upsert 使用者，理論上不會發生
+                return
+            old_vec = user.get("persona_vector")
+            old_weight = user.get("persona_vector_weight", 0.0) if old_vec and len(old_vec) == len(cafe_vec) else 0.0
+
+            decayed = PERSONA_VECTOR_DECAY * old_weight
+            new_weight = decayed + 1.0
+            if decayed:
+                new_vec = [(decayed * o + sign * c) / new_weight for o, c in zip(old_vec, cafe_vec)]
+            else:
+                new_vec = [sign * c for c in cafe_vec]
+
+            # 欄位不存在時比對 None 也會命中 (第一次寫入)
+            result = db['users'].update_one(
+                {"user_id": user_id,
+                 "persona_vector_weight": user.get("persona_vector_weight"),
+                 "persona_vector_updated_at": user.get("persona_vector_updated_at")},
+                {"$set": {"persona_vector": new_vec, "persona_vector_weight": new_weight, "persona_vector_updated_at": get_taiwan_now()}}
+            )
+            if result.matched_count:
+                return
+        logger.warning(f"⚠️ [User Service] 偏好向量連續 {PERSONA_VECTOR_MAX_RETRIES} 次寫入衝突，放棄這次更新: User={user_id}, Place={place_id}")
+
     def check_user_exists(self, user_id: str):
         """檢查是否為老手"""
         db = db_client.get_db()
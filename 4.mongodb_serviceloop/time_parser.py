@@ -0,0 +1,222 @@
+# app/time_parser.py
+import os
+import re
+from datetime import datetime, timedelta
+from constants import STANDARD_TAGS
+
+# 規則解析的信心門檻：達標就直接採用，不再呼叫 Gemini
+TIME_PARSER_MIN_CONFIDENCE = float(os.getenv("TIME_PARSER_MIN_CONFIDENCE", 0.8))
+
+# 時段預設時間 (與 IntentAgent 規則一致：早上 09:00、下午 14:00、晚上 19:00)
+# 單字的「早」「晚」不列入：「好晚了」、「早一點」這類說法規則猜不準，留給 LLM
+PERIOD_DEFAULTS = [
+    ("清晨", 7, "am"), ("早上", 9, "am"), ("上午", 9, "am"),
+    ("中午", 12, "noon"), ("下午", 14, "pm"), ("午後", 14, "pm"), ("傍晚", 17, "pm"),
+    ("晚上", 19, "evening"), ("今晚", 19, "evening"), ("明晚", 19, "evening"), ("明早", 9, "am"),
+    ("半夜", 23, "night"), ("凌晨", 1, "early"),
+]
+# 含時段字但不是時間的名詞 (餐點、問候語)，解析前先拿掉，避免「下午茶」被當成下午 2 點
+PERIOD_NOUNS = ["下午茶", "早午餐", "早餐", "午餐", "晚餐", "宵夜", "早安", "午安", "晚安"]
+RELATIVE_DAYS = [("大後天", 3), ("後天", 2), ("明天", 1), ("明日", 1), ("明晚", 1), ("明早", 1), ("今天", 0), ("今日", 0), ("今晚", 0)]
+NOW_WORDS = ["現在", "馬上", "立刻", "等下就去", "目前"]
+WEEKDAY_MAP = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6,
+               "1": 0, "2": 1, "3": 2, "4": 3, "5": 4, "6": 5, "7": 6}
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_NUM_RE = re.compile(r"[零一二兩三四五六七八九十]+(?=[點时時:：個分小])")
+# 「一點」常是「多一點、早一點」的意思，前面有時段 / 日期或後面接半、整、N 分時才當成 1 點
+_CLOCK_PREFIX_RE = re.compile(r"(?:清晨|早上|上午|中午|下午|午後|傍晚|晚上|今晚|明晚|明早|半夜|凌晨|今天|明天|後天|今日|明日|"
+                              r"(?:週|周|星期|禮拜)[一二三四五六日天])\s*$")
+_CLOCK_SUFFIX_RE = re.compile(r"點\s*(?:半|整|鐘|[0-9零一二三四五六七八九十]+\s*分)")
+_WEEKDAY_RE = re.compile(r"(下下|下個?|這個?|本)?(?:週|周|星期|禮拜)([一二三四五六日天1-7])")
+_MONTH_DAY_RE = re.compile(r"(\d{1,2})\s*(?:月|/)\s*(\d{1,2})\s*(?:日|號)?")
+_DAY_ONLY_RE = re.compile(r"(\d{1,2})\s*(?:號|日)")
+_CLOCK_RE = re.compile(r"(\d{1,2})\s*(?:[:：]\s*(\d{2})|(?:點|時)\s*(半|\d{1,2}\s*分?)?)")
+_HOURS_LATER_RE = re.compile(r"(\d{1,2}|半)\s*(?:個)?\s*(?:小時|鐘頭)(?:以?後)")
+# 處理完之後若還殘留這些字，代表有規則看不懂的時間描述，交給 LLM
+_RESIDUAL_TIME_RE = re.compile(r"[點時早晚午週周號]|星期|禮拜|月|凌晨|半夜|等等|待會|晚點|之後|以後|前")
+_FULLWIDTH = str.maketrans("０１２３４５６７８９：", "0123456789:")
+
+
+def _cn_to_int(token: str) -> int:
+    """支援「三」、「十」、「十二」、「二十」等 0~99 的中文數字"""
+    if "十" in token:
+        tens, _, ones = token.partition("十")
+        return (_CN_DIGITS.get(tens, 1) if tens else 1) * 10 + (_CN_DIGITS.get(ones, 0) if ones else 0)
+    value = 0
+    for ch in token:
+        value = value * 10 + _CN_DIGITS.get(ch, 0)
+    return value
+
+
+def _normalize(text: str) -> str:
+    text = text.translate(_FULLWIDTH)
+    # 先移除會誤觸時間字的標籤 (例如「不限時」、「深夜」)
+    for tag in sorted(STANDARD_TAGS, key=len, reverse=True):
+        text = text.replace(tag, " ")
+    for noun in PERIOD_NOUNS:
+        text = text.replace(noun, " ")
+
+    def to_digits(m):
+        if m.group(0) == "一" and text[m.end():m.end() + 1] == "點" \
+                and not _CLOCK_PREFIX_RE.search(text, 0, m.start()) and not _CLOCK_SUFFIX_RE.match(text, m.end()):
+            return m.group(0)
+        return str(_cn_to_int(m.group(0)))
+
+    return _CN_NUM_RE.sub(to_digits, text)
+
+
+def parse_time_expression(text: str, now: datetime) -> dict:
+    """
+    規則式中文時間解析：回傳與 IntentAgent 相同的欄位，外加 confidence (0~1)。
+    confidence 不足時由呼叫端改問 LLM。
+    """
+    result = {"has_time": False, "target_time": None, "time_flexibility": "", "confidence": 0.0}
+    if not text:
+        result["confidence"] = 1.0
+        return result
+
+    s = _normalize(text)
+    matched = []
+
+    def consume(pattern_text):
+        nonlocal s
+        matched.append(pattern_text)
+        s = s.replace(pattern_text, " ", 1)
+
+    # 0. 模糊的相對說法 (晚點、等等、待會) 規則無法給出時間點
+    if any(w in s for w in ("晚點", "等等", "待會", "等一下")):
+        result["confidence"] = 0.2
+        return result
+
+    # 1. 「現在」類：不指定時間 = 找現在有開的
+    for w in NOW_WORDS:
+        if w in s:
+            consume(w)
+            result["confidence"] = 0.95
+            if _RESIDUAL_TIME_RE.search(s) or _CLOCK_RE.search(s):
+                result["confidence"] = 0.3
+            return result
+
+    # 2. 「N 小時後」
+    m = _HOURS_LATER_RE.search(s)
+    if m:
+        consume(m.group(0))
+        hours = 0.5 if m.group(1) == "半" else int(m.group(1))
+        target = now + timedelta(hours=hours)
+        result.update(has_time=True, target_time=target.strftime("%Y-%m-%d %H:%M"),
+                      time_flexibility=m.group(0), confidence=0.3 if _RESIDUAL_TIME_RE.search(s) else 0.9)
+        return result
+
+    # 3. 日期：星期 / 月日 / 相對日
+    day = None
+    m = _WEEKDAY_RE.search(s)
+    if m:
+        consume(m.group(0))
+        prefix, wd = m.group(1) or "", WEEKDAY_MAP[m.group(2)]
+        monday = now.date() - timedelta(days=now.weekday())
+        if prefix.startswith("下下"):
+            day = monday + timedelta(days=14 + wd)
+        elif prefix.startswith("下"):
+            day = monday + timedelta(days=7 + wd)
+        elif prefix:
+            day = monday + timedelta(days=wd)
+        else:
+            # 單講「週五」：今天或接下來最近的那個週五
+            day = now.date() + timedelta(days=(wd - now.weekday()) % 7)
+    else:
+        m = _MONTH_DAY_RE.search(s) or _DAY_ONLY_RE.search(s)
+        if m:
+            try:
+                if len(m.groups()) == 2:
+                    day = now.replace(month=int(m.group(1)), day=int(m.group(2))).date()
+                    if day < now.date():
+                        day = day.replace(year=day.year + 1)
+                else:
+                    day = now.replace(day=int(m.group(1))).date()
+                    if day < now.date():
+                        day = (now.replace(day=1) + timedelta(days=32)).replace(day=int(m.group(1))).date()
+            except ValueError:
+                return result
+            consume(m.group(0))
+
+    for word, offset in RELATIVE_DAYS:
+        if word in s:
+            # 「明晚」、「明早」、「今晚」同時代表時段，留給下方時段解析時再吃掉
+            if word not in ("明晚", "明早", "今晚"):
+                consume(word)
+            if day is None:
+                day = (now + timedelta(days=offset)).date()
+            break
+    day_explicit = day is not None
+
+    # 4. 時段與鐘點
+    period = None
+    for word, default_hour, kind in PERIOD_DEFAULTS:
+        if word in s:
+            consume(word)
+            period = (default_hour, kind)
+            break
+
+    hour = minute = None
+    m = _CLOCK_RE.search(s)
+    if m:
+        consume(m.group(0))
+        hour = int(m.group(1))
+        if m.group(2):
+            minute = int(m.group(2))
+        elif m.group(3):
+            minute = 30 if m.group(3) == "半" else int(re.sub(r"\D", "", m.group(3)) or 0)
+        else:
+            minute = 0
+        if hour > 24 or minute > 59:
+            return result
+
+    if hour is None and period is None and day is None:
+        # 沒有任何時間描述：若也沒有殘留的時間字，代表使用者沒指定時間
+        result["confidence"] = 0.3 if _RESIDUAL_TIME_RE.search(s) else 0.95
+        return result
+
+    confidence = 0.9
+    next_day = False
+    if hour is None:
+        if period is None:
+            # 只有日期 (例如「明天」)：不知道幾點，交給 LLM
+            hour, minute, confidence = 14, 0, 0.5
+        else:
+            hour, minute = period[0], 0
+            confidence = 0.85
+    else:
+        kind = period[1] if period else None
+        if kind in ("pm", "evening") and hour < 12:
+            hour += 12
+        elif kind == "evening" and hour == 12:
+            # 「晚上 12 點」是當晚結束的午夜，也就是隔天 00:00
+            hour, next_day = 0, True
+        elif kind == "night":
+            # 「半夜 11 點」= 23:00；「半夜 2 點」= 隔天 02:00
+            hour = hour + 12 if 6 <= hour < 12 else (0 if hour == 12 else hour)
+        elif kind == "noon" and hour < 5:
+            hour += 12
+        elif kind is None and 1 <= hour <= 7:
+            # 沒講上下午的 1~7 點，咖啡廳情境幾乎都是下午
+            hour += 12
+            confidence = 0.8
+        if hour == 24:
+            hour = 0
+
+    target = datetime.combine(day or now.date(), datetime.min.time()).replace(hour=hour, minute=minute)
+    if next_day:
+        target += timedelta(days=1)
+    if period and period[1] == "early" and not day_explicit and target < now:
+        target += timedelta(days=1)
+    if not day_explicit and target < now - timedelta(minutes=30):
+        # 今天已經過了的時間點 -> 視為明天
+        target += timedelta(days=1)
+
+    if _RESIDUAL_TIME_RE.search(s):
+        confidence = min(confidence, 0.3)
+
+    result.update(has_time=True, target_time=target.strftime("%Y-%m-%d %H:%M"),
+                  time_flexibility="".join(matched), confidence=confidence)
+    return result